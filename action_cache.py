@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+def normalize_request(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def url_pattern(url: str) -> str:
+    """scheme://host/path with query and fragment dropped and numeric path segments generalized."""
+    parts = urlsplit(url)
+    path = re.sub(r"/\d+(?=/|$)", "/:n", parts.path.rstrip("/"))
+    return f"{parts.scheme}://{parts.netloc}{path}"
+
+
+def _history_tail(command_history: list, size: int) -> list:
+    tail = []
+    for entry in command_history[-size:]:
+        command = entry.get("command", {})
+        outcome = "error" if "error occurred" in str(entry.get("result", "")).lower() else "ok"
+        tail.append([command.get("action"), command.get("element_id"), command.get("text"), command.get("url"), outcome])
+    return tail
+
+
+@contextmanager
+def _locked(path: str):
+    """Holds an exclusive lock on `path`.lock, across processes (the workers share the cache)."""
+    with open(f"{path}.lock", "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class ActionCache:
+    """On-disk cache of LLM actions that worked, keyed by the state they were chosen in.
+
+    The key hashes the normalized request, the URL pattern, the page structure (the
+    element_id -> selector map) and the last few commands, so a hit means the same
+    task is at the same point on a structurally identical page. Entries expire after
+    `ttl_s` seconds and the least recently used ones are dropped past `max_entries`.
+
+    Several processes (one per worker) can use the same file. Each save merges, under a
+    file lock, what the others saved since, so no worker's entries are lost. Invalidated
+    keys are kept in the file with the time they were removed, so another worker's
+    older copy of the entry is dropped at its next save instead of written back.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1000, ttl_s: float = 7 * 24 * 3600, history_size: int = 3):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.history_size = history_size
+        self.entries = OrderedDict()
+        # Invalidated keys with when, so a merge doesn't bring their entries back
+        self.removed = {}
+        self.stats = {"lookups": 0, "hits": 0, "invalidated": 0}
+        self.load()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return OrderedDict(), {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return OrderedDict(), {}
+        return OrderedDict(data.get("entries", [])), data.get("removed", {})
+
+    def load(self):
+        self.entries, self.removed = self._read()
+
+    def save(self):
+        try:
+            with _locked(self.path):
+                merged, removed = self._merge(*self._read())
+                # Write-then-rename through a temp file of this process's own, so a crash
+                # never leaves a truncated cache behind and concurrent saves can't collide
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "w", encoding="utf-8") as f:
+                        json.dump({"entries": list(merged.items()), "removed": removed}, f)
+                    os.replace(tmp_path, self.path)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+        except OSError as e:
+            # The cache only saves LLM calls, a task must not fail over it
+            print(f"⚠️ Could not save the action cache: {e}")
+            return
+        self.entries = merged
+        self.removed = removed
+
+    def _merge(self, saved: OrderedDict, saved_removed: dict):
+        # The newer entry of a key wins; this process's entries go last, as the most recently used.
+        # An entry created before its key was invalidated, here or by another worker, is dropped.
+        now = time.time()
+        removed = dict(saved_removed)
+        for key, at in self.removed.items():
+            removed[key] = max(at, removed.get(key, at))
+        # Past the ttl every entry created before the removal has expired anyway
+        removed = {key: at for key, at in removed.items() if now - at <= self.ttl_s}
+
+        def live(key, entry):
+            return now - entry["created"] <= self.ttl_s and entry["created"] > removed.get(key, float("-inf"))
+
+        merged = OrderedDict((key, entry) for key, entry in saved.items() if live(key, entry))
+        for key, entry in self.entries.items():
+            if not live(key, entry) or (key in merged and merged[key]["created"] > entry["created"]):
+                continue
+            merged.pop(key, None)
+            merged[key] = entry
+        while len(merged) > self.max_entries:
+            merged.popitem(last=False)
+        return merged, removed
+
+    def key(self, user_request: str, url: str, selector_map: dict, command_history: list) -> str:
+        state = {
+            "request": normalize_request(user_request),
+            "url": url_pattern(url),
+            "structure": sorted(selector_map.items()),
+            "history": _history_tail(command_history, self.history_size),
+        }
+        return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str, selector_map: dict):
+        """Returns the cached action list if present, fresh and every element_id still resolves."""
+        self.stats["lookups"] += 1
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        if time.time() - entry["created"] > self.ttl_s:
+            del self.entries[key]
+            return None
+
+        for action in entry["actions"]:
+            if "element_id" in action and action["element_id"] not in selector_map:
+                self.invalidate(key)
+                return None
+
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry["actions"]
+
+    def put(self, key: str, actions: list):
+        self.entries[key] = {"actions": actions, "created": time.time()}
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.save()
+
+    def invalidate(self, key: str):
+        if self.entries.pop(key, None) is not None:
+            self.removed[key] = time.time()
+            self.stats["invalidated"] += 1
+            self.save()
+
+    def hit_rate(self) -> float:
+        return self.stats["hits"] / self.stats["lookups"] if self.stats["lookups"] else 0.0
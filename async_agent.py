@@ -0,0 +1,451 @@
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import keyboard
+from openai import AsyncOpenAI
+
+import llm_handler
+from llm_command_parser import LLMCommandParser
+from prompt_budget import PromptBudget
+from prompt_builder import UsageStats
+from action_cache import ActionCache
+from stream_parser import ActionStreamParser
+from tab_manager import TabManager
+from model_router import FAST
+import tracing
+
+
+# llm_handler has already loaded .env on import
+async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+async def query_llm_async(prompt, conversation=None, tier=None):
+    with tracing.span("llm", **llm_handler.llm_span_attrs(tier)) as span:
+        response = await async_client.chat.completions.create(
+            model=llm_handler.model_for(tier),
+            messages=llm_handler._messages(prompt, conversation),
+            temperature=0,
+        )
+        llm_handler._record_usage(span, response.usage)
+        return response.choices[0].message.content.strip()
+
+
+async def stream_llm_async(prompt, conversation=None, tier=None):
+    span = tracing.start_span("llm", activate=False, **llm_handler.llm_span_attrs(tier, stream=True))
+    try:
+        stream = await async_client.chat.completions.create(
+            model=llm_handler.model_for(tier),
+            messages=llm_handler._messages(prompt, conversation),
+            temperature=0,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in stream:
+            if chunk.usage is not None:
+                llm_handler._record_usage(span, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        if span is not None:
+            span.end()
+
+
+class AsyncAgentSession:
+    """One browser (or one tab of a shared browser) driven from the event loop.
+
+    WebDriver is not thread-safe, so every browser call of a session runs on the
+    session's own single-thread executor; the event loop is free to wait on the
+    LLM for this session while other sessions use their browsers. A session given a
+    `host` works in its own tab of the host's browser instead, on the host's thread,
+    and switches to that tab before each call (see tab_manager.TabManager). Such a
+    session waits for its page loads with one browser call per probe (see
+    `wait_ready`), so the other tabs' calls run in between.
+    """
+
+    def __init__(self, session_id: int, usr_dir: str, host: "AsyncAgentSession" = None):
+        self.session_id = session_id
+        self.usr_dir = usr_dir
+        self.host = host
+        if host is not None:
+            self.executor = host.executor
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"browser-{session_id}")
+        self.agent = None
+        self.pool = None
+        self.tabs = None
+
+    async def call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        if self.tabs is not None:
+            fn = functools.partial(self._in_tab, fn)
+        # Run in a copy of the caller's context so browser spans nest under the current step
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, fn, *args, **kwargs))
+
+    def _in_tab(self, fn, *args, **kwargs):
+        self.tabs.activate(self.agent)
+        return fn(*args, **kwargs)
+
+    def _make_agent(self, driver=None):
+        return LLMCommandParser(
+            url=llm_handler.BROWSER_START_URL,
+            usr_dir=self.usr_dir,
+            dom_format=llm_handler.DOM_FORMAT,
+            extraction=llm_handler.DOM_EXTRACTION,
+            diff=llm_handler.DOM_DIFF,
+            ready_timeout=llm_handler.READY_TIMEOUT,
+            driver=driver,
+            headless=llm_handler.HEADLESS,
+            blocked_urls=llm_handler.BLOCKED_URLS,
+            pruner=llm_handler.make_pruner(),
+            stable_ids=llm_handler.STABLE_IDS,
+            html_parser=llm_handler.HTML_PARSER,
+            ready_max_inflight=llm_handler.READY_MAX_INFLIGHT,
+            ready_request_max_age_ms=llm_handler.READY_REQUEST_MAX_AGE_MS,
+        )
+
+    async def start(self, tabs: int = 1):
+        """Starts the browser, or with a host, opens this session's tab in the host's browser.
+
+        `tabs` > 1 prepares the browser to be shared; a pool's browser can be swapped
+        out between tasks, so shared browsers are never pooled.
+        """
+        if self.host is not None:
+            self.agent = await self.call(self.host.tabs.open, self._make_agent)
+            self.tabs = self.host.tabs
+            await self.call(self.agent._prepare_tab)
+        else:
+            if tabs <= 1:
+                self.pool = await self.call(llm_handler.make_browser_pool, self.usr_dir)
+            driver = await self.call(self.pool.acquire) if self.pool is not None else None
+            self.agent = await self.call(self._make_agent, driver)
+            if tabs > 1:
+                self.tabs = TabManager(self.agent.driver)
+                self.tabs.claim(self.agent)
+        self.agent.record_locators = bool(llm_handler.REPLAY_DIR)
+
+    async def close(self):
+        if self.host is not None:
+            # The browser and the thread belong to the host
+            return
+        if self.pool is not None:
+            await self.call(self.pool.close)
+        elif self.agent is not None:
+            await self.call(self.agent.close)
+        self.executor.shutdown(wait=False)
+
+    async def wait_ready(self) -> bool:
+        """PageReadiness.wait, sleeping on the event loop between probes instead of in the browser thread."""
+        readiness = self.agent.readiness
+        deadline = time.monotonic() + readiness.timeout
+        with tracing.span("page_ready") as span:
+            ready = await self.call(readiness.probe)
+            while not ready and time.monotonic() < deadline:
+                await asyncio.sleep(readiness.poll_interval)
+                ready = await self.call(readiness.probe)
+            if span is not None:
+                span.set(ready=ready)
+            return ready
+
+    async def execute_batch(self, actions):
+        if self.tabs is None:
+            return await self.call(self.agent.execute_batch, actions)
+
+        # A shared browser: the batch stops after each page load, which is waited for here
+        results = []
+        while True:
+            batch = await self.call(self.agent.execute_batch, actions[len(results):], bool(results), True)
+            results += batch
+            await self.wait_ready()
+            if not batch or len(results) >= len(actions):
+                break
+        tab = self.agent.tab
+        await self.call(self.agent._settle, 0)
+        if self.agent.tab != tab:
+            # The page opened a tab, which replaced this task's one
+            await self.wait_ready()
+            await self.call(self.agent._settle, 0)
+        return results
+
+    async def _respond_streaming(self, prompt, conversation, dispatch_state, tier=None, command_history=None):
+        # execute_batch runs in the browser thread and pulls actions from this queue
+        # while the rest of the reply is still being generated
+        actions = queue.Queue()
+
+        def pending():
+            while True:
+                action = actions.get()
+                if action is None:
+                    return
+                yield action
+
+        batch = asyncio.ensure_future(self.call(self.agent.execute_batch, pending()))
+        parser = ActionStreamParser()
+        started = time.perf_counter()
+        try:
+            async for chunk in stream_llm_async(prompt, conversation, tier):
+                for action in parser.feed(chunk):
+                    if dispatch_state["done"]:
+                        continue
+                    if action.get("action", "").lower() == "done":
+                        dispatch_state["done"] = True
+                        actions.put(None)
+                        continue
+                    actions.put(action)
+        finally:
+            if not dispatch_state["done"]:
+                actions.put(None)
+
+        output = parser.text.strip()
+        error = None
+        try:
+            parser.close()
+        except Exception as e:
+            error = e
+        if tier is not None:
+            llm_handler.router.record_reply(tier, (time.perf_counter() - started) * 1000, rejected=error is not None)
+        return await batch, output, error, tier
+
+    async def _respond(self, prompt, conversation, dispatch_state, tier=None, command_history=None):
+        # A rejected fast reply is asked again of the strong model (see llm_handler.query_routed)
+        while True:
+            started = time.perf_counter()
+            output = (await query_llm_async(prompt, conversation, tier)).replace("```json", "").replace("```", "").strip()
+            actions, error, problem = llm_handler.review_reply(
+                output, tier, (time.perf_counter() - started) * 1000, self.agent.selector_map, command_history or []
+            )
+            next_tier = llm_handler.escalate_tier(tier, problem)
+            if next_tier is None:
+                break
+            tier = next_tier
+        if error is not None:
+            return [], output, error, tier
+        return await self._dispatch(actions, dispatch_state), output, None, tier
+
+    async def _dispatch(self, actions, dispatch_state):
+        pending = []
+        for action in actions:
+            if action.get("action", "").lower() == "done":
+                dispatch_state["done"] = True
+                break
+            pending.append(action)
+
+        return await self.execute_batch(pending) if pending else []
+
+    async def run_task(self, task: str, budget: PromptBudget = None, cache: ActionCache = None, on_step=None) -> dict:
+        """Async counterpart of llm_handler.run_task, returning the same result shape."""
+        print(f"\n🚀 [session {self.session_id}] Starting task: {task}")
+        started = time.perf_counter()
+        error_counter = 0
+        status = "done"
+        steps = []
+        command_history = []
+        conversation = []
+        reported_commands = 0
+        self.agent.prompt_history.append(task)
+        await self.call(self.agent.reset_snapshot)
+        usage = UsageStats()
+        usage_token = llm_handler.task_usage.set(usage)
+        task_span = tracing.start_span("task", task=task, session=self.session_id)
+        step_span = None
+        # Set when a streamed fast reply broke off, so the next step goes to the strong model
+        escalate = False
+
+        # The first snapshot is prefetched too, so every step starts from an awaited future
+        next_prompt = asyncio.ensure_future(
+            self.call(llm_handler.prepare_prompt, self.agent, task, command_history, reported_commands, budget)
+        )
+
+        while True:
+            if self.agent.stop_requested:
+                print(f"⏹️ [session {self.session_id}] Task interrupted by hotkey.")
+                status = "stopped"
+                break
+
+            if error_counter >= llm_handler.ERROR_THRESHOLD:
+                print(f"[session {self.session_id}] Consecutive errors exceeded threshold, stopping task!")
+                status = "failed"
+                break
+
+            step_started = time.perf_counter()
+            step_span = tracing.start_span("step", index=len(steps))
+            prompt, is_delta = await next_prompt
+            if not is_delta:
+                conversation = []
+            reported_commands = len(command_history)
+            snapshot_done = time.perf_counter()
+
+            cache_key = None
+            cached_actions = None
+            if cache is not None:
+                url = await self.call(lambda: self.agent.driver.current_url)
+                cache_key = cache.key(task, url, self.agent.selector_map, command_history)
+                cached_actions = cache.get(cache_key, self.agent.selector_map)
+
+            dispatch_state = {"done": False}
+            tier = None
+            if cached_actions is not None:
+                print(f"♻️ [session {self.session_id}] Replaying cached actions")
+                batch = await self._dispatch(cached_actions, dispatch_state)
+                llm_output, parse_error = json.dumps(cached_actions), None
+            else:
+                tier = llm_handler.route_step(self.agent, command_history, error_counter, escalate)
+                # A streamed batch holds the browser thread until the reply ends, which
+                # would stall the other tabs of a shared browser
+                streaming = llm_handler.STREAM_RESPONSES and self.tabs is None
+                respond = self._respond_streaming if streaming else self._respond
+                batch, llm_output, parse_error, tier = await respond(prompt, conversation, dispatch_state, tier, command_history)
+            escalate = False
+
+            conversation += [
+                {"role": "user", "content": prompt},
+                {"role": "assistant", "content": llm_output},
+            ]
+            error_counter = llm_handler.record_batch(batch, command_history, error_counter)
+            if tier is not None:
+                llm_handler.router.record_step(tier, batch)
+
+            if parse_error is not None and tier == FAST:
+                # Only a streamed reply gets here on the fast tier; what arrived has run
+                print(f"\n⤴️ [session {self.session_id}] The streamed reply broke off ({parse_error}), escalating the next step")
+                escalate = True
+            elif parse_error is not None:
+                print(f"\n❌ [session {self.session_id}] Failed to parse LLM output: {parse_error}")
+                print(f"🧾 Raw output:\n{llm_output}")
+                status = "failed"
+                break
+
+            if cache is not None and parse_error is None:
+                failed = any("error occurred" in entry["result"].lower() for entry in batch)
+                if cached_actions is not None:
+                    if failed:
+                        cache.invalidate(cache_key)
+                elif not failed and (batch or dispatch_state["done"]):
+                    actions = json.loads(llm_output.replace("```json", "").replace("```", ""))
+                    cache.put(cache_key, actions if isinstance(actions, list) else [actions])
+
+            steps.append({
+                "snapshot_ms": round((snapshot_done - step_started) * 1000),
+                "respond_ms": round((time.perf_counter() - snapshot_done) * 1000),
+                "total_ms": round((time.perf_counter() - step_started) * 1000),
+            })
+            if tier is not None:
+                steps[-1]["tier"] = tier
+            if step_span is not None:
+                step_span.set(cached=cached_actions is not None, actions=len(batch))
+                step_span.end()
+            if on_step is not None:
+                on_step(llm_handler.step_event(len(steps) - 1, batch, steps[-1]))
+            if dispatch_state["done"]:
+                break
+
+            # Start the next snapshot right away; the loop checks above run meanwhile
+            next_prompt = asyncio.ensure_future(
+                self.call(llm_handler.prepare_prompt, self.agent, task, command_history, reported_commands, budget)
+            )
+
+        if not next_prompt.done():
+            next_prompt.cancel()
+
+        if status == "done":
+            llm_handler._play_sound(llm_handler.sucess_sound)
+            print(f"✅ [session {self.session_id}] {task} — Task Completed!\n")
+        llm_handler.task_usage.reset(usage_token)
+        if usage.prompt_tokens:
+            print(f"🧊 Prompt cache: {usage.report()}")
+        if cache is not None:
+            print(f"♻️ Action cache hit rate {cache.hit_rate():.0%} ({cache.stats['hits']}/{cache.stats['lookups']} steps)")
+        if llm_handler.router is not None:
+            print(f"🧭 Model routing: {llm_handler.router.report()}")
+        if step_span is not None:
+            step_span.end()
+        if task_span is not None:
+            task_span.set(status=status, steps=len(steps), prompt_tokens=usage.prompt_tokens, cached_tokens=usage.cached_tokens)
+            task_span.end()
+
+        return llm_handler.task_result(status, command_history, started, steps, usage)
+
+
+async def _session_loop(session: AsyncAgentSession, task_queue, result_queue, budget, cache):
+    loop = asyncio.get_running_loop()
+    while True:
+        # Blocking multiprocessing queue, read from the default executor
+        task = await loop.run_in_executor(None, task_queue.get)
+
+        if isinstance(task, str) and task.lower() == "exit":
+            # Let the other sessions see the sentinel as well
+            task_queue.put("exit")
+            break
+
+        task_id = task.get("id") if isinstance(task, dict) else None
+        text = task["task"] if isinstance(task, dict) else task
+        # Only this session's flag: another session's task may have just been stopped
+        session.agent.stop_requested = False
+
+        on_step = None
+        if result_queue is not None and task_id is not None:
+            on_step = functools.partial(llm_handler.report_progress, result_queue, task_id)
+
+        try:
+            if session.tabs is None:
+                # A shared browser is neither swapped nor reset between tasks, that would
+                # pull it from under the other tabs
+                await session.call(llm_handler.acquire_browser, session.agent, session.pool)
+            start_url = await session.call(lambda: session.agent.driver.current_url)
+            if isinstance(task, dict) and task.get("replay", False):
+                # Replays barely touch the LLM, the browser thread runs them end to end
+                result = await session.call(llm_handler.replay_task, session.agent, text, budget, cache, on_step)
+            else:
+                result = await session.run_task(text, budget, cache, on_step)
+            llm_handler.record_replay(text, start_url, result)
+            if session.tabs is None:
+                await session.call(llm_handler.release_browser, session.agent, session.pool)
+        except Exception as e:
+            print(f"\n❌ [session {session.session_id}] Task crashed: {e}")
+            result = {"status": "error", "command_history": [], "duration_s": 0, "steps": [], "error": str(e)}
+        # Posting to a collector blocks, keep it off the event loop
+        await loop.run_in_executor(None, tracing.tracer.flush)
+
+        if result_queue is not None:
+            result_queue.put({"id": task_id, "task": text, "worker": session.session_id, **result})
+
+
+async def run_sessions(task_queue, result_queue=None, sessions: int = 1, tabs: int = 1):
+    """Runs `sessions` browsers with `tabs` task sessions (one per tab) in each."""
+    budget = PromptBudget(llm_handler.PROMPT_TOKEN_BUDGET) if llm_handler.PROMPT_TOKEN_BUDGET > 0 else None
+    # Shared by all sessions; they run on one event loop so cache access never interleaves
+    cache = ActionCache(llm_handler.ACTION_CACHE_PATH) if llm_handler.ACTION_CACHE_PATH else None
+    hosts = []
+    for browser_id in range(sessions):
+        usr_dir = llm_handler.CHROME_USER_DATA
+        if sessions > 1:
+            usr_dir = f"{usr_dir}-worker{browser_id}"
+        hosts.append(AsyncAgentSession(browser_id * tabs, usr_dir))
+    guests = [
+        AsyncAgentSession(host.session_id + tab, host.usr_dir, host=host)
+        for host in hosts for tab in range(1, tabs)
+    ]
+    pool = hosts + guests
+
+    try:
+        await asyncio.gather(*(host.start(tabs) for host in hosts))
+        # Tabs of one browser open one after another on its thread anyway
+        await asyncio.gather(*(guest.start() for guest in guests))
+        keyboard.add_hotkey("esc", lambda: llm_handler.stop_task(*(session.agent for session in pool)))
+        await asyncio.gather(*(_session_loop(session, task_queue, result_queue, budget, cache) for session in pool))
+    finally:
+        await asyncio.gather(*(session.close() for session in pool), return_exceptions=True)
+
+
+def main(task_queue, result_queue=None, sessions: int = 1, tabs: int = None):
+    """Process entry point: drives `sessions` browsers from a single event loop."""
+    try:
+        asyncio.run(run_sessions(task_queue, result_queue, sessions, tabs or llm_handler.TABS_PER_BROWSER))
+    except KeyboardInterrupt:
+        print("\n👋 Exiting automation.")
@@ -0,0 +1,836 @@
+import argparse
+import functools
+import glob
+import http.server
+import io
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+
+from bs4 import BeautifulSoup, Tag
+import html_to_json
+
+from dom_compactor import DOMCompactor, ESSENTIAL_CONTENT_TAGS, ESSENTIAL_ATTRIBUTES
+from dom_serializer import DOMSerializer, DOM_FORMATS
+from dom_extractor import BrowserDOMExtractor
+from html_parsers import DEFAULT_HTML_PARSER, available_parsers, parse_html
+from stream_parser import ActionStreamParser
+from stub_llm_server import StubLLMServer
+from browser_pool import browser_memory_mb, launch_browser
+from lightweight import blocked_patterns
+from prompt_budget import estimate_tokens
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "pages")
+SITE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "sites")
+
+
+# Reference copy of the original three-pass parser, kept here as the baseline.
+# Both parsers stop before html_to_json so the timings isolate the compaction stage.
+def legacy_page_source_parser(html: str):
+    soup = BeautifulSoup(html, "html.parser")
+    selector_map = {}
+    element_counter = [0]
+
+    def prune_element(el: Tag):
+        for child in list(el.contents):
+            if isinstance(child, Tag):
+                if child.name not in ESSENTIAL_CONTENT_TAGS:
+                    child.decompose()
+                else:
+                    prune_element(child)
+        el.attrs = {k: v for k, v in el.attrs.items() if k in ESSENTIAL_ATTRIBUTES}
+
+    for tag in soup(["script", "style"]):
+        tag.decompose()
+
+    prune_element(soup.body)
+
+    def build_selector(el: Tag):
+        parts = []
+        while el and el.name != '[document]':
+            part = el.name
+            if el.has_attr('id'):
+                part += f"#{el['id']}"
+            elif el.has_attr('class'):
+                classes = [cls for cls in el['class'] if cls.strip()]
+                if classes:
+                    part += '.' + '.'.join(classes)
+            else:
+                if el.parent:
+                    siblings = [sib for sib in el.parent.find_all(el.name, recursive=False)]
+                    index = siblings.index(el) + 1
+                    part += f":nth-of-type({index})"
+            parts.insert(0, part)
+            el = el.parent
+        return ' > '.join(parts)
+
+    def assign_element_ids(el: Tag):
+        selector = build_selector(el)
+        el['_element_id'] = element_counter[0]
+        selector_map[element_counter[0]] = selector
+        element_counter[0] += 1
+
+        if el.parent:
+            all_element_siblings = [c for c in el.parent.contents if isinstance(c, Tag)]
+            el['idx'] = str(all_element_siblings.index(el) + 1)
+
+        for child in el.children:
+            if isinstance(child, Tag):
+                assign_element_ids(child)
+
+    assign_element_ids(soup.body)
+
+    return str(soup.body), selector_map
+
+
+def compactor_page_source_parser(html: str):
+    soup = BeautifulSoup(html, "html.parser")
+    selector_map = DOMCompactor().compact(soup.body)
+    return str(soup.body), selector_map
+
+
+def synthetic_page(n_nodes=20000, seed=0):
+    """Builds a large, deeply nested page, a stress case on top of the fixture pages (--synthetic)."""
+    rng = random.Random(seed)
+    tags = ["div", "span", "a", "li", "p", "button", "section", "ul", "input", "svg"]
+    out = ["<html><head><title>synthetic</title><script>var x = 1;</script></head><body>"]
+    open_tags = []
+    for i in range(n_nodes):
+        if open_tags and (rng.random() < 0.35 or len(open_tags) > 30):
+            out.append(f"</{open_tags.pop()}>")
+        tag = rng.choice(tags)
+        attrs = ""
+        roll = rng.random()
+        if roll < 0.2:
+            attrs = f' id="n{i}"'
+        elif roll < 0.6:
+            attrs = f' class="c{i % 13} flex gap-{i % 5}" data-track="{i}"'
+        if tag == "input":
+            out.append(f'<input type="text" name="f{i}"{attrs}>')
+            continue
+        if tag == "svg":
+            out.append(f'<svg{attrs}><path d="M0 0L{i} {i}"></path></svg>')
+            continue
+        out.append(f"<{tag}{attrs}>item {i}")
+        open_tags.append(tag)
+    out.extend(f"</{t}>" for t in reversed(open_tags))
+    out.append("</body></html>")
+    return "".join(out)
+
+
+def load_pages(fixture_dir=FIXTURE_DIR, synthetic=False):
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(fixture_dir, "*.html"))):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            pages[os.path.basename(path)] = f.read()
+    if not pages:
+        # Timings of some other page set would not compare with earlier runs
+        raise FileNotFoundError(f"No *.html pages in {fixture_dir}")
+    if synthetic:
+        pages["synthetic-20k.html"] = synthetic_page()
+    return pages
+
+
+def measure(fn, data, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn(data)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"median_ms": statistics.median(timings) * 1000, "peak_mb": peak / 1024 / 1024}
+
+
+def bench_parser(pages, rounds):
+    results = {}
+    for name, html in pages.items():
+        legacy_output = legacy_page_source_parser(html)
+        compactor_output = compactor_page_source_parser(html)
+        # Selectors differ by design (see selector_synthesizer), the pruned page must not
+        if compactor_output[0] != legacy_output[0]:
+            print(f"⚠️ {name}: compactor output differs from the legacy parser")
+
+        results[name] = {
+            "bytes": len(html.encode()),
+            "elements": len(legacy_output[1]),
+            "legacy": measure(legacy_page_source_parser, html, rounds),
+            "compactor": measure(compactor_page_source_parser, html, rounds),
+        }
+        row = results[name]
+        row["legacy"]["mean_selector_chars"] = statistics.mean(map(len, legacy_output[1].values()))
+        row["compactor"]["mean_selector_chars"] = statistics.mean(map(len, compactor_output[1].values()))
+        print(
+            f"{name}: {row['elements']} elements | "
+            f"legacy {row['legacy']['median_ms']:.1f} ms / {row['legacy']['peak_mb']:.1f} MB / "
+            f"{row['legacy']['mean_selector_chars']:.0f} chars per selector | "
+            f"compactor {row['compactor']['median_ms']:.1f} ms / {row['compactor']['peak_mb']:.1f} MB / "
+            f"{row['compactor']['mean_selector_chars']:.0f} chars per selector"
+        )
+    return results
+
+
+def compacted_soup(html: str):
+    soup = BeautifulSoup(html, "html.parser")
+    DOMCompactor().compact(soup.body)
+    return soup
+
+
+def html_to_json_serializer(soup):
+    # The original str(soup) -> html_to_json -> json.dumps round trip
+    return json.dumps(html_to_json.convert(str(soup.body)))
+
+
+def bench_serializer(pages, rounds):
+    serializers = {"html_to_json": html_to_json_serializer}
+    for dom_format in DOM_FORMATS:
+        serializers[dom_format] = lambda soup, s=DOMSerializer(dom_format): s.serialize(soup.body)
+
+    results = {}
+    for name, html in pages.items():
+        soup = compacted_soup(html)
+        results[name] = {}
+        for label, fn in serializers.items():
+            output = fn(soup)
+            row = measure(fn, soup, rounds)
+            row["output_bytes"] = len(output.encode())
+            # Rough token estimate, good enough to compare formats against each other
+            row["approx_tokens"] = len(output) // 4
+            results[name][label] = row
+            print(
+                f"{name} [{label}]: {row['median_ms']:.1f} ms / {row['peak_mb']:.1f} MB | "
+                f"{row['output_bytes']} bytes, ~{row['approx_tokens']} tokens"
+            )
+    return results
+
+
+def conformance_pages() -> dict:
+    """Small pages written the way Chrome serializes page_source, each on a case tokenizers
+    tend to disagree on (entities, whitespace, tables, void and foreign elements, ...)."""
+    def page(body, head="<title>t</title>"):
+        return f"<html><head>{head}</head><body>{body}</body></html>"
+
+    return {
+        "entities.html": page(
+            "<p>Fish &amp; chips&nbsp;for £5 &lt;today&gt; — “fresh” 😀</p>"
+            '<a href="/search?q=a&amp;page=2" title="&quot;quoted&quot; &amp; more">Next</a>'
+        ),
+        "whitespace.html": page(
+            "\n  <div class=\"  card   wide \">\n    <span>  spaced\n  out  </span>\n  </div>\n"
+            "<pre>  keep\n    this  </pre><p>a<!-- note -->b</p>\n"
+        ),
+        "tables.html": page(
+            "<table id=\"grid\"><thead><tr><th>Name</th><th>Qty</th></tr></thead>"
+            "<tbody><tr><td>Apple</td><td><input type=\"number\" name=\"qty-1\" value=\"1\"></td></tr>"
+            "<tr><td>Pear</td><td><input type=\"number\" name=\"qty-2\" value=\"2\"></td></tr></tbody></table>"
+            "<table><tbody><tr><td><table><tbody><tr><td>nested</td></tr></tbody></table></td></tr></tbody></table>"
+        ),
+        "forms.html": page(
+            '<form id="login" action="/login"><label for="email">Email</label>'
+            '<input type="email" id="email" name="email" placeholder="you@example.com" required="">'
+            '<input type="checkbox" name="remember" checked=""><select name="lang"><option value="en" selected="">English</option>'
+            '<option value="de">Deutsch</option></select><textarea name="note">&lt;b&gt;not a tag&lt;/b&gt;</textarea>'
+            '<button type="submit" onclick="return check(this, \'a &lt; b\')">Sign in</button></form>'
+        ),
+        "foreign.html": page(
+            '<button aria-label="Close"><svg viewBox="0 0 24 24" width="24"><path d="M6 6l12 12"></path>'
+            '<use xlink:href="#icon-x"></use></svg></button><img src="a.png" alt="Logo"><br><hr>'
+            '<math><mi>x</mi></math><canvas id="chart" width="300"></canvas><video src="v.mp4"></video>'
+        ),
+        "scripts.html": page(
+            '<div id="app"><h1>Title</h1><script>if (a < b && c > d) { document.write("</div>"); }</script>'
+            '<style>.x > .y { color: red; }</style><noscript><div id="no-js">Enable JS</div></noscript>'
+            '<template><li>row</li></template><p>After</p></div>',
+            head='<meta charset="utf-8"><script src="app.js"></script><style>body{margin:0}</style>',
+        ),
+        "lists.html": page(
+            '<nav aria-label="Main"><ul>' + "".join(f'<li><a href="/s/{i}" class="nav-link">Section {i}</a></li>' for i in range(12))
+            + '</ul></nav><ol><li>One<ul><li>One.a</li></ul></li><li>Two</li></ol>'
+            + '<div data-testid="list"><div><div><div><div><span>Deep</span><a href="/deep">deep link</a></div></div></div></div></div>'
+        ),
+        "attributes.html": page(
+            '<div id="1st" class="a"><a id="a:b.c" href="#">odd id</a><a data-testid="x &quot;y&quot;">q</a>'
+            '<input name="user[email]" type="text"><div role="button" title="Ünïcödé" aria-hidden="true">x</div>'
+            '<A HREF="/upper">upper</A><div id="dup">one</div><div id="dup">two</div></div>'
+        ),
+    }
+
+
+def conformance_corpus(fixture_dir=FIXTURE_DIR, site_dir=SITE_DIR) -> dict:
+    """The pages backends must agree on: conformance_pages, the fixture pages and the e2e sites' pages.
+
+    The synthetic page is left out, its random nesting (blocks inside a p) is repaired
+    differently by every parser, while Chrome never serializes a page that way.
+    """
+    corpus = dict(conformance_pages())
+    corpus.update(load_pages(fixture_dir))
+    for site, spec in load_sites(site_dir).items():
+        for name, content in spec["files"].items():
+            if name.endswith(".html"):
+                corpus[f"{site}/{name}"] = content.decode("utf-8", "replace")
+    return corpus
+
+
+def backend_pipeline(html: str, backend: str = DEFAULT_HTML_PARSER):
+    # What LLMCommandParser.page_source_parser does with the json format
+    soup = parse_html(html, backend)
+    selector_map = DOMCompactor().compact(soup.body)
+    return selector_map, DOMSerializer("json").serialize(soup.body)
+
+
+def first_difference(reference, output):
+    """Describes the first element id, selector or JSON character where `output` departs from `reference`."""
+    ref_map, ref_json = reference
+    selector_map, json_text = output
+    for element_id in sorted(set(ref_map) | set(selector_map)):
+        if ref_map.get(element_id) != selector_map.get(element_id):
+            return f"element {element_id}: {ref_map.get(element_id)!r} vs {selector_map.get(element_id)!r}"
+    if ref_json != json_text:
+        at = next((i for i, (a, b) in enumerate(zip(ref_json, json_text)) if a != b), min(len(ref_json), len(json_text)))
+        return f"JSON at char {at}: {ref_json[max(0, at - 40):at + 40]!r} vs {json_text[max(0, at - 40):at + 40]!r}"
+    return None
+
+
+def _peak_rss_kb(field: str = "VmHWM") -> float:
+    # /proc/self/status on Linux (VmHWM is the high-water mark), ru_maxrss elsewhere
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss is in bytes on macOS, KB elsewhere
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform == "darwin" else 1)
+
+
+def _peak_rss_growth_mb(html: str, backend: str) -> float:
+    # Runs in a fresh process, so the peak is this page's alone and includes what C
+    # extensions allocate, which tracemalloc doesn't see. The high-water mark carries
+    # over from the parent through fork and exec; on Linux writing 5 to clear_refs resets it.
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        before = _peak_rss_kb("VmRSS")
+    except OSError:
+        before = _peak_rss_kb()
+    backend_pipeline(html, backend)
+    return max(0, _peak_rss_kb() - before) / 1024
+
+
+def peak_rss_growth_mb(html: str, backend: str):
+    if resource is None:
+        return None
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(_peak_rss_growth_mb, html, backend).result()
+
+
+def check_conformance(corpus) -> dict:
+    """Checks every installed parser backend against html.parser on `corpus`.
+
+    Backends must give identical element ids, selectors and JSON; any page where one
+    doesn't is listed under "divergent", with the first difference per backend.
+    """
+    backends = available_parsers()
+    if len(backends) == 1:
+        print(f"⚠️ Only {backends[0]} is installed, install lxml to compare backends")
+
+    divergent = {}
+    for name, html in corpus.items():
+        reference = backend_pipeline(html, DEFAULT_HTML_PARSER)
+        for backend in backends:
+            if backend == DEFAULT_HTML_PARSER:
+                continue
+            difference = first_difference(reference, backend_pipeline(html, backend))
+            if difference is not None:
+                divergent.setdefault(name, {})[backend] = difference
+                print(f"⚠️ {name} [{backend}]: differs from {DEFAULT_HTML_PARSER} at {difference}")
+    print(f"Conformance: {len(corpus) - len(divergent)}/{len(corpus)} pages identical across {', '.join(backends)}")
+    return {"pages": len(corpus), "backends": backends, "divergent": divergent}
+
+
+def bench_backends(pages, corpus, rounds):
+    """Checks the parser backends on `corpus` (see check_conformance), then measures
+    throughput and peak memory of each on `pages`."""
+    results = {"conformance": check_conformance(corpus)}
+    backends = results["conformance"]["backends"]
+    for name, html in pages.items():
+        size_mb = len(html.encode()) / 1024 / 1024
+        results[name] = {}
+        for backend in backends:
+            row = measure(functools.partial(backend_pipeline, backend=backend), html, rounds)
+            row["total_ms"] = row.pop("median_ms")
+            row["parse_ms"] = measure(functools.partial(parse_html, parser=backend), html, rounds)["median_ms"]
+            row["pages_per_sec"] = 1000 / row["total_ms"]
+            row["mb_per_sec"] = size_mb / (row["total_ms"] / 1000)
+            row["peak_rss_mb"] = peak_rss_growth_mb(html, backend)
+            results[name][backend] = row
+            rss = f"{row['peak_rss_mb']:.1f} MB RSS" if row["peak_rss_mb"] is not None else "RSS n/a"
+            print(
+                f"{name} [{backend}]: parse {row['parse_ms']:.1f} ms, total {row['total_ms']:.1f} ms | "
+                f"{row['mb_per_sec']:.2f} MB/s | peak {row['peak_mb']:.1f} MB Python heap, {rss}"
+            )
+    return results
+
+
+@contextmanager
+def serve_pages(pages, latency_ms=0):
+    """Serves the pages (and bytes assets) from a temporary directory on a local HTTP server.
+
+    Everything but .html files is delayed by `latency_ms` to stand in for a real network.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        for name, content in pages.items():
+            if isinstance(content, bytes):
+                with open(os.path.join(root, name), "wb") as f:
+                    f.write(content)
+            else:
+                with open(os.path.join(root, name), "w", encoding="utf-8") as f:
+                    f.write(content)
+
+        handler_class = type("Handler", (QuietHandler,), {"latency": latency_ms / 1000})
+        handler = functools.partial(handler_class, directory=root)
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield f"http://127.0.0.1:{server.server_port}"
+        finally:
+            server.shutdown()
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    latency = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.latency and not self.path.endswith(".html"):
+            time.sleep(self.latency)
+        super().do_GET()
+
+
+def headless_driver():
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless=new")
+    options.add_argument("--log-level=3")
+    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+
+
+def bench_extraction(pages, rounds):
+    serializer = DOMSerializer()
+    extractor = BrowserDOMExtractor()
+
+    def page_source_path(driver):
+        html = driver.page_source
+        soup = BeautifulSoup(html, "html.parser")
+        DOMCompactor().compact(soup.body)
+        serializer.serialize(soup.body)
+        return len(html.encode())
+
+    def browser_path(driver):
+        raw = extractor.extract_raw(driver)
+        serializer.serialize_tree(json.loads(raw)["tree"])
+        return len(raw.encode())
+
+    results = {}
+    driver = headless_driver()
+    try:
+        with serve_pages(pages) as base_url:
+            for name in pages:
+                driver.get(f"{base_url}/{name}")
+                results[name] = {}
+                for label, fn in (("page_source", page_source_path), ("browser", browser_path)):
+                    timings = []
+                    for _ in range(rounds):
+                        start = time.perf_counter()
+                        transferred = fn(driver)
+                        timings.append(time.perf_counter() - start)
+                    row = {"median_ms": statistics.median(timings) * 1000, "bytes_transferred": transferred}
+                    results[name][label] = row
+                    print(f"{name} [{label}]: {row['median_ms']:.1f} ms | {transferred} bytes over the wire")
+    finally:
+        driver.quit()
+    return results
+
+
+def media_heavy_site(n_images=30):
+    """A page that pulls images, a web font, a video and an analytics script, plus its assets."""
+    images = "".join(f'<figure><img src="img{i}.png" alt="Product {i}"><figcaption>Product {i}</figcaption></figure>' for i in range(n_images))
+    page = f"""<html><head>
+    <style>
+    @font-face {{ font-family: Brand; src: url(brand.woff2) format("woff2"); }}
+    body {{ font-family: Brand, sans-serif; }}
+    .banner {{ animation: pulse 1s infinite; }}
+    @keyframes pulse {{ from {{ opacity: 0.5; }} to {{ opacity: 1; }} }}
+    </style>
+    <script src="analytics.js"></script>
+    </head><body>
+    <div class="banner"><a href="#sale">Sale</a></div>
+    <video src="intro.mp4" autoplay muted preload="auto"></video>
+    <form><input name="q" placeholder="Search products"><button>Search</button></form>
+    {images}
+    </body></html>"""
+
+    site = {"media.html": page}
+    for i in range(n_images):
+        site[f"img{i}.png"] = b"\x89PNG\r\n\x1a\n" + os.urandom(60 * 1024)
+    site["brand.woff2"] = os.urandom(120 * 1024)
+    site["intro.mp4"] = os.urandom(1024 * 1024)
+    site["analytics.js"] = ("var events = [];" + "events.push(Math.random());" * 5000).encode()
+    return site
+
+
+def bench_lightweight(pages, rounds):
+    """Page load time, requests and browser memory: default vs lightweight profile.
+
+    Both run headless so the comparison isolates resource blocking and animations.
+    """
+    site = media_heavy_site()
+    site.update(pages)
+    names = ["media.html"] + list(pages)
+    profiles = {"default": None, "lightweight": blocked_patterns()}
+
+    results = {}
+    with serve_pages(site, latency_ms=20) as base_url:
+        for label, blocked in profiles.items():
+            with tempfile.TemporaryDirectory() as profile_dir:
+                driver = launch_browser(profile_dir, headless=True, blocked_urls=blocked)
+                try:
+                    for name in names:
+                        timings = []
+                        for _ in range(rounds):
+                            driver.get("about:blank")
+                            start = time.perf_counter()
+                            driver.get(f"{base_url}/{name}")
+                            timings.append(time.perf_counter() - start)
+                        requests = driver.execute_script("return performance.getEntriesByType('resource').length;")
+                        row = {
+                            "load_ms": statistics.median(timings) * 1000,
+                            "requests": requests,
+                            "browser_mb": browser_memory_mb(driver),
+                        }
+                        results.setdefault(name, {})[label] = row
+                        print(f"{name} [{label}]: load {row['load_ms']:.1f} ms | {requests} requests | {row['browser_mb']:.0f} MB")
+                finally:
+                    driver.quit()
+    return results
+
+
+STREAMING_RESPONSE = json.dumps([
+    {"action": "fill", "element_id": 17, "text": "user@example.com", "intend": "Fill in the email input"},
+    {"action": "fill", "element_id": 18, "text": "correct horse battery staple", "intend": "Fill in the password input"},
+    {"action": "click", "element_id": 42, "intend": "Click the sign in button"},
+])
+
+
+def bench_streaming(rounds):
+    """Time to first dispatchable action, plain vs streamed completions, against the stub server."""
+    with StubLLMServer([STREAMING_RESPONSE]) as server:
+        # llm_handler builds its OpenAI client at import time from the environment
+        os.environ["OPENAI_API_KEY"] = "stub"
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ["model"] = "stub"
+        import llm_handler
+
+        def plain():
+            start = time.perf_counter()
+            actions = json.loads(llm_handler.query_llm("benchmark"))
+            first = time.perf_counter() - start
+            return first, time.perf_counter() - start, len(actions)
+
+        def streamed():
+            start = time.perf_counter()
+            first = None
+            parser = ActionStreamParser()
+            for _ in parser.iter_actions(llm_handler.stream_llm("benchmark")):
+                if first is None:
+                    first = time.perf_counter() - start
+            return first, time.perf_counter() - start, len(parser.actions)
+
+        results = {}
+        for label, fn in (("plain", plain), ("streamed", streamed)):
+            runs = [fn() for _ in range(rounds)]
+            results[label] = {
+                "first_action_ms": statistics.median(run[0] for run in runs) * 1000,
+                "all_actions_ms": statistics.median(run[1] for run in runs) * 1000,
+                "actions": runs[0][2],
+            }
+            row = results[label]
+            print(f"[{label}] first action after {row['first_action_ms']:.1f} ms, all {row['actions']} after {row['all_actions_ms']:.1f} ms")
+    return results
+
+
+def load_sites(site_dir=SITE_DIR) -> dict:
+    """Recorded sites: one directory per site with its files and a tasks.json.
+
+    tasks.json lists the site's tasks. In a task's `steps`, each entry is one LLM reply.
+    An action may name its element with `target`, the selector the agent assigns to it
+    (`#id` or `tag[name="..."]` for elements with a unique id or name), which
+    ScriptedLLM turns into the element_id of the current snapshot. `expect_url` is
+    checked once the task ends.
+    """
+    sites = {}
+    for tasks_path in sorted(glob.glob(os.path.join(site_dir, "*", "tasks.json"))):
+        root = os.path.dirname(tasks_path)
+        files = {}
+        for path in glob.glob(os.path.join(root, "**", "*"), recursive=True):
+            name = os.path.relpath(path, root)
+            if os.path.isfile(path) and name != "tasks.json":
+                with open(path, "rb") as f:
+                    files[name] = f.read()
+        with open(tasks_path, encoding="utf-8") as f:
+            sites[os.path.basename(root)] = {"files": files, "tasks": json.load(f)}
+    if not sites:
+        raise FileNotFoundError(f"No recorded sites (<site>/tasks.json) in {site_dir}")
+    return sites
+
+
+class ScriptedLLM:
+    """Stub LLM replies for one task: the next scripted step, with targets resolved.
+
+    Also records the size of every prompt it receives, whole and of its last message
+    alone: the part a provider's prefix cache can't serve when a step continues the
+    conversation (dom_diff).
+    """
+
+    def __init__(self, agent, steps: list):
+        self.agent = agent
+        self.steps = list(steps)
+        self.prompt_bytes = []
+        self.prompt_tokens = []
+        self.new_prompt_bytes = []
+        self.unresolved = 0
+
+    def _resolve(self, action: dict) -> dict:
+        action = dict(action)
+        target = action.pop("target", None)
+        if target is not None:
+            ids = [element_id for element_id, selector in self.agent.selector_map.items() if selector == target]
+            if not ids:
+                self.unresolved += 1
+            # An id no snapshot uses, so the action fails like a wrong LLM answer would
+            action["element_id"] = ids[0] if ids else 10 ** 9
+        return action
+
+    def __call__(self, body: dict) -> str:
+        messages = body.get("messages", [])
+        text = "".join(str(message.get("content", "")) for message in messages)
+        self.prompt_bytes.append(len(text.encode()))
+        self.prompt_tokens.append(estimate_tokens(text))
+        self.new_prompt_bytes.append(len(str(messages[-1].get("content", "")).encode()) if messages else 0)
+        step = self.steps.pop(0) if self.steps else [{"action": "done"}]
+        return json.dumps([self._resolve(action) for action in step])
+
+
+def bench_e2e(sites, rounds):
+    """Runs the scripted tasks end to end: headless Chrome, local sites, stub LLM.
+
+    Per task: steps/sec, p50/p95 per phase (from the trace spans), prompt bytes and
+    tokens per step, and the time to compact each page of the site. Each task is run
+    again with dom_diff, whose prompt sizes are reported under "dom_diff": a delta step
+    resends the whole conversation, so it only sends fewer bytes than a full snapshot
+    would in its last message, which is all that is new when the prefix is cached.
+    """
+    # llm_handler builds its OpenAI client and reads its settings at import time; pin
+    # the settings that change what is measured so a local .env can't skew the run
+    responder = {"current": None}
+    server = StubLLMServer(lambda body: responder["current"](body), first_token_delay=0.05, chunk_delay=0, chunk_size=4096)
+    server.start()
+    os.environ.update({
+        "OPENAI_API_KEY": "stub", "OPENAI_BASE_URL": server.base_url, "model": "stub",
+        "stream_responses": "false", "prompt_token_budget": "0", "dom_diff": "false",
+        "action_cache": "", "replay_dir": "", "trace_file": "", "trace_collector": "",
+    })
+    import llm_handler
+    import tracing
+    from llm_command_parser import LLMCommandParser
+
+    results = {}
+    try:
+        for site_name, site in sites.items():
+            parse_ms = {}
+            for name, content in site["files"].items():
+                if name.endswith(".html"):
+                    html = content.decode("utf-8", "replace") if isinstance(content, bytes) else content
+                    parse_ms[name] = round(measure(compactor_page_source_parser, html, rounds)["median_ms"], 2)
+
+            with serve_pages(site["files"]) as base_url, tempfile.TemporaryDirectory() as profile_dir:
+                driver = launch_browser(profile_dir, headless=True)
+                try:
+                    for task in site["tasks"]:
+                        def run(diff):
+                            runs = []
+                            for _ in range(rounds):
+                                with tempfile.TemporaryDirectory() as trace_dir:
+                                    trace_path = os.path.join(trace_dir, "trace.jsonl")
+                                    tracing.configure(trace_path)
+                                    agent = LLMCommandParser(url=f"{base_url}/{task['start']}", usr_dir=profile_dir, driver=driver, diff=diff)
+                                    scripted = ScriptedLLM(agent, task["steps"])
+                                    responder["current"] = scripted
+                                    with redirect_stdout(io.StringIO()):
+                                        result = llm_handler.run_task(agent, task["task"])
+                                    tracing.tracer.flush()
+                                    phases = tracing.summarize(trace_path)
+                                    tracing.configure()
+                                url = driver.current_url
+                                runs.append({
+                                    "ok": result["status"] == "done" and task.get("expect_url", "") in url and not scripted.unresolved,
+                                    "duration_s": result["duration_s"],
+                                    "steps": len(result["steps"]),
+                                    "phases": phases,
+                                    "prompt_bytes": scripted.prompt_bytes,
+                                    "prompt_tokens": scripted.prompt_tokens,
+                                    "new_prompt_bytes": scripted.new_prompt_bytes,
+                                })
+                            return _e2e_row(runs)
+
+                        row = run(False)
+                        diff_row = run(True)
+                        row["dom_diff"] = {
+                            key: diff_row[key]
+                            for key in ("ok", "prompt_bytes_per_step", "prompt_tokens_per_step", "new_prompt_bytes_per_step")
+                        }
+                        row["parser_ms_per_page"] = parse_ms
+                        results.setdefault(site_name, {})[task["task"]] = row
+                        phases = ", ".join(
+                            f"{phase} {row['phases'][phase]['p50_ms']:.0f}/{row['phases'][phase]['p95_ms']:.0f}"
+                            for phase in ("snapshot", "parse", "llm", "settle") if phase in row["phases"]
+                        )
+                        print(
+                            f"{site_name}: {task['task']} | {'ok' if row['ok'] else 'FAILED'} | "
+                            f"{row['steps_per_sec']:.2f} steps/s | p50/p95 ms {phases} | "
+                            f"{row['prompt_bytes_per_step']:.0f} bytes, ~{row['prompt_tokens_per_step']:.0f} tokens per prompt | "
+                            f"dom_diff {row['dom_diff']['prompt_bytes_per_step']:.0f} bytes per prompt, "
+                            f"{row['dom_diff']['new_prompt_bytes_per_step']:.0f} in the last message"
+                        )
+                finally:
+                    driver.quit()
+    finally:
+        server.stop()
+    return results
+
+
+def _e2e_row(runs: list) -> dict:
+    prompt_bytes = [size for run in runs for size in run["prompt_bytes"]]
+    prompt_tokens = [size for run in runs for size in run["prompt_tokens"]]
+    new_prompt_bytes = [size for run in runs for size in run["new_prompt_bytes"]]
+    # Phases are merged over the rounds by recomputing from the per-round stats
+    phases = {}
+    for name in {name for run in runs for name in run["phases"]}:
+        stats = [run["phases"][name] for run in runs if name in run["phases"]]
+        phases[name] = {
+            "count": sum(stat["count"] for stat in stats) / len(runs),
+            "p50_ms": statistics.median(stat["p50_ms"] for stat in stats),
+            "p95_ms": max(stat["p95_ms"] for stat in stats),
+        }
+    steps = sum(run["steps"] for run in runs)
+    duration = sum(run["duration_s"] for run in runs)
+    return {
+        "ok": all(run["ok"] for run in runs),
+        "rounds": len(runs),
+        "steps": steps / len(runs),
+        "task_ms": statistics.median(run["duration_s"] for run in runs) * 1000,
+        "steps_per_sec": steps / duration if duration else 0,
+        "prompt_bytes_per_step": statistics.mean(prompt_bytes) if prompt_bytes else 0,
+        "prompt_tokens_per_step": statistics.mean(prompt_tokens) if prompt_tokens else 0,
+        "new_prompt_bytes_per_step": statistics.mean(new_prompt_bytes) if new_prompt_bytes else 0,
+        "phases": phases,
+    }
+
+
+def compare(results, baseline, tolerance: float = 0.1, path: str = "") -> list:
+    """Lists the timings (*_ms) and rates (*per_sec) of `results` that got more than
+    `tolerance` worse than in `baseline`, a results file of an earlier run."""
+    regressions = []
+    for key, value in results.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        name = f"{path}/{key}" if path else str(key)
+        if isinstance(value, dict):
+            regressions += compare(value, old, tolerance, name)
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old > 0:
+            if key.endswith("_ms") and value > old * (1 + tolerance):
+                regressions.append(f"{name}: {old:.1f} -> {value:.1f} ms")
+            elif key.endswith("per_sec") and value < old * (1 - tolerance):
+                regressions.append(f"{name}: {old:.2f} -> {value:.2f}/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance benchmarks for the DOM pipeline")
+    parser.add_argument("suite", choices=["parser", "serializer", "backends", "conformance", "extraction", "streaming", "lightweight", "e2e"], help="Benchmark suite to run")
+    parser.add_argument("--fixtures", default=FIXTURE_DIR, help="Directory of *.html pages (default: the generated stand-ins in fixtures/pages)")
+    parser.add_argument("--synthetic", action="store_true", help="Also run on a generated 20k-node page")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--sites", default=SITE_DIR, help="Directory of recorded sites for the e2e and backends suites")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to report regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed slowdown against the baseline, as a fraction")
+    args = parser.parse_args()
+
+    if args.suite == "parser":
+        results = bench_parser(load_pages(args.fixtures, args.synthetic), args.rounds)
+    elif args.suite == "serializer":
+        results = bench_serializer(load_pages(args.fixtures, args.synthetic), args.rounds)
+    elif args.suite == "backends":
+        results = bench_backends(load_pages(args.fixtures, args.synthetic), conformance_corpus(args.fixtures, args.sites), args.rounds)
+    elif args.suite == "conformance":
+        results = {"conformance": check_conformance(conformance_corpus(args.fixtures, args.sites))}
+    elif args.suite == "extraction":
+        results = bench_extraction(load_pages(args.fixtures, args.synthetic), args.rounds)
+    elif args.suite == "streaming":
+        results = bench_streaming(args.rounds)
+    elif args.suite == "lightweight":
+        results = bench_lightweight(load_pages(args.fixtures, args.synthetic), args.rounds)
+    elif args.suite == "e2e":
+        results = bench_e2e(load_sites(args.sites), args.rounds)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"⚠️ Regression {line}")
+        if regressions:
+            sys.exit(1)
+
+    if args.suite in ("backends", "conformance"):
+        conformance = results["conformance"]
+        if conformance["divergent"]:
+            print(f"❌ {len(conformance['divergent'])} pages differ between parser backends")
+            sys.exit(1)
+        if args.suite == "conformance" and len(conformance["backends"]) < 2:
+            # Nothing was compared, a pass would mean nothing
+            print("❌ Conformance needs a second parser backend, install lxml")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import os
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+
+from lightweight import apply_lightweight, lightweight_options
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+DRIVER_PATH_CACHE = ".chromedriver_path"
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+
+def resolve_driver_path(cache_file: str = DRIVER_PATH_CACHE) -> str:
+    """Path of the chromedriver binary, resolved through ChromeDriverManager only once.
+
+    The result is kept for the process and in `cache_file`, so later starts skip the
+    driver manager (and its network check) as long as the binary is still there.
+    """
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path and os.path.exists(_driver_path):
+            return _driver_path
+
+        if os.path.exists(cache_file):
+            with open(cache_file, encoding="utf-8") as f:
+                cached = f.read().strip()
+            if cached and os.path.exists(cached):
+                _driver_path = cached
+                return _driver_path
+
+        _driver_path = ChromeDriverManager().install()
+        try:
+            with open(cache_file, "w", encoding="utf-8") as f:
+                f.write(_driver_path)
+        except OSError:
+            pass
+        return _driver_path
+
+
+def launch_browser(usr_dir: str, headless: bool = False, blocked_urls: list = None):
+    """Starts Chrome on the `usr_dir` profile. With `blocked_urls` (see
+    lightweight.blocked_patterns) it runs the lightweight profile: those URLs are never
+    fetched and animations are disabled."""
+    options = webdriver.ChromeOptions()
+    options.add_argument(f"--user-data-dir={usr_dir}")
+    options.add_argument("--log-level=3")
+    options.add_experimental_option("excludeSwitches", ["enable-logging"])
+    options.add_argument("disable-logging")
+    if headless:
+        options.add_argument("--headless=new")
+        options.add_argument("--window-size=1280,1000")
+    if blocked_urls is not None:
+        lightweight_options(options, blocked_urls)
+
+    driver = webdriver.Chrome(
+        service=Service(resolve_driver_path(), log_path=os.devnull),
+        options=options,
+    )
+    if blocked_urls is not None:
+        apply_lightweight(driver, blocked_urls)
+    return driver
+
+
+def browser_memory_mb(driver) -> float:
+    """Resident memory of the whole browser (all Chrome processes) if psutil is installed,
+    otherwise the JS heap of the current page."""
+    if psutil is not None:
+        try:
+            process = psutil.Process(driver.service.process.pid)
+            rss = sum(child.memory_info().rss for child in process.children(recursive=True))
+            return rss / (1024 * 1024)
+        except Exception:
+            pass
+    try:
+        return (driver.execute_script("return performance.memory ? performance.memory.usedJSHeapSize : 0;") or 0) / (1024 * 1024)
+    except Exception:
+        return 0.0
+
+
+def _origin(url: str):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}" if parts.scheme in ("http", "https") and parts.netloc else None
+
+
+def _history_origins(driver) -> set:
+    # Every origin the current tab went through, not only the one it ended on
+    try:
+        entries = driver.execute_cdp_cmd("Page.getNavigationHistory", {})["entries"]
+    except Exception:
+        entries = [{"url": driver.current_url}]
+    return {origin for origin in map(_origin, (entry["url"] for entry in entries)) if origin}
+
+
+def reset_browser(driver, url: str = None):
+    """Drops cookies, cache, storage and extra tabs so the next task starts clean.
+
+    Storage (local storage, IndexedDB, service workers, cache storage, ...) is cleared
+    over CDP for every origin the tabs navigated through or that holds a cookie, since
+    a page only reaches its own origin's. Session storage lives in the tab, so only the
+    current origin's is cleared. Ends on `url`, or a blank page without one.
+    """
+    origins = set()
+    handles = driver.window_handles
+    for handle in reversed(handles):
+        driver.switch_to.window(handle)
+        origins |= _history_origins(driver)
+        if handle != handles[0]:
+            driver.close()
+    driver.switch_to.window(handles[0])
+
+    driver.execute_script("try { localStorage.clear(); sessionStorage.clear(); } catch (e) {}")
+    try:
+        for cookie in driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]:
+            domain = cookie["domain"].lstrip(".")
+            origins.update((f"https://{domain}", f"http://{domain}"))
+        for origin in sorted(origins):
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+    except Exception:
+        # Not a Chromium driver
+        driver.delete_all_cookies()
+    driver.get(url or "about:blank")
+
+
+class BrowserPool:
+    """Keeps warm browsers ready so tasks never wait for Chrome to start.
+
+    `acquire` hands out the browser in use, or a pre-launched spare once it has been
+    retired. `release` counts the finished task, optionally resets the browser and
+    retires it after `max_tasks` tasks or once its memory grew by `max_memory_growth_mb`
+    since it was handed out; a replacement is launched in the background. Browsers are
+    started on `start_url` and get their own `<usr_dir>-slot<n>` profile, since Chrome
+    cannot share a profile between running browsers.
+    """
+
+    def __init__(self, usr_dir: str, start_url: str = "about:blank", spare: int = 1, max_tasks: int = 50,
+                 max_memory_growth_mb: float = 500, headless: bool = True, reset: bool = False, blocked_urls: list = None):
+        self.usr_dir = usr_dir
+        self.start_url = start_url or "about:blank"
+        self.spare = spare
+        self.max_tasks = max_tasks
+        self.max_memory_growth_mb = max_memory_growth_mb
+        self.headless = headless
+        self.reset = reset
+        self.blocked_urls = blocked_urls
+        self.stats = {"launched": 0, "recycled": 0, "resets": 0}
+
+        self.current = None
+        self.tasks = 0
+        self.baseline_mb = 0.0
+        self.ready = deque()
+        self.launching = 0
+        self.free_slots = deque(range(spare + 1))
+        self.slots = {}
+        self._lock = threading.Condition()
+        self._closed = False
+
+        with self._lock:
+            self._top_up()
+
+    def _reserve_slot(self) -> int:
+        # Called with the lock held
+        self.launching += 1
+        return self.free_slots.popleft()
+
+    def _launch(self, slot: int):
+        driver = None
+        try:
+            driver = launch_browser(f"{self.usr_dir}-slot{slot}", headless=self.headless, blocked_urls=self.blocked_urls)
+            driver.get(self.start_url)
+        except Exception as e:
+            print(f"⚠️ Could not launch a browser: {type(e).__name__}")
+            if driver is not None:
+                try:
+                    driver.quit()
+                except Exception:
+                    pass
+            driver = None
+
+        with self._lock:
+            self.launching -= 1
+            if driver is None:
+                self.free_slots.append(slot)
+            else:
+                self.slots[driver] = slot
+                self.stats["launched"] += 1
+                if self._closed:
+                    self._quit(driver)
+                    driver = None
+                else:
+                    self.ready.append(driver)
+            self._lock.notify_all()
+        return driver
+
+    def _top_up(self):
+        # Called with the lock held; starts launches until `spare` browsers are ready or on the way
+        while not self._closed and self.free_slots and len(self.ready) + self.launching < self.spare:
+            threading.Thread(target=self._launch, args=(self._reserve_slot(),), daemon=True).start()
+
+    def _quit(self, driver):
+        # Called with the lock held
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        slot = self.slots.pop(driver, None)
+        if slot is not None:
+            self.free_slots.append(slot)
+
+    def acquire(self):
+        if self.current is not None:
+            return self.current
+
+        while True:
+            with self._lock:
+                # A retiring browser may still hold the only free profile slot
+                while not self.ready and (self.launching or not self.free_slots):
+                    self._lock.wait()
+                if self.ready:
+                    self.current = self.ready.popleft()
+                    self._top_up()
+                    break
+                # Nothing warm and nothing starting (no spares, or a launch failed)
+                slot = self._reserve_slot()
+            if self._launch(slot) is None:
+                raise RuntimeError("Could not launch a browser")
+
+        self.tasks = 0
+        self.baseline_mb = browser_memory_mb(self.current)
+        return self.current
+
+    def release(self, driver, reset: bool = None):
+        """Ends a task on `driver`; the next acquire may return a different browser."""
+        if driver is not self.current:
+            return
+
+        self.tasks += 1
+        growth = browser_memory_mb(driver) - self.baseline_mb
+        retire = self.tasks >= self.max_tasks or growth >= self.max_memory_growth_mb
+        if not retire and (self.reset if reset is None else reset):
+            try:
+                reset_browser(driver, self.start_url)
+                self.stats["resets"] += 1
+            except Exception as e:
+                print(f"⚠️ Browser reset failed: {type(e).__name__}")
+                retire = True
+
+        if retire:
+            print(f"♻️ Recycling browser after {self.tasks} tasks ({growth:.0f} MB growth)")
+            self.current = None
+            self.stats["recycled"] += 1
+            threading.Thread(target=self._retire, args=(driver,), daemon=True).start()
+
+    def _retire(self, driver):
+        with self._lock:
+            self._quit(driver)
+            self._top_up()
+            self._lock.notify_all()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            drivers = list(self.ready) + ([self.current] if self.current is not None else [])
+            self.ready.clear()
+            self.current = None
+            for driver in drivers:
+                self._quit(driver)
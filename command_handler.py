@@ -1,28 +1,152 @@
-from queue import Queue
+from collections import OrderedDict
+from queue import Queue, Full
+import heapq
+import itertools
+import threading
 import time
+import tracing
+
+
+# Finished task records kept for status lookups, oldest dropped first
+MAX_FINISHED_TASKS = 1000
 
 
 class handleCommands:
-    def __init__(self, task_queue: Queue):
+    """Accepts tasks (from the prompt or the task API) and feeds them to the workers.
+
+    Tasks wait in a priority heap and are handed to the workers' queue only while
+    fewer than `capacity` are running, so a later high-priority task can still
+    overtake earlier ones. Without a capacity they go straight to the queue. With
+    `max_pending`, `submit` raises queue.Full once that many are waiting. Every task
+    has a record (status, step progress events, final result) that the workers'
+    results update through `on_progress` and `on_result`.
+    """
+
+    def __init__(self, task_queue: Queue, trace_file: str = "", capacity: int = None, max_pending: int = None):
         self.task_queue = task_queue
+        self.trace_file = trace_file
+        self.capacity = capacity
+        self.max_pending = max_pending
         self.exit = False
+        self.exited = threading.Event()
+        # Set by TaskAPI, tasks can then still arrive when there is no terminal
+        self.serving = False
+        self.next_task_id = 1
+        self.pending = []
+        self.order = itertools.count()
+        self.running = 0
+        self.tasks = OrderedDict()
+        self.changed = threading.Condition()
+
+    def submit(self, task: str, priority: int = 0, replay: bool = False, task_id=None) -> dict:
+        """Queues a task and returns its record; higher `priority` runs first."""
+        with self.changed:
+            if task_id is not None and task_id in self.tasks:
+                raise KeyError(f"Task id {task_id} is already in use")
+            if self.max_pending is not None and len(self.pending) >= self.max_pending:
+                raise Full(f"{len(self.pending)} tasks are already waiting")
+            if task_id is None:
+                # Skips ids a client already picked for its own tasks
+                while self.next_task_id in self.tasks:
+                    self.next_task_id += 1
+                task_id = self.next_task_id
+                self.next_task_id += 1
+
+            message = {"id": task_id, "task": task}
+            if replay:
+                message["replay"] = True
+            record = {
+                "id": task_id,
+                "task": task,
+                "priority": priority,
+                "status": "queued",
+                "submitted": time.time(),
+                "events": [],
+                "result": None,
+            }
+            self.tasks[task_id] = record
+            heapq.heappush(self.pending, (-priority, next(self.order), message))
+            self._dispatch()
+            return record
+
+    def _dispatch(self):
+        # Caller holds the lock
+        while self.pending and (self.capacity is None or self.running < self.capacity):
+            _, _, message = heapq.heappop(self.pending)
+            self.running += 1
+            self.tasks[message["id"]]["status"] = "running"
+            self.task_queue.put(message)
+        self.changed.notify_all()
+
+    def on_progress(self, message: dict):
+        with self.changed:
+            record = self.tasks.get(message.get("id"))
+            if record is not None:
+                record["events"].append(message["progress"])
+                self.changed.notify_all()
+
+    def on_result(self, result: dict):
+        with self.changed:
+            record = self.tasks.get(result.get("id"))
+            if record is None:
+                return
+            record["status"] = result.get("status", "error")
+            record["result"] = result
+            self.running = max(0, self.running - 1)
+            self._forget_finished()
+            self._dispatch()
+
+    def _forget_finished(self):
+        finished = [task_id for task_id, record in self.tasks.items() if record["result"] is not None]
+        for task_id in finished[:max(0, len(finished) - MAX_FINISHED_TASKS)]:
+            del self.tasks[task_id]
+
+    def stats(self) -> dict:
+        with self.changed:
+            return {"queued": len(self.pending), "running": self.running, "capacity": self.capacity}
+
+    def request_exit(self):
+        with self.changed:
+            # Tasks still waiting go ahead of the exit sentinel, in priority order
+            while self.pending:
+                _, _, message = heapq.heappop(self.pending)
+                self.tasks[message["id"]]["status"] = "running"
+                self.task_queue.put(message)
+            self.task_queue.put("exit")
+            self.exit = True
+            self.exited.set()
+            self.changed.notify_all()
 
     def process_command(self, command):
         if command == "help":
             response = """HELP:-
                 - help :- Shows all the command options
+                - replay <task> :- Replays the recording of a task that completed before, the LLM only takes over if the page changed
+                - report :- Prints p50/p95 timings per phase (snapshot, LLM, actions, waits) from the trace file
                 - exit :- To exit the program"""
             print(response)
             return
         elif command == "exit":
-            self.task_queue.put("exit")
-            self.exit = True
+            self.request_exit()
+            return
+        elif command == "report":
+            tracing.print_report(self.trace_file)
             return
+        elif command.startswith("replay "):
+            self.submit(command[len("replay "):].strip(), replay=True)
         else:
-            self.task_queue.put(command)
+            self.submit(command)
 
     def start_command_loop(self):
         while not self.exit:
-            command = input("> ")
+            try:
+                command = input("> ")
+            except EOFError:
+                if not self.serving:
+                    self.request_exit()
+                    break
+                # No terminal (e.g. run as a service), tasks come through the API until it asks to exit
+                self.exited.wait()
+                break
             self.process_command(command)
-            continue
\ No newline at end of file
+            continue
@@ -0,0 +1,135 @@
+from bs4 import Tag
+
+from selector_synthesizer import SelectorSynthesizer, MAX_CHAIN_DEPTH
+
+
+ESSENTIAL_CONTENT_TAGS = {
+    "html", "body", "button", "a", "label", "input", "textarea", "select", "option",
+    "span", "div", "h1", "h2", "h3", "h4", "h5", "h6", "p", "li", "form", "img", "nav",
+    "section", "article", "table", "thead", "tbody", "tr", "td", "th", "ul", "ol",
+    "iframe", "video", "audio", "i", "canvas"
+}
+
+ESSENTIAL_ATTRIBUTES = {
+    "id", "class", "name", "type", "value", "href", "alt", "title", "role", "placeholder",
+    "onclick", "onchange", "for", "selected", "checked", "min", "max", "step", "data-value",
+    "aria-label", "aria-hidden", "data-testid"
+}
+
+
+def _nth_of_type(el: Tag) -> int:
+    nth = 1
+    for sib in el.previous_siblings:
+        if isinstance(sib, Tag) and sib.name == el.name:
+            nth += 1
+    return nth
+
+
+def _root_path(el: Tag) -> str:
+    # Structural selector of the root we compact, for when it has no anchor of its own
+    if el.name in ("html", "body"):
+        return el.name
+    parts = []
+    while el is not None and el.name != "[document]":
+        parts.append(el.name if el.name in ("html", "body") else f"{el.name}:nth-of-type({_nth_of_type(el)})")
+        if el.name == "body":
+            break
+        el = el.parent
+    return " > ".join(reversed(parts))
+
+
+def _child_step(parent: Tag, child: Tag, nth: int, of_type: int) -> str:
+    step = f"{child.name}:nth-of-type({nth})" if of_type > 1 else child.name
+    # Browsers wrap rows written straight into a table in an implicit tbody
+    if parent.name == "table" and child.name == "tr":
+        return f"tbody > {step}"
+    return step
+
+
+class DOMCompactor:
+    """Prunes a parsed page and assigns element ids and selectors in a single walk.
+
+    Every kept element gets `_element_id` (pre-order) and `idx` (1-based position
+    among its kept element siblings). An element with a unique id, data-testid, name
+    or aria-label gets that as its selector; any other is addressed from its nearest
+    such ancestor with child steps (nth-of-type only where a sibling shares the tag),
+    or by unique text once that chain gets longer than MAX_CHAIN_DEPTH (see
+    SelectorSynthesizer). Uniqueness is checked against an index of the whole parsed
+    page, built once per call.
+    """
+
+    def __init__(self, content_tags=None, attributes=None):
+        self.content_tags = content_tags or ESSENTIAL_CONTENT_TAGS
+        self.attributes = attributes or ESSENTIAL_ATTRIBUTES
+        self.synthesizer = SelectorSynthesizer()
+
+    def compact(self, root: Tag) -> dict:
+        """Compacts `root` in place and returns the element_id -> selector map."""
+        selector_map = {}
+        content_tags = self.content_tags
+        attributes = self.attributes
+        synthesizer = self.synthesizer
+        counter = 0
+
+        document = root
+        while document.parent is not None:
+            document = document.parent
+        synthesizer.index(document)
+
+        root_idx = None
+        if root.parent is not None:
+            root_idx = 1
+            for sib in root.previous_siblings:
+                if isinstance(sib, Tag) and sib.name not in ("script", "style"):
+                    root_idx += 1
+
+        # Anchors are looked up before the attributes are filtered, since the page
+        # still has every attribute
+        root_selector = synthesizer.anchor(root) or _root_path(root)
+        root.attrs = {k: v for k, v in root.attrs.items() if k in attributes}
+        # (element, its selector, idx, selector its children are built on, steps below an anchor)
+        stack = [(root, root_selector, root_idx, root_selector, 0)]
+
+        while stack:
+            el, selector, idx, base, depth = stack.pop()
+
+            el["_element_id"] = counter
+            if idx is not None:
+                el["idx"] = str(idx)
+            selector_map[counter] = selector
+            counter += 1
+
+            children = []
+            type_counts = {}
+            for child in list(el.contents):
+                if not isinstance(child, Tag):
+                    continue
+                if child.name not in content_tags:
+                    child.decompose()
+                    continue
+                children.append(child)
+                type_counts[child.name] = type_counts.get(child.name, 0) + 1
+
+            kept = []
+            nth_counts = {}
+            for child in children:
+                nth = nth_counts.get(child.name, 0) + 1
+                nth_counts[child.name] = nth
+
+                anchor = synthesizer.anchor(child)
+                if anchor is not None:
+                    child_base, child_depth, child_selector = anchor, 0, anchor
+                else:
+                    child_base = f"{base} > {_child_step(el, child, nth, type_counts[child.name])}"
+                    child_depth = depth + 1
+                    child_selector = child_base
+                    if child_depth > MAX_CHAIN_DEPTH:
+                        child_selector = synthesizer.text_xpath(child) or child_base
+
+                child.attrs = {k: v for k, v in child.attrs.items() if k in attributes}
+                kept.append((child, child_selector, len(kept) + 1, child_base, child_depth))
+
+            # Reverse so children are popped (and numbered) in document order
+            stack.extend(reversed(kept))
+
+        return selector_map
@@ -0,0 +1,116 @@
+import json
+
+
+def _shallow(node: dict) -> dict:
+    return {k: v for k, v in node.items() if k != "children"}
+
+
+def _child_ids(node: dict) -> list:
+    return [child["element_id"] for child in node.get("children", ())]
+
+
+def _kept_order(node: dict, element_id: int, other: dict) -> list:
+    # The children that are under the same parent in the other snapshot too, in this one's order
+    return [child_id for child_id in _child_ids(node) if child_id in other and other[child_id][1] == element_id]
+
+
+def _index_tree(tree: dict) -> dict:
+    """Maps element_id to (node, parent element_id) for every node of a DOMSerializer tree."""
+    index = {tree["element_id"]: (tree, None)}
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        for child in node.get("children", ()):
+            index[child["element_id"]] = (child, node["element_id"])
+            stack.append(child)
+    return index
+
+
+class DOMDiffer:
+    """Keeps the last snapshot sent to the LLM and describes later snapshots as deltas.
+
+    Snapshots must carry stable element_ids (see element_identity.ElementIdentity), so
+    an element present in both snapshots has the same id in each and the LLM can keep
+    using ids it has already seen. A full snapshot is required when there is no
+    previous one, the URL changed, the delta would not be much smaller than the
+    snapshot, or too many deltas have been chained. Added subtrees carry their index
+    among the parent's children, and a parent whose children changed order is listed
+    with the new order, so a re-sorted list isn't mistaken for the old one.
+    """
+
+    def __init__(self, max_change_ratio: float = 0.3, max_deltas: int = 10):
+        self.max_change_ratio = max_change_ratio
+        self.max_deltas = max_deltas
+        self.reset()
+
+    def reset(self):
+        self.previous = None
+        self.previous_url = None
+        self.deltas_sent = 0
+
+    def diff(self, tree: dict, url: str):
+        """Commits `tree` as the last sent snapshot and returns the delta from the previous
+        one, or None if a full snapshot must be sent."""
+        if self.previous is None or url != self.previous_url or self.deltas_sent >= self.max_deltas:
+            self.reset()
+
+        index = _index_tree(tree)
+        delta = None
+        if self.previous is not None:
+            delta = self._delta(self.previous, index)
+            size = len(json.dumps(delta, ensure_ascii=False))
+            if size > self.max_change_ratio * len(json.dumps(tree, ensure_ascii=False)):
+                delta = None
+
+        self.previous = index
+        self.previous_url = url
+        self.deltas_sent = self.deltas_sent + 1 if delta is not None else 0
+        return delta
+
+    @staticmethod
+    def _delta(old: dict, new: dict) -> dict:
+        changes = []
+        anchors = {}
+
+        def anchor(node):
+            anchors[node["element_id"]] = _shallow(node)
+
+        for element_id, (node, parent_id) in new.items():
+            if element_id not in old:
+                # Only report the root of an added subtree
+                if parent_id in old and parent_id in new:
+                    parent = new[parent_id][0]
+                    changes.append({"change": "added", "parent_id": parent_id, "index": _child_ids(parent).index(element_id), "node": node})
+                    anchor(parent)
+                continue
+
+            old_node, old_parent_id = old[element_id]
+            if parent_id is not None and parent_id not in old:
+                # Moved into a new subtree, which is already reported with this node in it
+                continue
+            if old_parent_id != parent_id and parent_id in new:
+                # Moved, reported as a removal and an addition under the new parent
+                changes.append({"change": "removed", "element_id": element_id})
+                parent = new[parent_id][0]
+                changes.append({"change": "added", "parent_id": parent_id, "index": _child_ids(parent).index(element_id), "node": node})
+                anchor(parent)
+                continue
+
+            if old_node.get("attrs") != node.get("attrs") or old_node.get("text") != node.get("text"):
+                changes.append({
+                    "change": "changed",
+                    "element_id": element_id,
+                    "attrs": node.get("attrs", {}),
+                    "text": node.get("text", ""),
+                })
+                if parent_id is not None:
+                    anchor(new[parent_id][0])
+            if _kept_order(node, element_id, old) != _kept_order(old_node, element_id, new):
+                changes.append({"change": "reordered", "element_id": element_id, "children": _child_ids(node)})
+
+        for element_id, (node, parent_id) in old.items():
+            if element_id not in new and parent_id in new:
+                changes.append({"change": "removed", "element_id": element_id})
+                anchor(new[parent_id][0])
+
+        return {"changes": changes, "context": list(anchors.values())}
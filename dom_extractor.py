@@ -0,0 +1,105 @@
+import json
+
+from dom_compactor import ESSENTIAL_CONTENT_TAGS, ESSENTIAL_ATTRIBUTES
+
+
+AGENT_ID_ATTRIBUTE = "data-agent-id"
+
+# Walks the live DOM in the page, pruning exactly like DOMCompactor but also skipping
+# elements that are not rendered. Every kept element is tagged with AGENT_ID_ATTRIBUTE
+# so it can be found again with a trivial selector. Returns the tree (in the DOMSerializer
+# shape) and each element's top offset in the viewport as one JSON string, which is
+# cheaper to ship over the wire than nested objects.
+EXTRACT_SCRIPT = """
+const contentTags = new Set(arguments[0]);
+const keptAttributes = new Set(arguments[1]);
+const idAttribute = arguments[2];
+let counter = 0;
+const positions = {};
+
+document.querySelectorAll("[" + idAttribute + "]").forEach(el => el.removeAttribute(idAttribute));
+
+function isVisible(el) {
+    // Options of a closed select have no layout but are part of a visible control
+    if (el.tagName.toLowerCase() === "option") return true;
+    if (el.hasAttribute("hidden")) return false;
+    if (el.checkVisibility) return el.checkVisibility({ visibilityProperty: true });
+    if (el.getClientRects().length === 0) return false;
+    return getComputedStyle(el).visibility !== "hidden";
+}
+
+function walk(el) {
+    const node = { element_id: counter++, tag: el.tagName.toLowerCase() };
+    el.setAttribute(idAttribute, node.element_id);
+    positions[node.element_id] = Math.round(el.getBoundingClientRect().top);
+
+    const attrs = {};
+    let hasAttrs = false;
+    for (const attr of el.attributes) {
+        if (keptAttributes.has(attr.name)) {
+            attrs[attr.name] = attr.value;
+            hasAttrs = true;
+        }
+    }
+    if (node.tag === "select") {
+        attrs["data-value"] = el.options[el.selectedIndex]?.text || "";
+        hasAttrs = true;
+    } else if (node.tag === "input" || node.tag === "textarea") {
+        attrs["data-value"] = el.value || "";
+        hasAttrs = true;
+    }
+    if (hasAttrs) node.attrs = attrs;
+
+    const text = [];
+    const children = [];
+    for (const child of el.childNodes) {
+        if (child.nodeType === Node.TEXT_NODE) {
+            const value = child.nodeValue.trim();
+            if (value) text.push(value);
+        } else if (child.nodeType === Node.ELEMENT_NODE) {
+            const tag = child.tagName.toLowerCase();
+            if (contentTags.has(tag) && isVisible(child)) children.push(walk(child));
+        }
+    }
+    if (text.length) node.text = text.join(" ");
+    if (children.length) node.children = children;
+    return node;
+}
+
+const tree = walk(document.body);
+return JSON.stringify({ tree: tree, positions: positions });
+"""
+
+
+class BrowserDOMExtractor:
+    """Extracts the compact DOM inside the browser with a single execute_script call.
+
+    Instead of transferring the full page source and parsing it in Python, the page
+    runs EXTRACT_SCRIPT and returns only the pruned, visible elements. Selectors in
+    the returned map point at the `data-agent-id` attribute the script stamps on
+    each element.
+    """
+
+    def __init__(self, content_tags=None, attributes=None):
+        self.content_tags = sorted(content_tags or ESSENTIAL_CONTENT_TAGS)
+        self.attributes = sorted(attributes or ESSENTIAL_ATTRIBUTES)
+
+    def extract_raw(self, driver) -> str:
+        """Runs the walker and returns its JSON string untouched."""
+        return driver.execute_script(EXTRACT_SCRIPT, self.content_tags, self.attributes, AGENT_ID_ATTRIBUTE)
+
+    def extract(self, driver):
+        """Returns the extracted tree, its element_id -> selector map and element_id -> top offset map."""
+        data = json.loads(self.extract_raw(driver))
+        tree = data["tree"]
+        positions = {int(element_id): top for element_id, top in data["positions"].items()}
+
+        selector_map = {}
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            element_id = node["element_id"]
+            selector_map[element_id] = f'[{AGENT_ID_ATTRIBUTE}="{element_id}"]'
+            stack.extend(node.get("children", ()))
+
+        return tree, selector_map, positions
@@ -0,0 +1,143 @@
+import json
+
+from bs4 import Tag, NavigableString, Comment, Doctype
+
+
+DOM_FORMATS = ("json", "lines")
+
+# Bookkeeping attributes written by the compactor, emitted separately or not at all
+INTERNAL_ATTRIBUTES = {"_element_id", "idx"}
+
+
+def _direct_text(el: Tag) -> str:
+    parts = []
+    for child in el.children:
+        if isinstance(child, NavigableString) and not isinstance(child, (Comment, Doctype)):
+            text = child.strip()
+            if text:
+                parts.append(text)
+    return " ".join(parts)
+
+
+def _kept_attributes(el: Tag) -> dict:
+    attrs = {}
+    for key, value in el.attrs.items():
+        if key in INTERNAL_ATTRIBUTES:
+            continue
+        if isinstance(value, list):
+            value = " ".join(value)
+        attrs[key] = value
+    return attrs
+
+
+def _line(element_id: int, tag: str, attrs: dict, text: str, depth: int, omitted: int = 0) -> str:
+    line = f"{' ' * depth}[{element_id}] {tag}"
+    for key, value in attrs.items():
+        line += f" {key}={json.dumps(value, ensure_ascii=False)}"
+    if text:
+        line += f": {text}"
+    if omitted:
+        line += f" (+{omitted} omitted)"
+    return line
+
+
+class DOMSerializer:
+    """Serializes a compacted tree straight to the prompt format in one walk.
+
+    `json` emits nested objects ({"element_id", "tag", "attrs", "text", "children"})
+    with empty fields omitted. `lines` emits one element per line, indented by depth:
+    `[12] button type="submit": Sign in`.
+    """
+
+    def __init__(self, dom_format: str = "json"):
+        if dom_format not in DOM_FORMATS:
+            raise ValueError(f"Unknown DOM format: {dom_format}, expected one of {DOM_FORMATS}")
+        self.dom_format = dom_format
+
+    def serialize(self, root: Tag) -> str:
+        if self.dom_format == "lines":
+            return self._to_lines(root)
+        return self._to_json(root)
+
+    def serialize_tree(self, tree: dict) -> str:
+        """Serializes a tree that is already in the `json` shape (e.g. from BrowserDOMExtractor)."""
+        if self.dom_format == "lines":
+            lines = []
+            stack = [(tree, 0)]
+            while stack:
+                node, depth = stack.pop()
+                lines.append(_line(node["element_id"], node["tag"], node.get("attrs", {}), node.get("text", ""), depth, node.get("omitted", 0)))
+                stack.extend((child, depth + 1) for child in reversed(node.get("children", ())))
+            return "\n".join(lines)
+        return json.dumps(tree, ensure_ascii=False, separators=(",", ":"))
+
+    def to_tree(self, root: Tag) -> dict:
+        """Builds the `json` shape as nested dicts, for callers that need to inspect it."""
+        tree = {}
+        stack = [(root, tree)]
+
+        while stack:
+            el, node = stack.pop()
+            node["element_id"] = int(el["_element_id"])
+            node["tag"] = el.name
+            attrs = _kept_attributes(el)
+            if attrs:
+                node["attrs"] = attrs
+            text = _direct_text(el)
+            if text:
+                node["text"] = text
+
+            children = [c for c in el.children if isinstance(c, Tag)]
+            if children:
+                node["children"] = [{} for _ in children]
+                stack.extend(zip(children, node["children"]))
+
+        return tree
+
+    def _to_json(self, root: Tag) -> str:
+        out = []
+        dumps = json.dumps
+        stack = [root]
+
+        while stack:
+            item = stack.pop()
+            # Plain strings on the stack are closing brackets and separators
+            if isinstance(item, str):
+                out.append(item)
+                continue
+
+            out.append(f'{{"element_id":{int(item["_element_id"])},"tag":{dumps(item.name)}')
+            attrs = _kept_attributes(item)
+            if attrs:
+                out.append(f',"attrs":{dumps(attrs, ensure_ascii=False, separators=(",", ":"))}')
+            text = _direct_text(item)
+            if text:
+                out.append(f',"text":{dumps(text, ensure_ascii=False)}')
+
+            children = [c for c in item.children if isinstance(c, Tag)]
+            if not children:
+                out.append("}")
+                continue
+
+            out.append(',"children":[')
+            stack.append("]}")
+            stack.append(children[-1])
+            for child in reversed(children[:-1]):
+                stack.append(",")
+                stack.append(child)
+
+        return "".join(out)
+
+    def _to_lines(self, root: Tag) -> str:
+        lines = []
+        stack = [(root, 0)]
+
+        while stack:
+            el, depth = stack.pop()
+
+            lines.append(_line(int(el["_element_id"]), el.name, _kept_attributes(el), _direct_text(el), depth))
+
+            children = [c for c in el.children if isinstance(c, Tag)]
+            stack.extend((child, depth + 1) for child in reversed(children))
+
+        return "\n".join(lines)
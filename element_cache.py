@@ -0,0 +1,39 @@
+from selenium.common.exceptions import StaleElementReferenceException
+from selenium.webdriver.common.by import By
+
+
+class ElementCache:
+    """Caches resolved WebElements by element_id for the current snapshot.
+
+    The parser clears it whenever it takes a snapshot, since a selector such as
+    `ul > li:nth-of-type(1)` may name another node after the page changed. Within a
+    snapshot an entry is only reused while the element_id still maps to the same
+    selector. Stale references (the element was replaced or the page navigated) are
+    re-resolved once.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.elements = {}
+
+    def clear(self):
+        self.elements = {}
+
+    def get(self, element_id: int, selector: str):
+        cached = self.elements.get(element_id)
+        if cached is not None and cached[1] == selector:
+            return cached[0]
+
+        # XPath selectors (see selector_synthesizer) always start at the root
+        by = By.XPATH if selector.startswith("/") else By.CSS_SELECTOR
+        element = self.driver.find_element(by, selector)
+        self.elements[element_id] = (element, selector)
+        return element
+
+    def run(self, element_id: int, selector: str, action):
+        """Calls `action(element)` and returns its result, re-resolving a stale element once."""
+        try:
+            return action(self.get(element_id, selector))
+        except StaleElementReferenceException:
+            self.elements.pop(element_id, None)
+            return action(self.get(element_id, selector))
@@ -0,0 +1,131 @@
+import re
+from collections import deque
+
+
+# Attributes that tend to survive re-renders, most specific first
+IDENTITY_ATTRIBUTES = ("id", "data-testid", "name", "aria-label", "placeholder", "for", "href", "type", "role")
+
+# Attributes specific enough to match an element on their own
+UNIQUE_ATTRIBUTES = ("id", "data-testid", "name", "aria-label")
+
+TEXT_KEY_LENGTH = 40
+
+
+def _signature(node: dict) -> str:
+    attrs = node.get("attrs", {})
+    parts = [node["tag"]]
+    parts.extend(f"{name}={attrs[name]}" for name in IDENTITY_ATTRIBUTES if attrs.get(name))
+    return "|".join(parts)
+
+
+def _text_key(node: dict) -> str:
+    return re.sub(r"\s+", " ", node.get("text", "")).strip()[:TEXT_KEY_LENGTH]
+
+
+class ElementIdentity:
+    """Gives elements element_ids that stay the same from one snapshot to the next.
+
+    Each element is fingerprinted by its tag, identity attributes, text and the
+    signatures of its nearest `ancestor_depth` ancestors. A new snapshot is matched
+    against the previous one in passes of decreasing strictness:
+
+    1. the full fingerprint,
+    2. signature and text, ignoring ancestors (the element moved or was re-wrapped),
+    3. signature under the same (already matched) parent, ignoring text (text changed),
+    4. a unique attribute alone (id, data-testid, name, aria-label).
+
+    Identical fingerprints are matched in document order. Unmatched elements get fresh
+    ids that are never reused, so an old id can't silently point at another element.
+    An element that only changed position among its siblings keeps its id, parent and
+    text; DOMDiffer compares the child order of every parent to report it.
+    """
+
+    def __init__(self, ancestor_depth: int = 4):
+        self.ancestor_depth = ancestor_depth
+        self.reset()
+
+    def reset(self):
+        self.previous = []
+        self.previous_ids = []
+        self.next_id = 0
+
+    def _records(self, tree: dict) -> list:
+        # Pre-order records: [node, parent record index, signature, text, ancestor path]
+        records = []
+        stack = [(tree, None, ())]
+        while stack:
+            node, parent, ancestors = stack.pop()
+            signature = _signature(node)
+            index = len(records)
+            records.append([node, parent, signature, _text_key(node), ancestors])
+            child_ancestors = (ancestors + (signature,))[-self.ancestor_depth:]
+            stack.extend((child, index, child_ancestors) for child in reversed(node.get("children", ())))
+        return records
+
+    @staticmethod
+    def _unique_key(node: dict):
+        attrs = node.get("attrs", {})
+        for name in UNIQUE_ATTRIBUTES:
+            if attrs.get(name):
+                return (node["tag"], name, attrs[name])
+        return None
+
+    def assign(self, tree: dict) -> dict:
+        """Renumbers `tree` in place and remembers it as the previous snapshot.
+
+        Returns the original element_id -> stable element_id mapping.
+        """
+        records = self._records(tree)
+        new_ids = [None] * len(records)
+        used = set()
+
+        def key_full(record, ids):
+            return (record[4], record[2], record[3])
+
+        def key_moved(record, ids):
+            return (record[2], record[3])
+
+        def key_text_changed(record, ids):
+            parent = record[1]
+            if parent is None:
+                return ("root", record[2])
+            if ids[parent] is None:
+                return None
+            return (ids[parent], record[2])
+
+        def key_unique(record, ids):
+            return self._unique_key(record[0])
+
+        for key_fn in (key_full, key_moved, key_text_changed, key_unique):
+            candidates = {}
+            for previous_id, record in self.previous:
+                if previous_id in used:
+                    continue
+                key = key_fn(record, self.previous_ids)
+                if key is not None:
+                    candidates.setdefault(key, deque()).append(previous_id)
+
+            for index, record in enumerate(records):
+                if new_ids[index] is not None:
+                    continue
+                key = key_fn(record, new_ids)
+                queue = candidates.get(key) if key is not None else None
+                while queue:
+                    previous_id = queue.popleft()
+                    if previous_id not in used:
+                        new_ids[index] = previous_id
+                        used.add(previous_id)
+                        break
+
+        id_map = {}
+        for index, record in enumerate(records):
+            if new_ids[index] is None:
+                new_ids[index] = self.next_id
+                self.next_id += 1
+            node = record[0]
+            id_map[node["element_id"]] = new_ids[index]
+            node["element_id"] = new_ids[index]
+
+        self.previous = list(zip(new_ids, records))
+        self.previous_ids = new_ids
+        return id_map
@@ -0,0 +1,50 @@
+from bs4 import BeautifulSoup
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+
+DEFAULT_HTML_PARSER = "html.parser"
+
+
+def _html_parser(html: str) -> BeautifulSoup:
+    # Pure Python, and it never repairs the nesting, so a live DOM that the HTML
+    # parsing rules couldn't produce (e.g. a div a script put inside a p) survives
+    return BeautifulSoup(html, "html.parser")
+
+
+def _lxml(html: str) -> BeautifulSoup:
+    # libxml2 tokenizes in C and drives bs4's tree builder through callbacks
+    return BeautifulSoup(html, "lxml")
+
+
+# Backends build the same BeautifulSoup tree, so DOMCompactor, SelectorSynthesizer and
+# DOMSerializer work on any of them; only tokenizing and tree construction differ.
+# `python benchmark.py backends` checks they give identical ids, selectors and JSON.
+PARSER_BACKENDS = {
+    "html.parser": _html_parser,
+    "lxml": _lxml,
+}
+
+# Backends whose library is missing from this install
+_MISSING = {"lxml"} if lxml is None else set()
+
+
+def available_parsers() -> list:
+    return [name for name in PARSER_BACKENDS if name not in _MISSING]
+
+
+def resolve_parser(name: str) -> str:
+    """Checks a configured backend name, falling back to html.parser if its library isn't installed."""
+    if name not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown HTML parser: {name}, expected one of {tuple(PARSER_BACKENDS)}")
+    if name in _MISSING:
+        print(f"⚠️ html_parser={name} is not installed, parsing with {DEFAULT_HTML_PARSER}")
+        return DEFAULT_HTML_PARSER
+    return name
+
+
+def parse_html(html: str, parser: str = DEFAULT_HTML_PARSER) -> BeautifulSoup:
+    return PARSER_BACKENDS[parser](html)
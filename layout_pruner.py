@@ -0,0 +1,178 @@
+import json
+
+from prompt_budget import estimate_tokens
+
+
+LAYOUT_ATTRIBUTE = "data-agent-layout"
+
+# Stamps every element under body with its layout in one pass: "hidden", "empty" (no
+# box) or "top,bottom,left,right" in viewport pixels. Returns the viewport size.
+LAYOUT_SCRIPT = """
+const attr = arguments[0];
+for (const el of document.body.querySelectorAll("*")) {
+    // Options of a closed select have no layout but are part of a visible control
+    if (el.tagName === "OPTION") continue;
+    const hidden = el.hasAttribute("hidden") || (el.checkVisibility
+        ? !el.checkVisibility({ visibilityProperty: true })
+        : el.getClientRects().length === 0 || getComputedStyle(el).visibility === "hidden");
+    if (hidden) {
+        el.setAttribute(attr, "hidden");
+        continue;
+    }
+    const r = el.getBoundingClientRect();
+    el.setAttribute(attr, r.width && r.height
+        ? [r.top, r.bottom, r.left, r.right].map(Math.round).join(",")
+        : "empty");
+}
+return [window.innerWidth, window.innerHeight];
+"""
+
+RULES = ("hidden", "zero_size", "offscreen", "viewport", "wrappers")
+
+WRAPPER_TAGS = {"div", "span"}
+# Attributes that make a wrapper worth keeping
+WRAPPER_NEUTRAL_ATTRIBUTES = {"class"}
+# Controls are kept even without a box; custom checkboxes and file inputs are often 0x0
+FORM_CONTROLS = {"input", "select", "textarea", "option", "button"}
+
+
+def _tokens(node: dict) -> int:
+    return estimate_tokens(json.dumps(node, ensure_ascii=False, separators=(",", ":")))
+
+
+def _subtree_ids(node: dict):
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current["element_id"]
+        stack.extend(current.get("children", ()))
+
+
+class LayoutPruner:
+    """Drops what a user cannot see from a DOMSerializer tree, using layout from the page.
+
+    `annotate` stamps every element with its box in one script call (LAYOUT_SCRIPT);
+    the attribute must survive extraction (add LAYOUT_ATTRIBUTE to the kept attributes),
+    then `prune` removes per rule, in order: hidden and `aria-hidden` subtrees, boxes
+    without size and no sized descendant, elements scrolled out sideways (carousels),
+    elements further than `viewport_screens` screens above or below the viewport (off
+    when None) and class-only div/span wrappers that are empty or hold a single child.
+    """
+
+    def __init__(self, viewport_screens: float = None):
+        self.viewport_screens = viewport_screens
+        self.viewport = (0, 0)
+        self.stats = {}
+
+    def annotate(self, driver):
+        self.viewport = tuple(driver.execute_script(LAYOUT_SCRIPT, LAYOUT_ATTRIBUTE))
+
+    def _remove_reason(self, node: dict, layout):
+        attrs = node.get("attrs", {})
+        if layout == "hidden" or attrs.get("aria-hidden") == "true":
+            return "hidden"
+        if layout is None or layout == "empty":
+            return None
+
+        top, bottom, left, right = layout
+        width, height = self.viewport
+        if width and (right <= 0 or left >= width):
+            return "offscreen"
+        if self.viewport_screens is not None and height:
+            margin = self.viewport_screens * height
+            if bottom < -margin or top > height + margin:
+                return "viewport"
+        return None
+
+    def prune(self, tree: dict, selector_map: dict = None, positions: dict = None):
+        """Prunes `tree` in place; pruned ids are dropped from `selector_map` and `positions`.
+
+        Returns (tree, stats) with the nodes and approximate tokens each rule removed.
+        """
+        stats = {rule: {"nodes": 0, "tokens": 0} for rule in RULES}
+        removed_ids = []
+
+        def remove(node, rule):
+            ids = list(_subtree_ids(node))
+            stats[rule]["nodes"] += len(ids)
+            stats[rule]["tokens"] += _tokens(node)
+            removed_ids.extend(ids)
+
+        def layout_of(node):
+            value = node.get("attrs", {}).pop(LAYOUT_ATTRIBUTE, None)
+            if "attrs" in node and not node["attrs"]:
+                del node["attrs"]
+            if value is None or value in ("hidden", "empty"):
+                return value
+            return tuple(int(part) for part in value.split(","))
+
+        # Post-order, so a node is judged after its children and knows whether any has a box
+        has_box = {}
+        stack = [(tree, False)]
+        while stack:
+            node, visited = stack.pop()
+            if not visited:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.get("children", ()))
+                continue
+
+            layout = layout_of(node)
+            kept = []
+            for child in node.get("children", ()):
+                reason = child.pop("_reason", None)
+                if reason is None and not has_box[child["element_id"]] and child["tag"] not in FORM_CONTROLS:
+                    reason = "zero_size"
+                if reason:
+                    remove(child, reason)
+                else:
+                    kept.append(child)
+
+            box = isinstance(layout, tuple) or layout is None
+            has_box[node["element_id"]] = box or any(has_box[child["element_id"]] for child in kept)
+            if kept:
+                node["children"] = kept
+            else:
+                node.pop("children", None)
+
+            if node is not tree:
+                reason = self._remove_reason(node, layout)
+                if reason:
+                    node["_reason"] = reason
+
+        # Wrapper chains, top-down on what is left
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            children = []
+            for child in node.get("children", ()):
+                while self._is_wrapper(child) and len(child.get("children", ())) == 1:
+                    stats["wrappers"]["nodes"] += 1
+                    stats["wrappers"]["tokens"] += _tokens({k: v for k, v in child.items() if k != "children"})
+                    removed_ids.append(child["element_id"])
+                    child = child["children"][0]
+                if self._is_wrapper(child) and not child.get("children"):
+                    remove(child, "wrappers")
+                    continue
+                children.append(child)
+            if children:
+                node["children"] = children
+            else:
+                node.pop("children", None)
+            stack.extend(children)
+
+        for element_id in removed_ids:
+            if selector_map is not None:
+                selector_map.pop(element_id, None)
+            if positions is not None:
+                positions.pop(element_id, None)
+
+        self.stats = stats
+        return tree, stats
+
+    @staticmethod
+    def _is_wrapper(node: dict) -> bool:
+        return (
+            node["tag"] in WRAPPER_TAGS
+            and not node.get("text")
+            and set(node.get("attrs", {})) <= WRAPPER_NEUTRAL_ATTRIBUTES
+        )
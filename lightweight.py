@@ -0,0 +1,106 @@
+import fnmatch
+import weakref
+
+
+def _extensions(*extensions) -> list:
+    # Anchored to the end of the path, with or without a query, so "/gifts/" or a host
+    # like "png.example.com" never matches
+    return [pattern for ext in extensions for pattern in (f"*.{ext}", f"*.{ext}?*")]
+
+
+def _hosts(*hosts) -> list:
+    # The host itself and its subdomains, never the same name in a path or query
+    return [pattern for host in hosts for pattern in (f"*://{host}/*", f"*://*.{host}/*")]
+
+
+# URL patterns per resource category, in the wildcard syntax of CDP Network.setBlockedURLs
+RESOURCE_PATTERNS = {
+    "images": _extensions("png", "jpg", "jpeg", "gif", "webp", "avif", "ico", "bmp", "svg"),
+    "media": _extensions("mp4", "webm", "ogg", "mp3", "wav", "m4a", "mov", "m3u8"),
+    "fonts": _extensions("woff", "woff2", "ttf", "otf", "eot") + _hosts("fonts.googleapis.com", "fonts.gstatic.com"),
+    "analytics": [
+        *_hosts(
+            "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+            "connect.facebook.net", "hotjar.com", "segment.io", "mixpanel.com", "clarity.ms",
+        ),
+        "*://cdn.segment.com/analytics*", "*/analytics.js", "*/analytics.js?*", "*/gtag/js", "*/gtag/js?*",
+    ],
+}
+
+DEFAULT_BLOCKED = "images,media,fonts,analytics"
+
+# Finishes CSS animations and transitions immediately, so the page settles sooner
+DISABLE_ANIMATIONS_SCRIPT = """
+(() => {
+    const css = "*, *::before, *::after { animation-duration: 0s !important; animation-delay: 0s !important; "
+        + "transition-duration: 0s !important; transition-delay: 0s !important; scroll-behavior: auto !important; }";
+    const add = () => {
+        const style = document.createElement("style");
+        style.textContent = css;
+        (document.head || document.documentElement).appendChild(style);
+    };
+    if (document.documentElement) add(); else document.addEventListener("DOMContentLoaded", add);
+})();
+"""
+
+
+# Per driver, the tabs (window handles) the animation script is registered in, with its
+# identifier; a script added twice would run twice in every page the tab loads
+_animation_scripts = weakref.WeakKeyDictionary()
+
+
+def _patterns(spec: str) -> list:
+    # Entries are category names or raw URL patterns
+    patterns = []
+    for entry in (item.strip() for item in spec.split(",")):
+        if entry:
+            patterns.extend(RESOURCE_PATTERNS.get(entry, [entry]))
+    return patterns
+
+
+def blocked_patterns(block: str = DEFAULT_BLOCKED, allow: str = "") -> list:
+    """URL patterns to block: those of `block` minus any matched by `allow`.
+
+    Both are comma separated category names (see RESOURCE_PATTERNS) or URL patterns.
+    setBlockedURLs has no exceptions, so an allowed pattern drops every blocked pattern
+    it matches or that matches it, e.g. allowing "*.svg*" keeps SVG images loading.
+    """
+    allowed = _patterns(allow)
+    return [
+        pattern for pattern in dict.fromkeys(_patterns(block))
+        if not any(pattern == keep or fnmatch.fnmatch(pattern, keep) or fnmatch.fnmatch(keep, pattern) for keep in allowed)
+    ]
+
+
+def lightweight_options(options, blocked: list):
+    """Chrome flags for the lightweight profile; `blocked` is the result of blocked_patterns."""
+    if any(pattern in blocked for pattern in RESOURCE_PATTERNS["images"]):
+        options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    options.add_argument("--mute-audio")
+    options.add_argument("--autoplay-policy=user-gesture-required")
+    options.add_argument("--force-prefers-reduced-motion")
+    options.add_argument("--disable-extensions")
+    options.add_argument("--disable-background-networking")
+    options.add_argument("--disable-component-update")
+    options.add_argument("--disable-default-apps")
+    options.add_argument("--no-first-run")
+
+
+def apply_lightweight(driver, blocked: list):
+    """Blocks the URL patterns and disables animations in the current tab.
+
+    CDP settings are per tab, so this has to run again after switching to a new one.
+    Running it again in the same tab is safe: the animation script is only added once.
+    """
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked})
+        driver.execute_cdp_cmd("Emulation.setEmulatedMedia", {"features": [{"name": "prefers-reduced-motion", "value": "reduce"}]})
+        scripts = _animation_scripts.setdefault(driver, {})
+        handle = driver.current_window_handle
+        if handle not in scripts:
+            added = driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": DISABLE_ANIMATIONS_SCRIPT})
+            scripts[handle] = added["identifier"]
+    except Exception:
+        # Not a Chromium driver; the launch flags still apply
+        pass
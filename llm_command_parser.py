@@ -1,115 +1,207 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
-from webdriver_manager.chrome import ChromeDriverManager
 import json
-import html_to_json
-from bs4 import BeautifulSoup, Tag
+from html_parsers import DEFAULT_HTML_PARSER, parse_html, resolve_parser
+from dom_compactor import DOMCompactor, ESSENTIAL_ATTRIBUTES
+from dom_serializer import DOMSerializer
+from dom_extractor import BrowserDOMExtractor
+from dom_diff import DOMDiffer
+from element_identity import ElementIdentity
+from page_readiness import PageReadiness
+from element_cache import ElementCache
+from prompt_budget import fit_dom
+from task_recorder import DESCRIBE_SCRIPT, RESOLVE_SCRIPT
+from browser_pool import launch_browser
+from lightweight import apply_lightweight
+from layout_pruner import LayoutPruner, LAYOUT_ATTRIBUTE
+import tracing
 import time
 import keyboard 
 
 
+EXTRACTION_MODES = ("page_source", "browser")
+
+# Actions that always replace the page the current element_ids were taken from
+NAVIGATING_ACTIONS = {"goto", "navigate", "switch_tab"}
+
+# Arguments each action method takes, in order, from the LLM's action object
+ACTION_ARGUMENTS = {
+    "click": ["element_id"],
+    "fill": ["element_id", "text"],
+    "scroll": ["direction", "pixels"],
+    "screenshot": ["path"],
+    "wait": ["seconds"],
+    "navigate": ["direction"],
+    "switch_tab": ["index"],
+    "extract": ["element_id"],
+    "goto": ["url"],
+    "press_enter": ["element_id"],
+    "move_slider": ["target_text", "target_value", "increment_mode" ,"slides_per_sec"],
+    "get_coordinates": ["element_id"],
+    "zoom": ["scan_name", "target_zoom", "direction"],
+    "enter_fullscreen": ["scan_name"]
+}
+
+# Replay targets live outside the snapshot's element_ids, which are never negative
+REPLAY_ELEMENT_ID = -1
+
+
 class LLMCommandParser:
-    def __init__(self, url: str, usr_dir: str):
-        options = webdriver.ChromeOptions()
-        options.add_argument(f"--user-data-dir={usr_dir}")
-        options.add_argument("--log-level=3")
-        options.add_experimental_option("excludeSwitches", ["enable-logging"])
-        options.add_argument("disable-logging")
-
-        self.driver = webdriver.Chrome(
-            service=Service(ChromeDriverManager().install(), log_path="NUL"),
-            options=options,
-        )
-        self.goto(url)
+    def __init__(self, url: str, usr_dir: str, dom_format: str = "json", extraction: str = "page_source", diff: bool = False, ready_timeout: float = 10, driver=None, headless: bool = False, blocked_urls: list = None, pruner: LayoutPruner = None, stable_ids: bool = True, html_parser: str = DEFAULT_HTML_PARSER, ready_max_inflight: int = 0, ready_request_max_age_ms: int = 500):
+        if extraction not in EXTRACTION_MODES:
+            raise ValueError(f"Unknown extraction mode: {extraction}, expected one of {EXTRACTION_MODES}")
+
+        # A browser handed in (e.g. a warm one from BrowserPool) is only navigated if it is elsewhere
+        self.ready_timeout = ready_timeout
+        self.ready_max_inflight = ready_max_inflight
+        self.ready_request_max_age_ms = ready_request_max_age_ms
+        self.blocked_urls = blocked_urls
+        self.attach(driver if driver is not None else launch_browser(usr_dir, headless=headless, blocked_urls=blocked_urls))
+        if url and self.driver.current_url.rstrip("/") != url.rstrip("/"):
+            self.goto(url)
 
         self.page_html = self.driver.page_source
 
         self.selector_map = {}
-
+        self.positions = {}
+        self.dom_budget_stats = {}
+        # The pruner reads the layout stamped on each element, so that attribute is kept too
+        self.pruner = pruner
+        self.prune_stats = {}
+        attributes = ESSENTIAL_ATTRIBUTES | {LAYOUT_ATTRIBUTE} if pruner is not None else None
+        self.compactor = DOMCompactor(attributes=attributes)
+        self.serializer = DOMSerializer(dom_format)
+        self.extraction = extraction
+        self.html_parser = resolve_parser(html_parser)
+        self.extractor = BrowserDOMExtractor(attributes=attributes)
+        self.differ = DOMDiffer() if diff else None
+        # Deltas refer to elements by id, so diffing always needs stable ids
+        self.identity = ElementIdentity() if stable_ids or diff else None
+        # Set by TabManager.claim when this parser shares its browser with other tasks
+        self.tabs = None
+        self.tab = None
+        # A tab this parser's last action opened in a shared browser, adopted on settle
+        self.opened_tab = None
+        # Requests of the tasks run on this parser, sent as "Previous User Prompts"; kept
+        # per parser so tasks in other tabs or sessions never see each other's requests
+        self.prompt_history = []
+        # Set by llm_handler.stop_task (the esc hotkey), checked before each step
+        self.stop_requested = False
+        # When set, execute_batch stores a locator for every element it acts on
+        self.record_locators = False
+        self.located = 0
+
+
+    def attach(self, driver):
+        """Switches to another browser; element_ids of the previous one no longer apply."""
+        self.driver = driver
+        self.readiness = PageReadiness(driver, timeout=self.ready_timeout, max_inflight=self.ready_max_inflight, request_max_age_ms=self.ready_request_max_age_ms)
+        self.elements = ElementCache(driver)
+        self.selector_map = {}
+        self.positions = {}
+        self.reset_snapshot()
 
     def page_source_parser(self, html: str) -> str:
-        soup = BeautifulSoup(html, "html.parser")
-        self.selector_map = {}  # Reset selector map
-        element_counter = [0]   # Counter for assigning unique element IDs
-
-        ESSENTIAL_CONTENT_TAGS = {
-            "html", "body", "button", "a", "label", "input", "textarea", "select", "option",
-            "span", "div", "h1", "h2", "h3", "h4", "h5", "h6", "p", "li", "form", "img", "nav",
-            "section", "article", "table", "thead", "tbody", "tr", "td", "th", "ul", "ol",
-            "iframe", "video", "audio", "i", "canvas"
-        }
-
-        ESSENTIAL_ATTRIBUTES = {
-            "id", "class", "name", "type", "value", "href", "alt", "title", "role", "placeholder",
-            "onclick", "onchange", "for", "selected", "checked", "min", "max", "step", "data-value",
-            "aria-label", "aria-hidden", "data-testid"
-        }
-
-        def prune_element(el: Tag):
-            for child in list(el.contents):
-                if isinstance(child, Tag):
-                    if child.name not in ESSENTIAL_CONTENT_TAGS:
-                        child.decompose()
-                    else:
-                        prune_element(child)
-            el.attrs = {k: v for k, v in el.attrs.items() if k in ESSENTIAL_ATTRIBUTES}
-
-        for tag in soup(["script", "style"]):
-            tag.decompose()
-
-        prune_element(soup.body)
-
-        def build_selector(el: Tag):
-            parts = []
-            while el and el.name != '[document]':
-                part = el.name
-                if el.has_attr('id'):
-                    part += f"#{el['id']}"
-                elif el.has_attr('class'):
-                    classes = [cls for cls in el['class'] if cls.strip()]
-                    if classes:
-                        part += '.' + '.'.join(classes)
-                else:
-                    if el.parent:
-                        siblings = [sib for sib in el.parent.find_all(el.name, recursive=False)]
-                        index = siblings.index(el) + 1
-                        part += f":nth-of-type({index})"
-                parts.insert(0, part)
-                el = el.parent
-            return ' > '.join(parts)
-
-        def assign_element_ids(el: Tag):
-            selector = build_selector(el)
-            el['_element_id'] = element_counter[0]
-            self.selector_map[element_counter[0]] = selector
-            element_counter[0] += 1
-
-            # Add idx based on order among all siblings (not just same tag)
-            if el.parent:
-                all_element_siblings = [c for c in el.parent.contents if isinstance(c, Tag)]
-                el['idx'] = str(all_element_siblings.index(el) + 1)
+        with tracing.span("parse", html_bytes=len(html)):
+            soup = parse_html(html, self.html_parser)
+            self.selector_map = self.compactor.compact(soup.body)
+            self.elements.clear()
+
+            return self.serializer.serialize(soup.body)
+
+    def _snapshot_tree(self) -> dict:
+        # A selector can keep its string and point at another node in the new snapshot
+        # (a positional one after an insert), so elements are only reused within a batch
+        self.elements.clear()
+        if self.pruner is not None:
+            self.pruner.annotate(self.driver)
+
+        # "browser" prunes inside the page in one script call, "page_source" parses in Python
+        with tracing.span("parse", extraction=self.extraction):
+            if self.extraction == "browser":
+                tree, self.selector_map, self.positions = self.extractor.extract(self.driver)
+            else:
+                self.positions = {}
+                soup = parse_html(self.driver.page_source, self.html_parser)
+                self.selector_map = self.compactor.compact(soup.body)
+                tree = self.serializer.to_tree(soup.body)
+
+        if self.pruner is not None:
+            # After compaction, so the selectors were built on the real DOM structure
+            with tracing.span("prune"):
+                tree, self.prune_stats = self.pruner.prune(tree, self.selector_map, self.positions)
+
+        if self.identity is not None:
+            with tracing.span("identity"):
+                self._remap_ids(self.identity.assign(tree))
+        return tree
+
+    def _remap_ids(self, id_map: dict):
+        self.selector_map = {id_map[element_id]: selector for element_id, selector in self.selector_map.items()}
+        self.positions = {id_map[element_id]: top for element_id, top in self.positions.items()}
+
+    def snapshot(self) -> str:
+        # Only the plain page_source path can serialize straight from the parsed page
+        if self.identity is not None or self.extraction == "browser" or self.pruner is not None:
+            return self.serializer.serialize_tree(self._snapshot_tree())
+        return self.page_source_parser(self.driver.page_source)
+
+    def snapshot_for_prompt(self, user_request: str = "", token_budget: int = None):
+        """Returns (page_data, is_delta); page_data is a DOM delta when diffing allows it.
+
+        With `token_budget`, the snapshot is trimmed to the elements most relevant to
+        `user_request` (see prompt_budget.fit_dom) and the trimming stats are left in
+        `dom_budget_stats`. Deltas are taken between trimmed snapshots, the ones the LLM
+        actually saw, so an element that comes into the trimmed set is reported as added.
+        """
+        with tracing.span("snapshot", extraction=self.extraction, diff=self.differ is not None):
+            self.dom_budget_stats = {}
+            if self.differ is None and token_budget is None:
+                return self.snapshot(), False
+
+            tree = self._snapshot_tree()
+            if token_budget is not None:
+                tree, self.dom_budget_stats = fit_dom(tree, token_budget, user_request, self.positions)
+            if self.differ is not None:
+                delta = self.differ.diff(tree, self.driver.current_url)
+                if delta is not None:
+                    return json.dumps(delta, ensure_ascii=False), True
+            return self.serializer.serialize_tree(tree), False
+
+    def describe(self, element_id: int) -> dict:
+        selector = self.selector_map[element_id]
+        return self.elements.run(element_id, selector, lambda element: self.driver.execute_script(DESCRIBE_SCRIPT, element))
 
-            for child in el.children:
-                if isinstance(child, Tag):
-                    assign_element_ids(child)
+    def locate(self, locator: dict):
+        """Finds the element a recorded locator points to on the current page.
 
-        assign_element_ids(soup.body)
+        Returns an element_id usable by the core actions, or None if nothing matches.
+        """
+        element = self.driver.execute_script(RESOLVE_SCRIPT, locator)
+        if element is None:
+            return None
 
-        cleaned_html = str(soup.body)
-        data = html_to_json.convert(cleaned_html)
+        # A fresh marker each time so the element cache never hands back the previous target
+        self.located += 1
+        self.driver.execute_script("arguments[0].setAttribute('data-replay-id', arguments[1]);", element, str(self.located))
+        self.selector_map[REPLAY_ELEMENT_ID] = f'[data-replay-id="{self.located}"]'
+        return REPLAY_ELEMENT_ID
 
-        return json.dumps(data)
+    def reset_snapshot(self):
+        # The next prompt snapshot will be a full one, numbered from 0 again
+        if getattr(self, "differ", None) is not None:
+            self.differ.reset()
+        if getattr(self, "identity", None) is not None:
+            self.identity.reset()
 
 
     # Core Action: Goto URL
     def goto(self, url: str):
         try:
             self.driver.get(url)
+            self.elements.clear()
             
-            # Wait until the document is fully loaded
-            time.sleep(3)
+            # Wait until the document is loaded and has settled
+            self.readiness.wait()
 
             return "Command executed successfully"
         except Exception as e:
@@ -119,8 +211,7 @@ class LLMCommandParser:
     def click(self, element_id: int):
         try:
             selector = self.selector_map[element_id]
-            element = self.driver.find_element(By.CSS_SELECTOR, selector)
-            element.click()
+            self.elements.run(element_id, selector, lambda element: element.click())
             return "Command executed successfully"
         except Exception as e:
             return f"Error occurred while trying to execute command, Error: {type(e).__name__}"
@@ -129,9 +220,11 @@ class LLMCommandParser:
     def fill(self, element_id: int, text: str):
         selector = self.selector_map[element_id]
         try:
-            element = self.driver.find_element(By.CSS_SELECTOR, selector)
-            element.clear()
-            element.send_keys(text)
+            def clear_and_type(element):
+                element.clear()
+                element.send_keys(text)
+
+            self.elements.run(element_id, selector, clear_and_type)
             return "Command executed successfully"
         except Exception as e:
             return f"Error occurred while trying to execute command, Error: {type(e).__name__}"
@@ -151,16 +244,14 @@ class LLMCommandParser:
     def extract(self, element_id: int):
         selector = self.selector_map[element_id]
         try:
-            element = self.driver.find_element(By.CSS_SELECTOR, selector)
-            return element.text
+            return self.elements.run(element_id, selector, lambda element: element.text)
         except Exception as e:
             return f"Error occurred while trying to execute command, Error: {type(e).__name__}"
         
     def press_enter(self, element_id: int):
         selector = self.selector_map[element_id]
         try:
-            element = self.driver.find_element(By.CSS_SELECTOR, selector)
-            element.send_keys(Keys.ENTER)
+            self.elements.run(element_id, selector, lambda element: element.send_keys(Keys.ENTER))
             return "Command executed successfully"
         except Exception as e:
             return f"Error occurred while trying to execute command, Error: {type(e).__name__}"
@@ -177,8 +268,16 @@ class LLMCommandParser:
     def switch_tab(self, index: int):
         try:
             tabs = self.driver.window_handles
+            if self.tabs is not None:
+                # Tabs of other tasks sharing this browser are out of reach
+                tabs = self.tabs.owned(self, tabs)
             if index < len(tabs):
-                self.driver.switch_to.window(tabs[index])
+                if self.tabs is not None:
+                    self.tabs.switch(self, tabs[index])
+                else:
+                    self.driver.switch_to.window(tabs[index])
+                self._prepare_tab()
+                self.elements.clear()
                 return "Command executed successfully"
             else:
                 return f"Error: Tab index {index} out of range"
@@ -192,81 +291,98 @@ class LLMCommandParser:
                 self.driver.back()
             elif direction == "forward":
                 self.driver.forward()
+            self.elements.clear()
             return "Command executed successfully"
         except Exception as e:
             return f"Error occurred while trying to execute command, Error: {type(e).__name__}"
 
-    def parse_and_execute(self, llm_output: str):
-        try:
-            command = json.loads(llm_output)
-            action = command.get("action")
-            if not action:
-                print("❌ No 'action' field found.")
-                return
-
-            # Map actions to method argument unpacking
-            method_args = {
-                "click": ["element_id"],
-                "fill": ["element_id", "text"],
-                "scroll": ["direction", "pixels"],
-                "screenshot": ["path"],
-                "wait": ["seconds"],
-                "navigate": ["direction"],
-                "switch_tab": ["index"],
-                "extract": ["element_id"],
-                "goto": ["url"],
-                "press_enter": ["element_id"],
-                "move_slider": ["target_text", "target_value", "increment_mode" ,"slides_per_sec"],
-                "get_coordinates": ["element_id"],
-                "zoom": ["scan_name", "target_zoom", "direction"],
-                "enter_fullscreen": ["scan_name"]
-            }
+    def _prepare_tab(self):
+        # Resource blocking is set per tab
+        if self.blocked_urls is not None:
+            apply_lightweight(self.driver, self.blocked_urls)
 
-            method = getattr(self, action, None)
-            if not method:
-                print(f"⚠️ Unknown action: {action}")
-                return
+    def _run_action(self, command: dict):
+        action = command.get("action")
+        if not action:
+            print("❌ No 'action' field found.")
+            return
 
-            # Extract only the arguments that method needs
-            args = [command.get(arg) for arg in method_args.get(action, [])]
+        method = getattr(self, action, None)
+        if not method:
+            print(f"⚠️ Unknown action: {action}")
+            return
 
-            # Call the method with extracted arguments
-            result = method(*args)
-
-            current_page_html = self.page_source_parser(self.driver.page_source)
-
-            if len(self.driver.window_handles) > 1:
-                current = self.driver.current_window_handle
-                all_tabs = self.driver.window_handles
-
-                # Find the new tab handle (the one that's NOT the current one)
-                new_tab = [handle for handle in all_tabs if handle != current][0]
-
-                # Switch to the new tab
-                self.driver.switch_to.window(new_tab)
-
-                # Close the old tab
-                self.driver.switch_to.window(current)
-                self.driver.close()
-
-                # Switch back to the new tab (since old one is closed)
-                self.driver.switch_to.window(new_tab)
-                time.sleep(5)
-            
-            script = """
-            document.querySelectorAll("input, textarea, select").forEach(el => {
-                if (el.tagName.toLowerCase() === "select") {
-                    el.setAttribute("data-value", el.options[el.selectedIndex]?.text || "");
-                } else {
-                    el.setAttribute("data-value", el.value || "");
-                }
-            });
-            """
-            self.driver.execute_script(script)
-
-            time.sleep(1.5)
+        # Extract only the arguments that method needs
+        args = [command.get(arg) for arg in ACTION_ARGUMENTS.get(action, [])]
 
+        # Call the method with extracted arguments
+        with tracing.span(f"action.{action}"):
+            self.readiness.mark()
+            result = method(*args)
+        if self.tabs is not None:
+            # In the same browser call as the action, before another task can see the tab
+            new_tab = self.tabs.opened(self.driver.window_handles)
+            if new_tab is not None:
+                self.tabs.reserve(self, new_tab)
+                self.opened_tab = new_tab
+        return result
+
+    def _settle(self, ready_timeout: float = None):
+        # Runs once after an action or a batch, before the next snapshot is taken
+        with tracing.span("settle"):
+            self._settle_page(ready_timeout)
+
+    def _settle_page(self, ready_timeout: float = None):
+        self.readiness.wait(ready_timeout)
+
+        if self.tabs is not None:
+            # Other tabs may belong to other tasks, only follow one this task's action opened
+            new_tab, self.opened_tab = self.opened_tab, None
+            if new_tab is not None and new_tab in self.driver.window_handles:
+                current = self.tab
+                self.tabs.switch(self, new_tab)
+                self.tabs.close(self, current)
+                self.tabs.activate(self)
+                self._prepare_tab()
+                self.elements.clear()
+                self.readiness.wait(ready_timeout)
+
+        elif len(self.driver.window_handles) > 1:
+            current = self.driver.current_window_handle
+            all_tabs = self.driver.window_handles
+
+            # Find the new tab handle (the one that's NOT the current one)
+            new_tab = [handle for handle in all_tabs if handle != current][0]
+
+            # Switch to the new tab
+            self.driver.switch_to.window(new_tab)
+
+            # Close the old tab
+            self.driver.switch_to.window(current)
+            self.driver.close()
+
+            # Switch back to the new tab (since old one is closed)
+            self.driver.switch_to.window(new_tab)
+            self._prepare_tab()
+            self.elements.clear()
+            self.readiness.wait(ready_timeout)
+        
+        script = """
+        document.querySelectorAll("input, textarea, select").forEach(el => {
+            if (el.tagName.toLowerCase() === "select") {
+                el.setAttribute("data-value", el.options[el.selectedIndex]?.text || "");
+            } else {
+                el.setAttribute("data-value", el.value || "");
+            }
+        });
+        """
+        self.driver.execute_script(script)
 
+    def parse_and_execute(self, llm_output: str):
+        try:
+            command = json.loads(llm_output)
+            result = self._run_action(command)
+            self._settle()
             return result
 
         except json.JSONDecodeError:
@@ -274,6 +390,75 @@ class LLMCommandParser:
         except Exception as e:
             print(f"❌ Error during execution: {e}")
 
+    def execute_batch(self, actions: list, page_changed: bool = False, defer_waits: bool = False) -> list:
+        """Runs a list of LLM actions against the current snapshot as one unit.
+
+        The page is only settled once, after the batch. If an action navigates, the
+        remaining element actions are skipped since their element_ids belong to the
+        previous page. Stops at a "done" action. Returns one command_history entry
+        ({"command", "result", "duration_ms"}, plus "locator" when `record_locators`
+        is set) per action that was attempted.
+
+        With `defer_waits`, page loads are left to the caller: the batch returns right
+        after an action that navigates and is not settled. The caller waits, then runs
+        the rest with `page_changed` set, and finally settles.
+        """
+        if defer_waits:
+            with self.readiness.deferred():
+                return self._execute_batch(actions, page_changed, defer_waits)
+        return self._execute_batch(actions, page_changed, defer_waits)
+
+    def _execute_batch(self, actions: list, page_changed: bool, defer_waits: bool) -> list:
+        results = []
+        url = self.driver.current_url
+
+        for command in actions:
+            action = command.get("action") or ""
+            if action.lower() == "done":
+                break
+
+            if page_changed and "element_id" in command:
+                results.append({
+                    "command": command,
+                    "result": "Skipped, the page changed earlier in this batch so this element_id is no longer valid",
+                    "duration_ms": 0,
+                })
+                continue
+
+            locator = None
+            if self.record_locators and command.get("element_id") in self.selector_map:
+                try:
+                    locator = self.describe(command["element_id"])
+                except Exception:
+                    locator = None
+
+            start = time.perf_counter()
+            try:
+                result = self._run_action(command)
+            except Exception as e:
+                result = f"Error occurred while trying to execute command, Error: {type(e).__name__}"
+
+            navigated = action in NAVIGATING_ACTIONS or self.driver.current_url != url
+            if navigated:
+                self.readiness.wait()
+                url = self.driver.current_url
+                page_changed = True
+
+            entry = {
+                "command": command,
+                "result": result or "",
+                "duration_ms": round((time.perf_counter() - start) * 1000),
+            }
+            if locator is not None:
+                entry["locator"] = locator
+            results.append(entry)
+            if navigated and defer_waits:
+                return results
+
+        if not defer_waits:
+            self._settle()
+        return results
+
     # Cleanup
     def close(self):
         self.driver.quit()
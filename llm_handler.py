@@ -1,3 +1,5 @@
+import contextvars
+import functools
 import json
 import os
 import platform
@@ -6,6 +8,16 @@ import threading
 from dotenv import load_dotenv
 from openai import OpenAI
 from llm_command_parser import LLMCommandParser
+from browser_pool import BrowserPool, reset_browser
+from lightweight import DEFAULT_BLOCKED, blocked_patterns
+from layout_pruner import LayoutPruner
+from stream_parser import ActionStreamParser
+from prompt_budget import PromptBudget, estimate_tokens
+from prompt_builder import PromptBuilder, UsageStats, SYSTEM_PROMPT
+from action_cache import ActionCache
+from model_router import ModelRouter, FAST, STRONG
+from task_recorder import compile_script, load_script, save_script
+import tracing
 import time
 import itertools
 import sys
@@ -15,7 +27,7 @@ import keyboard
 import io
 
 
-ERROR_THRESHOLD = os.getenv("ERROR_THRESHOLD")
+ERROR_THRESHOLD = int(os.getenv("ERROR_THRESHOLD", "5"))
 error_sound = "./sound effects/error.wav"
 sucess_sound = "./sound effects/success.wav"
 step_sucess_sound = "./sound effects/step_success.wav"
@@ -63,249 +75,659 @@ client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # -- Config --
 MODEL_NAME = os.getenv("model")
+# Routine steps go to fast_model when it is set, the rest to model (see ModelRouter)
+FAST_MODEL = os.getenv("fast_model", "")
+ROUTER_MAX_ELEMENTS = int(os.getenv("router_max_elements", "400"))
+ROUTER_MAX_ERROR_RATE = float(os.getenv("router_max_error_rate", "0.2"))
 CHROME_USER_DATA = os.path.join(os.getcwd(), "/profile")
 BROWSER_START_URL = os.getenv("start_url")
+DOM_FORMAT = os.getenv("dom_format", "json")
+DOM_EXTRACTION = os.getenv("dom_extraction", "page_source")
+HTML_PARSER = os.getenv("html_parser", "html.parser")
+DOM_DIFF = os.getenv("dom_diff", "false").lower() == "true"
+STABLE_IDS = os.getenv("stable_ids", "true").lower() == "true"
+DOM_PRUNING = os.getenv("dom_pruning", "false").lower() == "true"
+VIEWPORT_SCREENS = float(os.getenv("viewport_screens")) if os.getenv("viewport_screens") else None
+READY_TIMEOUT = float(os.getenv("ready_timeout", "10"))
+READY_MAX_INFLIGHT = int(os.getenv("ready_max_inflight", "0"))
+READY_REQUEST_MAX_AGE_MS = int(os.getenv("ready_request_max_age_ms", "500"))
+STREAM_RESPONSES = os.getenv("stream_responses", "false").lower() == "true"
+PROMPT_TOKEN_BUDGET = int(os.getenv("prompt_token_budget", "0"))
+WORKERS = int(os.getenv("workers", "1"))
+RUNTIME = os.getenv("runtime", "sync")
+TABS_PER_BROWSER = max(1, int(os.getenv("tabs_per_browser", "1")))
+API_PORT = int(os.getenv("api_port", "0"))
+API_HOST = os.getenv("api_host", "127.0.0.1")
+API_MAX_PENDING = int(os.getenv("api_max_pending", "100"))
+ACTION_CACHE_PATH = os.getenv("action_cache", "")
+REPLAY_DIR = os.getenv("replay_dir", "")
+LIGHTWEIGHT = os.getenv("lightweight", "false").lower() == "true"
+# The lightweight profile is always headless
+HEADLESS = LIGHTWEIGHT or os.getenv("headless", "false").lower() == "true"
+BLOCKED_URLS = blocked_patterns(os.getenv("block_resources", DEFAULT_BLOCKED), os.getenv("allow_resources", "")) if LIGHTWEIGHT else None
+BROWSER_POOL = int(os.getenv("browser_pool", "0"))
+BROWSER_MAX_TASKS = int(os.getenv("browser_max_tasks", "50"))
+BROWSER_MAX_MEMORY_GROWTH_MB = float(os.getenv("browser_max_memory_growth_mb", "500"))
+BROWSER_RESET = os.getenv("browser_reset", "false").lower() == "true"
+TRACE_FILE = os.getenv("trace_file", "")
+TRACE_COLLECTOR = os.getenv("trace_collector", "")
+
+tracing.configure(TRACE_FILE, TRACE_COLLECTOR)
 
 # --- Init ---
-prompt_history = []
-stop_requested = False  # Global flag to break loop
+
+
+# Per process; its history cache works across tasks and sessions
+prompts = PromptBuilder()
+# Token usage of the task running in the current context (thread or asyncio task)
+task_usage = contextvars.ContextVar("task_usage", default=None)
+# Per process, so its statistics cover every task of the worker
+router = ModelRouter(FAST_MODEL, MODEL_NAME, ROUTER_MAX_ELEMENTS, ROUTER_MAX_ERROR_RATE) if FAST_MODEL else None
 
 
 def build_prompt(prompt_history, command_history, url, page_data, user_request="", CURRENT_FULLSCREEN_SCAN=""):
-    prompt = f"""
-    You are a browser automation assistant. Your goal is to complete the **user's request** by returning one or more browser actions in the correct order.
+    return prompts.build(prompt_history, command_history, url, page_data, user_request)
+
+
+def build_delta_prompt(new_commands, url, page_data):
+    return prompts.build_delta(new_commands, url, page_data)
 
-    🧑‍💻 User's Request:
-    {user_request}
 
-    📓 Previous User Prompts:
-    {json.dumps(prompt_history)}
+def _messages(prompt, conversation=None):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *(conversation or []),
+        {"role": "user", "content": prompt},
+    ]
 
-    VERY IMPORTANT INSTRUCTION:
-    - Never send 2 or more actions until its to fill a input form and then press a button.
-    - Always check command history and check if the action you are going to send is there or not, if yes and executed without errors, then don't send that action, either continue with the next action from user request or send done.
 
-    ---
-    🛠️ Available Actions:
+def _record_usage(span, usage):
+    attrs = _usage_attrs(usage)
+    if task_usage.get() is not None:
+        task_usage.get().add(attrs)
+    if span is not None:
+        span.set(**attrs)
 
-    1. click  
-    - Clicks an element on the page.  
-    - Example: {{ "action": "click", "element_id": 42, "intend": "Click the submit button" }}
 
-    2. fill  
-    - Fills text into an input field.  
-    - Example: {{ "action": "fill", "element_id": 17, "text": "user@example.com", "intend": "Fill in the email input" }}
+def _usage_attrs(usage) -> dict:
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+    }
 
-    3. scroll  
-    - Scrolls the page.  
-    - Example: {{ "action": "scroll", "direction": "down", "pixels": 500, "intend": "Scroll down to find more content" }}
 
-    4. wait  
-    - Waits for a duration.  
-    - Example: {{ "action": "wait", "seconds": 3, "intend": "Wait for animations or content to load" }}
+def model_for(tier: str = None) -> str:
+    return router.model(tier) if tier else MODEL_NAME
 
-    5. navigate  
-    - Navigates browser history.  
-    - Example: {{ "action": "navigate", "direction": "back", "intend": "Go back to the previous page" }}
 
-    6. goto  
-    - Navigates to a specific URL.  
-    - Example: {{ "action": "goto", "url": "https://example.com/login", "intend": "Open the login page" }}
+def llm_span_attrs(tier: str = None, stream: bool = False) -> dict:
+    attrs = {"model": model_for(tier), "stream": stream}
+    if tier:
+        attrs["tier"] = tier
+    return attrs
 
-    7. press_enter  
-    - Sends Enter key to an input.  
-    - Example: {{ "action": "press_enter", "element_id": 19, "intend": "Submit the search form" }}
 
-    12. done  
-    - Signals task completion.  
-    - Example: {{ "action": "done", "intend": "The requested task was successfully completed" }}
+def query_llm(prompt, conversation=None, tier=None):
+    with tracing.span("llm", **llm_span_attrs(tier)) as span:
+        response = client.chat.completions.create(
+            model=model_for(tier),
+            messages=_messages(prompt, conversation),
+            temperature=0,
+        )
+        _record_usage(span, response.usage)
+        return response.choices[0].message.content.strip()
 
-    ---
-    ✅ IMPORTANT RULE:
 
-    **Always use the `element_id` field from the DOM (in `page_data`) to refer to elements.**  
-    Each element has a unique `element_id` corresponding to an internal CSS selector. Do not try to guess or generate selectors yourself.  
+def stream_llm(prompt, conversation=None, tier=None):
+    """Yields the response text chunk by chunk as the model generates it."""
+    # Not activated, the caller runs the actions between the chunks it pulls
+    span = tracing.start_span("llm", activate=False, **llm_span_attrs(tier, stream=True))
+    try:
+        stream = client.chat.completions.create(
+            model=model_for(tier),
+            messages=_messages(prompt, conversation),
+            temperature=0,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        for chunk in stream:
+            if chunk.usage is not None:
+                _record_usage(span, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        if span is not None:
+            span.end()
 
-    When acting on a specific element:
-    - Find the right element based on visible text, tag, or attributes.
-    - Use its `element_id` when returning any action.
+def stop_task(*agents):
+    """Stops the tasks running on `agents` before their next step; bound to the esc key."""
+    for agent in agents:
+        agent.stop_requested = True
+    print("\n⏹️ Stop requested via ESC key.\n")
 
-    If you cannot find a matching element:
-    - Respond with "element not found" and do not run any action.
+    
+def _play_sound(sound_file):
+    try:
+        if platform.system() == "Windows":
+            subprocess.Popen(['ffplay', '-nodisp', '-autoexit', '-loglevel', 'quiet', sound_file])
+        else:
+            subprocess.Popen(['afplay', sound_file])  # macOS
+    except OSError:
+        # No player installed (e.g. Linux CI); sounds are only cues
+        pass
+
+
+def prepare_prompt(agent: LLMCommandParser, task: str, command_history: list, reported_commands: int, budget: PromptBudget = None):
+    """Takes the DOM snapshot and builds the next prompt; returns (prompt, is_delta)."""
+    url = agent.driver.current_url
+    prompt_history = agent.prompt_history
+    sent_prompts, sent_commands = prompt_history, command_history
+    dom_budget = None
+    if budget:
+        sent_prompts, sent_commands = budget.fit_history(prompt_history, command_history)
+        # The system prompt is sent with every request, so it counts against the budget too
+        dom_budget = budget.dom_budget(SYSTEM_PROMPT + build_prompt(sent_prompts, sent_commands, url, "", task))
+
+    dom_data, is_delta = agent.snapshot_for_prompt(user_request=task, token_budget=dom_budget)
+    if agent.prune_stats:
+        removed = {rule: stats for rule, stats in agent.prune_stats.items() if stats["nodes"]}
+        details = ", ".join(f"{rule} {stats['nodes']} nodes/~{stats['tokens']} tokens" for rule, stats in removed.items())
+        print(f"🧹 Pruned {sum(stats['nodes'] for stats in removed.values())} nodes: {details or 'nothing to prune'}")
+
+    with tracing.span("build_prompt", delta=is_delta):
+        if is_delta:
+            prompt = build_delta_prompt(
+                new_commands=command_history[reported_commands:],
+                url=url,
+                page_data=dom_data,
+            )
+        else:
+            prompt = build_prompt(
+                prompt_history=sent_prompts,
+                command_history=sent_commands,
+                url=url,
+                page_data=dom_data,
+                user_request=task,
+            )
+        if budget:
+            step = budget.record(
+                estimate_tokens(prompts.history.render(prompt_history) + prompts.history.render(command_history)),
+                estimate_tokens(prompts.history.render(sent_prompts) + prompts.history.render(sent_commands)),
+                agent.dom_budget_stats,
+            )
+            print(f"✂️ Prompt budget saved {step['tokens_saved']} tokens this step, {budget.total_saved()} this session")
+    return prompt, is_delta
+
+
+def step_event(index: int, batch: list, timings: dict = None, replayed: bool = False) -> dict:
+    """Progress report of one step: the actions it ran with their results."""
+    event = {
+        "index": index,
+        "actions": [{k: v for k, v in entry.items() if k != "locator"} for entry in batch],
+        **(timings or {}),
+    }
+    if replayed:
+        event["replayed"] = True
+    return event
+
+
+def parse_actions(llm_output: str) -> list:
+    actions = json.loads(llm_output)
+    return actions if isinstance(actions, list) else [actions]
+
+
+def route_step(agent: LLMCommandParser, command_history: list, error_counter: int, escalate: bool = False):
+    """Model tier of the next step, or None when routing is off (no fast_model)."""
+    if router is None:
+        return None
+    tier, reason = router.route(len(agent.selector_map), command_history, error_counter, escalate)
+    if tier != FAST:
+        print(f"🧭 Using {router.model(tier)}: {reason}")
+    return tier
+
+
+def review_reply(llm_output: str, tier: str, latency_ms: float, selector_map: dict, command_history: list):
+    """Parses a reply and records it with the router; returns (actions, parse error, problem).
+
+    `problem` says why a fast tier's reply should be asked of the strong model instead.
+    """
+    actions, error, problem = None, None, None
+    try:
+        actions = parse_actions(llm_output)
+        if tier is not None:
+            problem = router.check(actions, selector_map, command_history)
+    except Exception as e:
+        error, problem = e, "the reply is not valid JSON"
+    if tier is not None:
+        router.record_reply(tier, latency_ms, rejected=problem is not None)
+    return actions, error, problem
 
-    ---
-    📌 DOM Matching Requirements:
 
-    - Use only `element_id` values from `page_data`.
-    - Never guess or invent any selectors.
-    - Each `element_id` corresponds internally to a real `_selector`.
+def escalate_tier(tier: str, problem: str):
+    """The tier to ask again after a rejected reply, or None if `tier` is already the strongest."""
+    if tier != FAST or problem is None:
+        return None
+    print(f"⤴️ Asking {router.model(STRONG)} instead: {problem}")
+    return STRONG
 
-    ---
 
-    🧠 Contextual Knowledge (Use When Relevant):
+def query_routed(prompt, conversation, tier, selector_map: dict, command_history: list):
+    """Queries the tier's model, escalating a rejected fast reply (see review_reply).
 
-    - Try to avoid sending multiple actions as much as possible.. ONLY and ONLY use it for filling up inputs and pressing submit.
+    Returns (tier that answered, llm_output, actions, parse error or None).
+    """
+    while True:
+        started = time.perf_counter()
+        llm_output = query_llm(prompt, conversation, tier).strip().replace("```json", "").replace("```", "")
+        actions, error, problem = review_reply(llm_output, tier, (time.perf_counter() - started) * 1000, selector_map, command_history)
+        next_tier = escalate_tier(tier, problem)
+        if next_tier is None:
+            return tier, llm_output, actions, error
+        tier = next_tier
+
+
+def record_batch(batch: list, command_history: list, error_counter: int) -> int:
+    """Appends executed actions to command_history and returns the updated consecutive error count."""
+    for entry in batch:
+        command_history.append(entry)
+
+        if "Error occurred while trying to execute command".lower() in entry["result"].lower():
+            _play_sound(error_sound)
+            error_counter += 1
+        else:
+            _play_sound(step_sucess_sound)
+            error_counter = 0
+    return error_counter
+
+
+def run_task(agent: LLMCommandParser, task: str, budget: PromptBudget = None, cache: ActionCache = None, command_history: list = None, on_step=None) -> dict:
+    """Drives the agent until the task is done, stopped or failing.
+
+    Returns its status, command_history and per-step latencies (snapshot, LLM plus
+    execution, total) in milliseconds. With a `cache`, steps seen before replay the
+    cached actions instead of querying the LLM. A `command_history` continues a task
+    that was already partly carried out. `on_step` is called with each finished step
+    (see step_event).
+    """
+    print(f"\n🚀 Starting task: {task}")
+    started = time.perf_counter()
+    error_counter = 0
+    status = "done"
+    steps = []
+    done = False
+    agent.stop_requested = False
+    command_history = command_history if command_history is not None else []
+    agent.prompt_history.append(task)
+    # Turns since the last full DOM snapshot; deltas only make sense on top of it
+    conversation = []
+    reported_commands = 0
+    agent.reset_snapshot()
+    usage = UsageStats()
+    usage_token = task_usage.set(usage)
+    task_span = tracing.start_span("task", task=task)
+    step_span = None
+    # Set when a streamed fast reply broke off, so the next step goes to the strong model
+    escalate = False
+
+    while not done:
+        if agent.stop_requested:
+            print("⏹️ Task interrupted by hotkey.")
+            status = "stopped"
+            break
+
+        if error_counter >= ERROR_THRESHOLD:
+            print("Consecutive errors exceeded threshold, stopping task!")
+            status = "failed"
+            break
+
+
+        step_started = time.perf_counter()
+        step_span = tracing.start_span("step", index=len(steps))
+        prompt, is_delta = prepare_prompt(agent, task, command_history, reported_commands, budget)
+        if not is_delta:
+            conversation = []
+        snapshot_done = time.perf_counter()
+        reported_commands = len(command_history)
+
+        cache_key = None
+        cached_actions = None
+        if cache is not None:
+            cache_key = cache.key(task, agent.driver.current_url, agent.selector_map, command_history)
+            cached_actions = cache.get(cache_key, agent.selector_map)
+        streaming = STREAM_RESPONSES and cached_actions is None
+        tier = route_step(agent, command_history, error_counter, escalate) if cached_actions is None else None
+        escalate = False
+
+        dispatch_state = {"done": False}
+
+        def until_done(actions):
+            # Everything before a "done" action is still executed
+            for action in actions:
+                if action.get("action", "").lower() == "done":
+                    dispatch_state["done"] = True
+                    return
+                yield action
+
+        if streaming:
+            # Actions are dispatched to the browser as soon as each one is complete
+            stream_started = time.perf_counter()
+            chunks = stream_llm(prompt, conversation, tier)
+            stream_parser = ActionStreamParser()
+            pending = until_done(stream_parser.iter_actions(chunks))
+            spinner_message = "🤖 Executing actions as they stream in"
+        else:
+            if cached_actions is not None:
+                print("♻️ Replaying cached actions")
+                llm_output, actions, parse_error = json.dumps(cached_actions), cached_actions, None
+            else:
+                tier, llm_output, actions, parse_error = query_routed(prompt, conversation, tier, agent.selector_map, command_history)
+
+            # print("\n\nLLM OUTPUT!", llm_output, "\n\n")
+            if parse_error is not None:
+                print(f"\n❌ Failed to parse LLM output: {parse_error}")
+                print(f"🧾 Raw output:\n{llm_output}")
+                status = "failed"
+                break
 
-    ---
-    🌐 Current Page URL:
-    {url}
+            pending = list(until_done(actions))
+            intends = " → ".join(action.get("intend", action.get("action", "")) for action in pending)
+            slider_hint = " Press p to stop slider" if any(action.get("action") == "move_slider" for action in pending) else ""
+            spinner_message = f"🤖 Executing: {intends}{slider_hint}"
+
+        result_container = {"result": ""}
+
+        def get_status():
+            return result_container["result"]
+
+        if streaming or pending:
+            with spinner(spinner_message, status_getter=get_status):
+                try:
+                    batch = agent.execute_batch(pending)
+                except Exception as e:
+                    print(f"\nSome error happened! {e}")
+                    batch = [
+                        {"command": action, "result": "Error occurred while trying to execute command", "duration_ms": 0}
+                        for action in (stream_parser.actions if streaming else pending)
+                    ]
+                result_container["result"] = " ".join(entry["result"] for entry in batch)
+        else:
+            batch = []
+        done = dispatch_state["done"]
+
+        if streaming:
+            # Drain whatever is left after "done" so the whole reply is kept
+            for chunk in chunks:
+                stream_parser.feed(chunk)
+            llm_output = stream_parser.text.strip()
+
+        conversation += [
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": llm_output},
+        ]
+
+        error_counter = record_batch(batch, command_history, error_counter)
+        steps.append({
+            "snapshot_ms": round((snapshot_done - step_started) * 1000),
+            "respond_ms": round((time.perf_counter() - snapshot_done) * 1000),
+            "total_ms": round((time.perf_counter() - step_started) * 1000),
+        })
+        stream_error = None
+        if streaming:
+            # Validated only now, its actions have already run as they arrived
+            try:
+                stream_parser.close()
+            except Exception as e:
+                stream_error = e
+            if tier is not None:
+                router.record_reply(tier, (time.perf_counter() - stream_started) * 1000, rejected=stream_error is not None)
+        if tier is not None:
+            steps[-1]["tier"] = tier
+            router.record_step(tier, batch)
+        if step_span is not None:
+            step_span.set(cached=cached_actions is not None, actions=len(batch))
+            step_span.end()
+        if on_step is not None:
+            on_step(step_event(len(steps) - 1, batch, steps[-1]))
+
+        if stream_error is not None:
+            if tier == FAST:
+                # The actions that did arrive have run; the strong model takes the next step
+                print(f"\n⤴️ The streamed reply broke off ({stream_error}), escalating the next step")
+                escalate = True
+                continue
+            print(f"\n❌ Failed to parse LLM output: {stream_error}")
+            print(f"🧾 Raw output:\n{llm_output}")
+            status = "failed"
+            break
+
+        if cache is not None:
+            failed = any("error occurred" in entry["result"].lower() for entry in batch)
+            if cached_actions is not None:
+                if failed:
+                    cache.invalidate(cache_key)
+            elif not failed and (batch or done):
+                cache.put(cache_key, stream_parser.actions if streaming else actions)
+
+    if status == "done":
+        _play_sound(sucess_sound)
+        print(f"✅ {task} — Task Completed!\n")
+    task_usage.reset(usage_token)
+    if usage.prompt_tokens:
+        print(f"🧊 Prompt cache: {usage.report()}")
+    if cache is not None:
+        print(f"♻️ Action cache hit rate {cache.hit_rate():.0%} ({cache.stats['hits']}/{cache.stats['lookups']} steps)")
+    if router is not None:
+        print(f"🧭 Model routing: {router.report()}")
+    if step_span is not None:
+        step_span.end()
+    if task_span is not None:
+        task_span.set(status=status, steps=len(steps), prompt_tokens=usage.prompt_tokens, cached_tokens=usage.cached_tokens)
+        task_span.end()
+
+    return task_result(status, command_history, started, steps, usage)
+
+
+def task_result(status: str, command_history: list, started: float, steps: list, usage: UsageStats) -> dict:
+    result = {
+        "status": status,
+        "command_history": command_history,
+        "duration_s": round(time.perf_counter() - started, 3),
+        "steps": steps,
+        "usage": usage.as_dict(),
+    }
+    if router is not None:
+        # The worker's totals so far, for tuning the router's thresholds
+        result["routing"] = router.as_dict()
+    return result
+
+
+def replay_task(agent: LLMCommandParser, task: str, budget: PromptBudget = None, cache: ActionCache = None, on_step=None) -> dict:
+    """Runs the recorded script of `task` without querying the LLM.
+
+    Element steps are found again by their locators. At the first step that cannot be
+    located or fails, the LLM takes over through run_task with the steps replayed so
+    far as command history. Tasks without a recording run through run_task directly.
+    """
+    script = load_script(REPLAY_DIR, task) if REPLAY_DIR else None
+    if script is None:
+        print(f"📼 No recording for: {task}, running it with the LLM")
+        return run_task(agent, task, budget, cache, on_step=on_step)
+
+    print(f"\n📼 Replaying task: {task} ({len(script['steps'])} steps)")
+    started = time.perf_counter()
+    agent.stop_requested = False
+    command_history = []
+    error_counter = 0
+    with tracing.span("replay", task=task, steps=len(script["steps"])):
+        agent.goto(script["start_url"])
+
+        for index, step in enumerate(script["steps"]):
+            if agent.stop_requested:
+                print("⏹️ Replay interrupted by hotkey.")
+                return {
+                    "status": "stopped",
+                    "command_history": command_history,
+                    "duration_s": round(time.perf_counter() - started, 3),
+                    "steps": [],
+                    "replayed_steps": index,
+                }
+
+            if step.get("action") == "fill" and "text" not in step:
+                print(f"📼 Step {index + 1} fills a password, which isn't recorded, handing over to the LLM")
+                break
 
-    📜 Command History (latest last):
-    {json.dumps(command_history)}
+            command = {k: v for k, v in step.items() if k != "locator"}
+            if "locator" in step:
+                element_id = agent.locate(step["locator"])
+                if element_id is None:
+                    print(f"📼 Step {index + 1} no longer matches the page, handing over to the LLM")
+                    break
+                command["element_id"] = element_id
+
+            batch = agent.execute_batch([command])
+            for entry in batch:
+                # The replay element_id means nothing to the LLM, the locator does
+                entry["command"] = step
+            error_counter = record_batch(batch, command_history, 0)
+            if on_step is not None:
+                on_step(step_event(index, batch, replayed=True))
+            if error_counter:
+                print(f"📼 Step {index + 1} failed on replay, handing over to the LLM")
+                break
+        else:
+            _play_sound(sucess_sound)
+            print(f"✅ {task} — Replay Completed!\n")
+            return {
+                "status": "done",
+                "command_history": command_history,
+                "duration_s": round(time.perf_counter() - started, 3),
+                "steps": [],
+                "replayed_steps": len(script["steps"]),
+            }
+
+    replayed_steps = len(command_history) - (1 if error_counter else 0)
+    result = run_task(agent, task, budget, cache, command_history, on_step)
+    result["duration_s"] = round(time.perf_counter() - started, 3)
+    result["replayed_steps"] = replayed_steps
+    return result
+
+
+def record_replay(task: str, start_url: str, result: dict):
+    """Saves a successful run as the task's replay script, replacing an older one."""
+    if not REPLAY_DIR or result.get("status") != "done":
+        return
+    if result.get("steps") == [] and result.get("replayed_steps"):
+        # A clean replay, the recording is still good
+        return
+    script = compile_script(task, start_url, result["command_history"])
+    if script["steps"]:
+        save_script(REPLAY_DIR, script)
+
+
+def make_browser_pool(usr_dir: str):
+    if BROWSER_POOL <= 0:
+        return None
+    return BrowserPool(
+        usr_dir,
+        start_url=BROWSER_START_URL,
+        spare=BROWSER_POOL,
+        max_tasks=BROWSER_MAX_TASKS,
+        max_memory_growth_mb=BROWSER_MAX_MEMORY_GROWTH_MB,
+        headless=HEADLESS,
+        reset=BROWSER_RESET,
+        blocked_urls=BLOCKED_URLS,
+    )
 
-    🧩 DOM Snapshot:
-    {page_data}
 
-    ---
-    Before you respond:
-    2. Only return new actions if they are clearly needed
-    3. Otherwise, return:
-    {{ "action": "done", "intend": "All steps from the user request were already completed" }}
+def make_pruner():
+    return LayoutPruner(VIEWPORT_SCREENS) if DOM_PRUNING else None
 
 
-    ⛔ Do NOT wrap your output in markdown. Return a raw JSON **list** of action objects.
+def acquire_browser(agent: LLMCommandParser, pool: BrowserPool = None):
+    # The pool may have retired the last browser, the agent then moves to a warm one
+    if pool is None:
+        return
+    driver = pool.acquire()
+    if driver is not agent.driver:
+        agent.attach(driver)
 
-    Now return the next action(s) to perform.
-    """
-    return prompt
-
-
-
-def query_llm(prompt):
-    response = client.chat.completions.create(
-        model=MODEL_NAME,
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You control a web browser using JSON commands. Do not use natural language.\n"
-                    'If the task appears to be completed already based on the DOM or last command result, return { "action": "done" } immediately. '
-                    "Only take actions if you are confident they are still necessary."
-                ),
-            },
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0,
-    )
-    return response.choices[0].message.content.strip()
 
-stop_requested = False
+def release_browser(agent: LLMCommandParser, pool: BrowserPool = None):
+    if pool is not None:
+        pool.release(agent.driver)
+    elif BROWSER_RESET:
+        reset_browser(agent.driver, BROWSER_START_URL)
 
-def stop_task():
-    global stop_requested
-    stop_requested = True
-    print("\n⏹️ Stop requested via ESC key.\n")
 
-    
-def _play_sound(sound_file):
-    if platform.system() == "Windows":
-        subprocess.Popen(['ffplay', '-nodisp', '-autoexit', '-loglevel', 'quiet', sound_file])
-    else:
-        subprocess.Popen(['afplay', sound_file])  # macOS
+def report_progress(result_queue, task_id, event: dict):
+    # Shares the results channel; progress messages are told apart by their "progress" key
+    result_queue.put({"id": task_id, "progress": event})
 
 
-def main(main_queue: Queue):
-    global stop_requested, CURRENT_FULLSCREEN_SCAN
-    
-    keyboard.add_hotkey("esc", stop_task)
+def main(main_queue: Queue, result_queue: Queue = None, worker_id: int = 0, usr_dir: str = CHROME_USER_DATA):
     task_queue = main_queue
-    agent = LLMCommandParser(url=BROWSER_START_URL, usr_dir=CHROME_USER_DATA)
-    error_counter = 0
+    pool = make_browser_pool(usr_dir)
+    agent = LLMCommandParser(
+        url=BROWSER_START_URL,
+        usr_dir=usr_dir,
+        dom_format=DOM_FORMAT,
+        extraction=DOM_EXTRACTION,
+        diff=DOM_DIFF,
+        ready_timeout=READY_TIMEOUT,
+        driver=pool.acquire() if pool is not None else None,
+        headless=HEADLESS,
+        blocked_urls=BLOCKED_URLS,
+        pruner=make_pruner(),
+        stable_ids=STABLE_IDS,
+        html_parser=HTML_PARSER,
+        ready_max_inflight=READY_MAX_INFLIGHT,
+        ready_request_max_age_ms=READY_REQUEST_MAX_AGE_MS,
+    )
+    budget = PromptBudget(PROMPT_TOKEN_BUDGET) if PROMPT_TOKEN_BUDGET > 0 else None
+    cache = ActionCache(ACTION_CACHE_PATH) if ACTION_CACHE_PATH else None
+    agent.record_locators = bool(REPLAY_DIR)
+    keyboard.add_hotkey("esc", stop_task, args=(agent,))
 
     # --- Main Loop ---
     try:
         while True:
                 task = task_queue.get()
 
-                if task.lower() == "exit":
-                    agent.driver.quit()
+                if isinstance(task, str) and task.lower() == "exit":
                     break
 
-                print(f"\n🚀 Starting task: {task}")
-                done = False
-                stop_requested = False
-                command_history = []
-                prompt_history.append(task)
-
-                while not done:
-                    if stop_requested:
-                        print("⏹️ Task interrupted by hotkey.")
-                        break
-                        
-                    if error_counter >= ERROR_THRESHOLD:
-                        print("Consecutive errors exceeded threshold, stopping task!")
-                        break
-
-
-                    current_html = agent.driver.page_source
-                    dom_data = agent.page_source_parser(current_html)
-
-                    prompt = build_prompt(
-                        prompt_history=prompt_history,
-                        command_history=command_history,
-                        url=agent.driver.current_url,
-                        page_data=dom_data,
-                        user_request=task,
-                    )
-
-                    llm_output = (
-                        query_llm(prompt).strip().replace("```json", "").replace("```", "")
-                    )
-
-                    # print("\n\nLLM OUTPUT!", llm_output, "\n\n")
-                    try:
-                        actions = json.loads(llm_output)
-                        if not isinstance(actions, list):
-                            actions = [actions]
-                    except Exception as e:
-                        print(f"\n❌ Failed to parse LLM output: {e}")
-                        print(f"🧾 Raw output:\n{llm_output}")
-                        break
-
-                    for action in actions:
-                        if action.get("action", "").lower() == "done":
-                            done = True
-                            break
-
-                        result_container = {"result": ""}
-
-                        def get_status():
-                            return result_container["result"]
-
-                        with spinner(
-                            f"🤖 Executing: {action.get('intend', action['action'])} {"Press p to stop slider" if action.get('action', action['action']) == "move_slider" else ""}",
-                            status_getter=get_status,
-                        ):
-                            try:
-                                result = agent.parse_and_execute(
-                                    json.dumps(action)
-                                )
-                                print(f"\nResults is {result}")
-                            except Exception as e:
-                                print("Some error happened!")
-                                result = "Error occurred while trying to execute command"
-                                print(f"\nResults is {result}, {e}")
-                            result_container["result"] = result or ""
-
-
-                        command_history.append({"command": action, "result": result})
-
-                        if "Error occurred while trying to execute command".lower() in result.lower():
-                            _play_sound(error_sound)
-                            error_counter += 1
-                        else:
-                            _play_sound(step_sucess_sound)
-                            error_counter = 0
-
-                    time.sleep(1.2)
-
-                if error_counter < ERROR_THRESHOLD and not stop_requested:
-                    _play_sound(sucess_sound)
-                    print(f"✅ {task} — Task Completed!\n")
-                error_counter = 0
+                # Tasks come as {"id", "task", "replay"} from handleCommands, plain strings are still accepted
+                task_id = task.get("id") if isinstance(task, dict) else None
+                text = task["task"] if isinstance(task, dict) else task
+                replay = isinstance(task, dict) and task.get("replay", False)
+
+                on_step = None
+                if result_queue is not None and task_id is not None:
+                    on_step = functools.partial(report_progress, result_queue, task_id)
+
+                try:
+                    acquire_browser(agent, pool)
+                    start_url = agent.driver.current_url
+                    result = (replay_task if replay else run_task)(agent, text, budget, cache, on_step=on_step)
+                    record_replay(text, start_url, result)
+                    release_browser(agent, pool)
+                except Exception as e:
+                    print(f"\n❌ Task crashed: {e}")
+                    result = {"status": "error", "command_history": [], "duration_s": 0, "error": str(e)}
+                tracing.tracer.flush()
+
+                if result_queue is not None:
+                    result_queue.put({"id": task_id, "task": text, "worker": worker_id, **result})
 
     except KeyboardInterrupt:
         print("\n👋 Exiting automation.")
 
     finally:
-        agent.close()
+        if pool is not None:
+            pool.close()
+        else:
+            agent.close()
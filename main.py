@@ -1,21 +1,80 @@
+import async_agent
 import command_handler
 import llm_handler
+import task_api
+import threading
 from multiprocessing import Process, Queue
 
 
+def route_results(result_queue: Queue, commands: command_handler.handleCommands):
+    while True:
+        result = result_queue.get()
+        if result is None:
+            break
+        if "progress" in result:
+            commands.on_progress(result)
+            continue
+        commands.on_result(result)
+        steps = result.get("steps") or []
+        average_step = sum(step["total_ms"] for step in steps) / len(steps) if steps else 0
+        print(
+            f"\n📋 Task {result['id']} ({result['task']}) finished on worker {result['worker']}: "
+            f"{result['status']} in {result['duration_s']}s, {len(steps)} steps averaging {average_step:.0f} ms"
+        )
+
+
 def main():
     print("Browser automation using LLM - Made by github.com/praveenkurup")
 
     task_queue = Queue()
+    result_queue = Queue()
+
+    # Every worker owns a browser; idle workers pick the next task from the shared queue
+    workers = []
+    if llm_handler.RUNTIME == "async":
+        # One process, one event loop driving all the browsers
+        llm = Process(target=async_agent.main, args=(task_queue, result_queue, llm_handler.WORKERS))
+        llm.start()
+        workers.append(llm)
+    else:
+        for worker_id in range(llm_handler.WORKERS):
+            usr_dir = llm_handler.CHROME_USER_DATA
+            if llm_handler.WORKERS > 1:
+                usr_dir = f"{usr_dir}-worker{worker_id}"
+            llm = Process(target=llm_handler.main, args=(task_queue, result_queue, worker_id, usr_dir))
+            llm.start()
+            workers.append(llm)
 
-    llm = Process(target=llm_handler.main, args=(task_queue,))
-    llm.start()
+    # Tasks are only handed out while a worker (or tab) is free, so priorities apply
+    capacity = llm_handler.WORKERS * (llm_handler.TABS_PER_BROWSER if llm_handler.RUNTIME == "async" else 1)
+    command_handler_instance = command_handler.handleCommands(
+        task_queue,
+        llm_handler.TRACE_FILE,
+        capacity=capacity,
+        max_pending=llm_handler.API_MAX_PENDING if llm_handler.API_PORT else None,
+    )
 
-    command_handler_instance = command_handler.handleCommands(task_queue)
+    results_thread = threading.Thread(target=route_results, args=(result_queue, command_handler_instance), daemon=True)
+    results_thread.start()
+
+    api = None
+    if llm_handler.API_PORT:
+        api = task_api.TaskAPI(command_handler_instance, llm_handler.API_HOST, llm_handler.API_PORT).start()
+        print(f"🌐 Task API listening on {api.url}")
 
     command_handler_instance.start_command_loop()
 
-    llm.join()
+    # handleCommands queues a single "exit", the other workers need one each
+    for _ in range(len(workers) - 1):
+        task_queue.put("exit")
+
+    for llm in workers:
+        llm.join()
+
+    result_queue.put(None)
+    results_thread.join()
+    if api is not None:
+        api.stop()
 
 if "__main__" == __name__:
     main()
\ No newline at end of file
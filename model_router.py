@@ -0,0 +1,128 @@
+from collections import Counter, deque
+
+from llm_command_parser import ACTION_ARGUMENTS
+from tracing import percentile
+
+
+FAST = "fast"
+STRONG = "strong"
+TIERS = (FAST, STRONG)
+
+# Latest commands the recent error rate is taken over
+ERROR_WINDOW = 6
+# Latencies kept per tier for the percentiles
+LATENCY_SAMPLES = 1000
+
+KNOWN_ACTIONS = set(ACTION_ARGUMENTS) | {"done"}
+ELEMENT_ACTIONS = {action for action, args in ACTION_ARGUMENTS.items() if "element_id" in args}
+# Sending one of these again right after it worked means the model lost track
+NON_REPEATABLE_ACTIONS = {"fill", "goto"}
+
+
+def _failed(entry: dict) -> bool:
+    return "error occurred" in entry["result"].lower()
+
+
+def _comparable(action: dict) -> dict:
+    # The same action, whatever intent the model wrote for it
+    return {k: v for k, v in action.items() if k != "intend"}
+
+
+class ModelRouter:
+    """Sends routine steps to a fast model and escalates the rest to the strong one.
+
+    `route` picks a step's tier before it is sent. It is strong after a failed action,
+    when more than `max_error_rate` of the last ERROR_WINDOW commands failed, or when the
+    snapshot has more than `max_fast_elements` elements, and fast otherwise. `check`
+    flags a low-confidence reply: no actions, an unknown action or element_id, or
+    repeating a fill/goto that just worked. A fast reply that fails the check or doesn't
+    parse is asked of the strong model instead. Latency, rejected replies and step
+    success are counted per tier, and routing decisions per reason, for tuning the
+    thresholds.
+    """
+
+    def __init__(self, fast_model: str, strong_model: str, max_fast_elements: int = 400, max_error_rate: float = 0.2):
+        self.models = {FAST: fast_model, STRONG: strong_model}
+        self.max_fast_elements = max_fast_elements
+        self.max_error_rate = max_error_rate
+        self.stats = {tier: {"calls": 0, "rejected": 0, "steps": 0, "failed_steps": 0} for tier in TIERS}
+        self.latencies = {tier: deque(maxlen=LATENCY_SAMPLES) for tier in TIERS}
+        self.routes = Counter()
+
+    def model(self, tier: str) -> str:
+        return self.models[tier]
+
+    def route(self, elements: int, command_history: list, error_counter: int = 0, escalate: bool = False):
+        """Returns the tier for the next step and the reason it was picked."""
+        recent = command_history[-ERROR_WINDOW:]
+        if escalate:
+            reason = "escalated"
+        elif error_counter:
+            reason = "last_action_failed"
+        elif recent and sum(map(_failed, recent)) / len(recent) > self.max_error_rate:
+            reason = "error_rate"
+        elif elements > self.max_fast_elements:
+            reason = "large_dom"
+        else:
+            reason = "routine"
+        self.routes[reason] += 1
+        return (FAST if reason == "routine" else STRONG), reason
+
+    def check(self, actions: list, selector_map: dict, command_history: list):
+        """Returns why a parsed reply looks low-confidence, or None if it looks fine."""
+        if not actions:
+            return "no actions"
+        for action in actions:
+            if not isinstance(action, dict):
+                return "not a list of actions"
+            name = str(action.get("action", "")).lower()
+            if name not in KNOWN_ACTIONS:
+                return f"unknown action {name!r}"
+            if name in ELEMENT_ACTIONS and action.get("element_id") not in selector_map:
+                return f"unknown element_id {action.get('element_id')!r}"
+
+        last = command_history[-1] if command_history else None
+        first = actions[0]
+        if (
+            last is not None and not _failed(last)
+            and first.get("action") in NON_REPEATABLE_ACTIONS
+            and _comparable(first) == _comparable(last["command"])
+        ):
+            return f"repeats the {first['action']} that just worked"
+        return None
+
+    def record_reply(self, tier: str, latency_ms: float, rejected: bool = False):
+        self.stats[tier]["calls"] += 1
+        self.stats[tier]["rejected"] += rejected
+        self.latencies[tier].append(latency_ms)
+
+    def record_step(self, tier: str, batch: list):
+        self.stats[tier]["steps"] += 1
+        self.stats[tier]["failed_steps"] += any(map(_failed, batch))
+
+    def as_dict(self) -> dict:
+        tiers = {}
+        for tier in TIERS:
+            stats = self.stats[tier]
+            latencies = sorted(self.latencies[tier])
+            tiers[tier] = {
+                "model": self.models[tier],
+                **stats,
+                "success_rate": (stats["steps"] - stats["failed_steps"]) / stats["steps"] if stats["steps"] else None,
+                "p50_ms": round(percentile(latencies, 50)) if latencies else None,
+                "p95_ms": round(percentile(latencies, 95)) if latencies else None,
+            }
+        return {"tiers": tiers, "routes": dict(self.routes)}
+
+    def report(self) -> str:
+        parts = []
+        for tier, stats in self.as_dict()["tiers"].items():
+            if not stats["calls"]:
+                continue
+            success = f", {stats['success_rate']:.0%} of steps ok" if stats["success_rate"] is not None else ""
+            parts.append(
+                f"{tier} ({stats['model']}) {stats['calls']} calls, p50 {stats['p50_ms']} ms / p95 {stats['p95_ms']} ms, "
+                f"{stats['rejected']} replies rejected{success}"
+            )
+        routes = ", ".join(f"{reason} {count}" for reason, count in self.routes.most_common())
+        return " | ".join(parts) + (f" | routes: {routes}" if routes else "")
@@ -0,0 +1,159 @@
+import time
+from contextlib import contextmanager
+
+from selenium.common.exceptions import WebDriverException
+
+import tracing
+
+
+# Records the start time of every in-flight fetch/XHR request and the time of the last
+# DOM mutation, and flags a document that is being navigated away from. Safe to run more
+# than once per document.
+INSTRUMENT_SCRIPT = """
+(() => {
+    if (window.__agentReadiness) return;
+    const state = { pending: new Map(), seq: 0, lastMutation: performance.now(), actionStart: 0, unloading: false };
+    window.__agentReadiness = state;
+    addEventListener("beforeunload", () => { state.unloading = true; });
+    addEventListener("pagehide", () => { state.unloading = true; });
+
+    const originalFetch = window.fetch;
+    if (originalFetch) {
+        window.fetch = function (...args) {
+            const id = ++state.seq;
+            state.pending.set(id, performance.now());
+            return originalFetch.apply(this, args).finally(() => { state.pending.delete(id); });
+        };
+    }
+
+    const originalSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function (...args) {
+        const id = ++state.seq;
+        state.pending.set(id, performance.now());
+        this.addEventListener("loadend", () => { state.pending.delete(id); }, { once: true });
+        return originalSend.apply(this, args);
+    };
+
+    new MutationObserver(() => { state.lastMutation = performance.now(); }).observe(document, {
+        subtree: true, childList: true, attributes: true, characterData: true
+    });
+})();
+"""
+
+# Only counts requests younger than arguments[0] ms, so a long-poll, an event stream read
+# with fetch or a beacon that never completes doesn't hold every wait until the timeout
+PROBE_SCRIPT = """
+const state = window.__agentReadiness;
+const now = performance.now();
+let inflight = 0;
+if (state) {
+    for (const started of state.pending.values()) {
+        if (now - started < arguments[0]) inflight++;
+    }
+}
+return {
+    ready_state: document.readyState,
+    installed: !!state,
+    unloading: state ? state.unloading : false,
+    inflight: inflight,
+    idle_ms: state ? now - Math.max(state.lastMutation, state.actionStart) : 0
+};
+"""
+
+# Restarts the quiet window, so the page must stay quiet for a while after the action
+MARK_SCRIPT = """
+const state = window.__agentReadiness;
+if (state) { state.actionStart = performance.now(); state.unloading = false; }
+"""
+
+
+class PageReadiness:
+    """Waits for a page to settle instead of sleeping for a fixed time.
+
+    A page is ready once `document.readyState` is complete, at most `max_inflight`
+    fetch/XHR requests younger than `request_max_age_ms` are in flight (older ones are
+    taken for long-polls and streams), it is not being navigated away from, and the DOM has not mutated for
+    `quiet_ms`, counted from the last `mark` (the start of the last action) at the
+    earliest. That gives a click some time to start a navigation, which the unload
+    flag then holds the wait for. A page whose DOM never stops changing (a ticker, an
+    animation) counts as ready once it has been loaded with no requests pending for
+    `max_mutation_wait` seconds. Waiting never fails the caller: after `timeout`
+    seconds it simply returns False.
+
+    Inside `deferred()`, `wait` only probes once and the caller does the waiting, e.g.
+    with its own `probe` loop that lets other work use the browser between probes.
+    """
+
+    def __init__(self, driver, timeout: float = 10, quiet_ms: int = 300, poll_interval: float = 0.05, max_inflight: int = 0, max_mutation_wait: float = 2, request_max_age_ms: int = 500):
+        self.driver = driver
+        self.timeout = timeout
+        self.quiet_ms = quiet_ms
+        self.poll_interval = poll_interval
+        self.max_inflight = max_inflight
+        self.max_mutation_wait = max_mutation_wait
+        self.request_max_age_ms = request_max_age_ms
+        self.deferring = False
+        # When the page was first seen loaded with no requests pending, since the last mark
+        self.loaded_at = None
+
+        # Chrome can inject the instrumentation before any page script runs, so
+        # requests fired during load are counted too
+        try:
+            self.driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": INSTRUMENT_SCRIPT})
+        except Exception:
+            pass
+
+    def wait(self, timeout: float = None) -> bool:
+        with tracing.span("page_ready") as span:
+            ready = self._wait(timeout)
+            if span is not None:
+                span.set(ready=ready)
+            return ready
+
+    @contextmanager
+    def deferred(self):
+        self.deferring = True
+        try:
+            yield
+        finally:
+            self.deferring = False
+
+    def mark(self):
+        """Records that an action is starting; call it right before acting on the page."""
+        self.loaded_at = None
+        try:
+            self.driver.execute_script(MARK_SCRIPT)
+        except WebDriverException:
+            pass
+
+    def probe(self) -> bool:
+        """Checks once whether the page is ready."""
+        try:
+            state = self.driver.execute_script(PROBE_SCRIPT, self.request_max_age_ms)
+            if not state["installed"]:
+                self.driver.execute_script(INSTRUMENT_SCRIPT)
+                return False
+        except WebDriverException:
+            # The document is being replaced mid-navigation
+            self.loaded_at = None
+            return False
+
+        if state["ready_state"] != "complete" or state["unloading"] or state["inflight"] > self.max_inflight:
+            self.loaded_at = None
+            return False
+        if state["idle_ms"] >= self.quiet_ms:
+            return True
+        if self.loaded_at is None:
+            self.loaded_at = time.monotonic()
+        return time.monotonic() - self.loaded_at >= self.max_mutation_wait
+
+    def _wait(self, timeout: float = None) -> bool:
+        if self.deferring:
+            return self.probe()
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+
+        while not self.probe():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+        return True
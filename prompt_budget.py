@@ -0,0 +1,178 @@
+import json
+import re
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _ENCODING = None
+
+
+INTERACTIVE_TAGS = {"button", "a", "input", "select", "textarea", "option", "label", "form"}
+DESCRIPTIVE_ATTRIBUTES = {"placeholder", "aria-label", "name", "title", "alt", "href", "value", "data-value"}
+VIEWPORT_HEIGHT = 1000
+
+
+def estimate_tokens(text: str) -> int:
+    """Counts tokens with tiktoken when installed, otherwise assumes ~4 characters per token."""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def _words(text: str) -> set:
+    return {word for word in re.findall(r"\w+", text.lower()) if len(word) > 2}
+
+
+def _shallow(node: dict) -> dict:
+    return {k: v for k, v in node.items() if k != "children"}
+
+
+def _score(node: dict, request_words: set, position, order: float) -> float:
+    attrs = node.get("attrs", {})
+    score = 0.0
+    if node["tag"] in INTERACTIVE_TAGS:
+        score += 3
+    if DESCRIPTIVE_ATTRIBUTES.intersection(attrs):
+        score += 1
+    if request_words:
+        node_words = _words(" ".join([node.get("text", "")] + [str(v) for v in attrs.values()]))
+        score += min(3, len(request_words & node_words)) * 2
+    if not attrs and not node.get("text") and node["tag"] not in INTERACTIVE_TAGS:
+        score -= 1
+
+    if position is None:
+        # No layout info, earlier in the document is a weak proxy for "on screen"
+        score += 1 - order
+    elif 0 <= position <= VIEWPORT_HEIGHT:
+        score += 2
+    elif -VIEWPORT_HEIGHT <= position <= 2 * VIEWPORT_HEIGHT:
+        score += 1
+    return score
+
+
+def fit_dom(tree: dict, max_tokens: int, user_request: str = "", positions: dict = None):
+    """Trims a DOMSerializer tree to roughly `max_tokens`, keeping the most relevant elements.
+
+    Elements are ranked by interactivity, word overlap with the user request and
+    viewport proximity (`positions` maps element_id to its top offset in pixels),
+    and added with their ancestors until the budget is spent. Parents that lost
+    children get an `omitted` count. Returns (tree, stats).
+    """
+    full_tokens = estimate_tokens(json.dumps(tree, ensure_ascii=False, separators=(",", ":")))
+
+    nodes = []
+    parents = {}
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        for child in node.get("children", ()):
+            parents[child["element_id"]] = node["element_id"]
+        stack.extend(reversed(node.get("children", ())))
+
+    stats = {"nodes": len(nodes), "nodes_sent": len(nodes), "dom_tokens": full_tokens, "dom_tokens_sent": full_tokens}
+    if full_tokens <= max_tokens:
+        return tree, stats
+
+    positions = positions or {}
+    request_words = _words(user_request)
+    total = len(nodes)
+    ranked = sorted(
+        enumerate(nodes),
+        key=lambda item: _score(item[1], request_words, positions.get(item[1]["element_id"]), item[0] / total),
+        reverse=True,
+    )
+
+    by_id = {node["element_id"]: node for node in nodes}
+    kept = {tree["element_id"]}
+    spent = len(json.dumps(_shallow(tree), ensure_ascii=False)) // 4 + 1
+    for _, node in ranked:
+        # Cheap per-node estimate, the final count below uses estimate_tokens
+        chain = []
+        element_id = node["element_id"]
+        while element_id is not None and element_id not in kept:
+            chain.append(element_id)
+            element_id = parents.get(element_id)
+        cost = sum(len(json.dumps(_shallow(by_id[i]), ensure_ascii=False)) // 4 + 1 for i in chain)
+        if spent + cost > max_tokens:
+            continue
+        kept.update(chain)
+        spent += cost
+
+    def copy(node):
+        result = _shallow(node)
+        children = [child for child in node.get("children", ()) if child["element_id"] in kept]
+        if children:
+            result["children"] = children
+        omitted = len(node.get("children", ())) - len(children)
+        if omitted:
+            result["omitted"] = omitted
+        return result
+
+    trimmed = copy(tree)
+    stack = [trimmed]
+    while stack:
+        node = stack.pop()
+        node["children"] = [copy(child) for child in node.get("children", ())]
+        if not node["children"]:
+            del node["children"]
+        stack.extend(node.get("children", ()))
+
+    stats["nodes_sent"] = len(kept)
+    stats["dom_tokens_sent"] = estimate_tokens(json.dumps(trimmed, ensure_ascii=False, separators=(",", ":")))
+    return trimmed, stats
+
+
+def _summarize_command(entry: dict) -> str:
+    command = entry.get("command", {})
+    target = command.get("element_id", command.get("url", command.get("direction", "")))
+    outcome = "error" if "error occurred" in str(entry.get("result", "")).lower() else "ok"
+    return f"{command.get('action', '?')} {target} -> {outcome}".replace("  ", " ")
+
+
+class PromptBudget:
+    """Keeps each prompt under `max_tokens` and records how many tokens that saved.
+
+    Histories keep their `keep_recent` latest entries verbatim and collapse older
+    ones into a one-line summary; the DOM snapshot gets whatever budget is left
+    (see fit_dom).
+    """
+
+    def __init__(self, max_tokens: int, keep_recent: int = 5):
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.steps = []
+
+    def fit_history(self, prompt_history: list, command_history: list):
+        prompts = prompt_history
+        if len(prompts) > self.keep_recent:
+            older = prompts[:-self.keep_recent]
+            prompts = [f"({len(older)} earlier prompts, latest of them: {older[-1][:200]})"] + prompts[-self.keep_recent:]
+
+        commands = command_history
+        if len(commands) > self.keep_recent:
+            older = commands[:-self.keep_recent]
+            summary = "; ".join(_summarize_command(entry) for entry in older)
+            commands = [{"summary": f"{len(older)} earlier commands: {summary}"}] + commands[-self.keep_recent:]
+
+        return prompts, commands
+
+    def dom_budget(self, prompt_without_dom: str) -> int:
+        return max(0, self.max_tokens - estimate_tokens(prompt_without_dom))
+
+    def record(self, full_history_tokens: int, sent_history_tokens: int, dom_stats: dict) -> dict:
+        step = {
+            "history_tokens": full_history_tokens,
+            "history_tokens_sent": sent_history_tokens,
+            "dom_tokens": dom_stats.get("dom_tokens", 0),
+            "dom_tokens_sent": dom_stats.get("dom_tokens_sent", 0),
+        }
+        step["tokens_saved"] = (
+            step["history_tokens"] - step["history_tokens_sent"] + step["dom_tokens"] - step["dom_tokens_sent"]
+        )
+        self.steps.append(step)
+        return step
+
+    def total_saved(self) -> int:
+        return sum(step["tokens_saved"] for step in self.steps)
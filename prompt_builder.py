@@ -0,0 +1,185 @@
+import json
+
+
+# Everything that is the same for every request, sent first as the system message so
+# the provider's prefix cache can reuse it across steps and tasks. Nothing dynamic
+# may be added here, or every prompt misses the cache.
+SYSTEM_PROMPT = """You control a web browser using JSON commands. Do not use natural language.
+If the task appears to be completed already based on the DOM or last command result, return { "action": "done" } immediately. Only take actions if you are confident they are still necessary.
+
+You are a browser automation assistant. Your goal is to complete the **user's request** by returning one or more browser actions in the correct order.
+
+VERY IMPORTANT INSTRUCTION:
+- Never send 2 or more actions until its to fill a input form and then press a button.
+- Always check command history and check if the action you are going to send is there or not, if yes and executed without errors, then don't send that action, either continue with the next action from user request or send done.
+
+---
+🛠️ Available Actions:
+
+1. click
+- Clicks an element on the page.
+- Example: { "action": "click", "element_id": 42, "intend": "Click the submit button" }
+
+2. fill
+- Fills text into an input field.
+- Example: { "action": "fill", "element_id": 17, "text": "user@example.com", "intend": "Fill in the email input" }
+
+3. scroll
+- Scrolls the page.
+- Example: { "action": "scroll", "direction": "down", "pixels": 500, "intend": "Scroll down to find more content" }
+
+4. wait
+- Waits for a duration.
+- Example: { "action": "wait", "seconds": 3, "intend": "Wait for animations or content to load" }
+
+5. navigate
+- Navigates browser history.
+- Example: { "action": "navigate", "direction": "back", "intend": "Go back to the previous page" }
+
+6. goto
+- Navigates to a specific URL.
+- Example: { "action": "goto", "url": "https://example.com/login", "intend": "Open the login page" }
+
+7. press_enter
+- Sends Enter key to an input.
+- Example: { "action": "press_enter", "element_id": 19, "intend": "Submit the search form" }
+
+12. done
+- Signals task completion.
+- Example: { "action": "done", "intend": "The requested task was successfully completed" }
+
+---
+✅ IMPORTANT RULE:
+
+**Always use the `element_id` field from the DOM (in `page_data`) to refer to elements.**
+Each element has a unique `element_id` corresponding to an internal CSS selector. Do not try to guess or generate selectors yourself.
+
+When acting on a specific element:
+- Find the right element based on visible text, tag, or attributes.
+- Use its `element_id` when returning any action.
+
+If you cannot find a matching element:
+- Respond with "element not found" and do not run any action.
+
+---
+📌 DOM Matching Requirements:
+
+- Use only `element_id` values from `page_data`.
+- If the snapshot is one element per line, the `element_id` is the number in brackets at the start of the line, e.g. `[12]`.
+- Never guess or invent any selectors.
+- Each `element_id` corresponds internally to a real `_selector`.
+
+---
+🧠 Contextual Knowledge (Use When Relevant):
+
+- Try to avoid sending multiple actions as much as possible.. ONLY and ONLY use it for filling up inputs and pressing submit.
+
+---
+🔁 DOM Changes:
+
+After your actions the user may send only the DOM changes since the last snapshot you saw, with the results of those actions.
+Every `element_id` you already know still refers to the same element unless it is listed as removed.
+- "added": a new element subtree under `parent_id`, at position `index` among its children.
+- "removed": the element and its subtree are gone.
+- "changed": the element now has these `attrs` and `text`.
+- "reordered": the element's children are now in the order of `children` (element_ids).
+- "context": the parents of the changed elements, for orientation.
+
+---
+Before you respond:
+2. Only return new actions if they are clearly needed
+3. Otherwise, return:
+{ "action": "done", "intend": "All steps from the user request were already completed" }
+
+Histories are given one JSON entry per line, latest last.
+
+⛔ Do NOT wrap your output in markdown. Return a raw JSON **list** of action objects."""
+
+CLOSING = "Now return the next action(s) to perform."
+
+
+class HistoryRenderer:
+    """Serializes history entries as JSON lines, each entry only once.
+
+    Entries are cached by identity, so an entry must not change after it has been
+    rendered (command_history entries never do). A growing history therefore costs
+    one json.dumps per new entry, and its text only ever grows at the end, keeping
+    the earlier part of the prompt byte-identical for the provider's prefix cache.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.cache = {}
+
+    def line(self, entry) -> str:
+        cached = self.cache.get(id(entry))
+        if cached is not None and cached[0] is entry:
+            return cached[1]
+        if len(self.cache) >= self.max_entries:
+            self.cache = {}
+        text = json.dumps(entry, ensure_ascii=False)
+        # The entry is kept alive with its text so its id can't be reused meanwhile
+        self.cache[id(entry)] = (entry, text)
+        return text
+
+    def render(self, entries: list) -> str:
+        return "\n".join(self.line(entry) for entry in entries) or "(none)"
+
+
+class PromptBuilder:
+    """Builds the per-step user message; the invariant instructions are SYSTEM_PROMPT.
+
+    Sections go from the most to the least stable (request, earlier requests, command
+    history, URL, DOM), so consecutive prompts of a task share the longest possible
+    prefix.
+    """
+
+    def __init__(self):
+        self.history = HistoryRenderer()
+
+    def build(self, prompt_history: list, command_history: list, url: str, page_data: str, user_request: str = "") -> str:
+        return "\n\n".join((
+            f"🧑‍💻 User's Request:\n{user_request}",
+            f"📓 Previous User Prompts:\n{self.history.render(prompt_history)}",
+            f"📜 Command History:\n{self.history.render(command_history)}",
+            f"🌐 Current Page URL:\n{url}",
+            f"🧩 DOM Snapshot:\n{page_data}",
+            CLOSING,
+        ))
+
+    def build_delta(self, new_commands: list, url: str, page_data: str) -> str:
+        return "\n\n".join((
+            f"📜 New Command Results:\n{self.history.render(new_commands)}",
+            f"🌐 Current Page URL:\n{url}",
+            f"🧩 DOM Changes:\n{page_data}",
+            CLOSING,
+        ))
+
+
+class UsageStats:
+    """Running totals of the prompt tokens the API reported, and how many were cached."""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, attrs: dict):
+        self.prompt_tokens += attrs.get("prompt_tokens") or 0
+        self.cached_tokens += attrs.get("cached_tokens") or 0
+        self.completion_tokens += attrs.get("completion_tokens") or 0
+
+    def as_dict(self) -> dict:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "uncached_tokens": self.prompt_tokens - self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+    def report(self) -> str:
+        share = self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0
+        return (
+            f"{self.prompt_tokens} prompt tokens, {self.cached_tokens} cached ({share:.0%}), "
+            f"{self.prompt_tokens - self.cached_tokens} uncached"
+        )
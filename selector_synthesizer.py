@@ -0,0 +1,145 @@
+import re
+
+from bs4 import Tag, NavigableString
+from bs4.element import PreformattedString
+
+
+# Attributes that can single an element out on their own, in order of preference
+ANCHOR_ATTRIBUTES = ("id", "data-testid", "name", "aria-label")
+
+# Elements usually told apart by their text, worth an XPath when no attribute is unique
+TEXT_TAGS = {"a", "button", "label", "option", "h1", "h2", "h3", "h4", "h5", "h6", "th", "li"}
+MAX_TEXT_LENGTH = 80
+# Text longer than this before whitespace is collapsed isn't considered at all
+MAX_RAW_TEXT_LENGTH = 10000
+
+# Structural steps below the nearest anchor before a unique text XPath is preferred
+MAX_CHAIN_DEPTH = 4
+
+
+def css_escape(value: str) -> str:
+    """Escapes `value` for use as a CSS identifier, like the browser's CSS.escape."""
+    out = []
+    for i, ch in enumerate(value):
+        code = ord(ch)
+        if code == 0:
+            out.append("\ufffd")
+        elif 0x1 <= code <= 0x1F or code == 0x7F:
+            out.append(f"\\{code:x} ")
+        elif (i == 0 or (i == 1 and value[0] == "-")) and ch.isdigit():
+            out.append(f"\\{code:x} ")
+        elif i == 0 and ch == "-" and len(value) == 1:
+            out.append("\\-")
+        elif code >= 0x80 or ch in "-_" or ch.isalnum():
+            out.append(ch)
+        else:
+            out.append("\\" + ch)
+    return "".join(out)
+
+
+def css_string(value: str) -> str:
+    """Quotes `value` as a CSS string, for attribute selectors."""
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+    return '"' + re.sub(r"[\n\r\f]", lambda m: f"\\{ord(m.group()):x} ", escaped) + '"'
+
+
+def xpath_literal(value: str) -> str:
+    # XPath 1.0 strings can't escape quotes, so mixed quotes need concat()
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    parts = value.split('"')
+    return "concat(" + ", '\"', ".join(f'"{part}"' for part in parts) + ")"
+
+
+def _attr(el: Tag, name: str):
+    value = el.attrs.get(name)
+    if isinstance(value, list):
+        value = " ".join(value)
+    return value or None
+
+
+def _anchor_key(el: Tag, name: str, value: str):
+    # Ids and test ids are matched on their own, the rest together with the tag
+    return (name, value) if name in ("id", "data-testid") else (el.name, name, value)
+
+
+def _normalize_space(text: str) -> str:
+    return " ".join(re.split(r"[ \t\r\n]+", text)).strip()
+
+
+class SelectorSynthesizer:
+    """Picks the shortest selector that matches exactly one element of a parsed page.
+
+    `index` counts the anchor attribute values (and the text of TEXT_TAGS elements)
+    over the whole document, so uniqueness is checked against the page itself rather
+    than the compacted tree. `anchor` returns a CSS selector for an element that has a
+    unique id, data-testid, name or aria-label. Elements without one are addressed
+    from their nearest anchored ancestor with nth-of-type steps (see DOMCompactor);
+    when that chain gets long, `text_xpath` gives a unique-text XPath instead.
+    Selectors starting with "/" are XPath, everything else is CSS.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.texts = {}
+
+    def index(self, document: Tag):
+        counts = {}
+        texts = {}
+        # String values are built bottom-up in one pass rather than with get_text per
+        # element, which would rescan every subtree once per text ancestor
+        raw = {}
+        for el in reversed(document.find_all(True)):
+            parts = []
+            for child in el.contents:
+                if isinstance(child, Tag):
+                    parts.append(raw.pop(id(child), None))
+                elif isinstance(child, NavigableString) and not isinstance(child, PreformattedString):
+                    parts.append(child)
+            text = None if None in parts else "".join(parts)
+            if text is not None and len(text) > MAX_RAW_TEXT_LENGTH:
+                text = None
+            raw[id(el)] = text
+
+            attrs = el.attrs
+            for name in ANCHOR_ATTRIBUTES:
+                if name in attrs:
+                    value = _attr(el, name)
+                    if value:
+                        key = _anchor_key(el, name, value)
+                        counts[key] = counts.get(key, 0) + 1
+            if el.name in TEXT_TAGS:
+                # Over-long text still counts, so it can't make a short one look unique
+                texts[id(el)] = _normalize_space(text) if text is not None else None
+                key = (el.name, "text", texts[id(el)])
+                counts[key] = counts.get(key, 0) + 1
+        self.counts = counts
+        self.texts = texts
+
+    def _unique(self, key) -> bool:
+        return self.counts.get(key) == 1
+
+    def anchor(self, el: Tag):
+        attrs = el.attrs
+        for name in ANCHOR_ATTRIBUTES:
+            if name not in attrs:
+                continue
+            value = _attr(el, name)
+            if not value or not self._unique(_anchor_key(el, name, value)):
+                continue
+            if name == "id":
+                return "#" + css_escape(value)
+            if name == "data-testid":
+                return f"[data-testid={css_string(value)}]"
+            return f"{el.name}[{name}={css_string(value)}]"
+        return None
+
+    def text_xpath(self, el: Tag):
+        if el.name not in TEXT_TAGS:
+            return None
+        text = self.texts.get(id(el))
+        if not text or len(text) > MAX_TEXT_LENGTH or not self._unique((el.name, "text", text)):
+            return None
+        return f"//{el.name}[normalize-space()={xpath_literal(text)}]"
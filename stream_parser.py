@@ -0,0 +1,68 @@
+import json
+
+
+class ActionStreamParser:
+    """Incrementally parses a streamed LLM response into action objects.
+
+    Accepts either a JSON list of actions or a single action object, optionally
+    wrapped in a markdown fence. Each action is returned by `feed` as soon as its
+    closing brace arrives, so it can be executed while the rest is still streaming.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.actions = []
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_depth = None  # Depth at which action objects open: 0 for a bare object, 1 inside a list
+        self._start = None
+
+    def feed(self, chunk: str) -> list:
+        self.text += chunk
+        completed = []
+
+        for i in range(self._pos, len(self.text)):
+            char = self.text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"' and self._depth > 0:
+                self._in_string = True
+            elif char in "[{":
+                if self._object_depth is None:
+                    self._object_depth = 0 if char == "{" else 1
+                if char == "{" and self._depth == self._object_depth:
+                    self._start = i
+                self._depth += 1
+            elif char in "]}" and self._depth > 0:
+                self._depth -= 1
+                if char == "}" and self._depth == self._object_depth and self._start is not None:
+                    try:
+                        action = json.loads(self.text[self._start:i + 1])
+                    except json.JSONDecodeError:
+                        action = None
+                    if isinstance(action, dict):
+                        completed.append(action)
+                    self._start = None
+
+        self._pos = len(self.text)
+        self.actions.extend(completed)
+        return completed
+
+    def iter_actions(self, chunks):
+        """Yields actions from an iterable of text chunks as they complete."""
+        for chunk in chunks:
+            yield from self.feed(chunk)
+
+    def close(self):
+        """Raises json.JSONDecodeError if the full response was not valid JSON."""
+        json.loads(self.text.strip().replace("```json", "").replace("```", ""))
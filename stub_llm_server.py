@@ -0,0 +1,142 @@
+import http.server
+import json
+import os
+import threading
+import time
+
+
+class StubLLMServer:
+    """Local OpenAI-compatible chat completions server that replays scripted responses.
+
+    Responses are returned in order (the last one repeats), or `responses` is a
+    callable that builds each one from the request body. They are generated at a fixed
+    pace: `first_token_delay` seconds before the first chunk, then `chunk_size`
+    characters every `chunk_delay` seconds, both for streamed and plain requests.
+    Every request body is kept in `requests` for inspection. Reported usage includes
+    cached tokens for the prefix shared with the previous request.
+
+        with StubLLMServer(['[{"action": "done"}]']) as server:
+            client = OpenAI(api_key="stub", base_url=server.base_url)
+    """
+
+    def __init__(self, responses, first_token_delay: float = 0.2, chunk_delay: float = 0.02, chunk_size: int = 4):
+        self.responses = responses if callable(responses) else list(responses)
+        self.first_token_delay = first_token_delay
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.requests = []
+        self._lock = threading.Lock()
+        self._previous_prompt = ""
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/v1"
+
+    def next_response(self, body: dict) -> str:
+        with self._lock:
+            self.requests.append(body)
+            if callable(self.responses):
+                return self.responses(body)
+            index = min(len(self.requests), len(self.responses)) - 1
+            return self.responses[index]
+
+    def chunks(self, text: str):
+        time.sleep(self.first_token_delay)
+        for i in range(0, len(text), self.chunk_size):
+            if i:
+                time.sleep(self.chunk_delay)
+            yield text[i:i + self.chunk_size]
+
+    def usage(self, body: dict, text: str) -> dict:
+        # Rough token counts, ~4 characters per token
+        prompt = "".join(str(message.get("content", "")) for message in body.get("messages", []))
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(text) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": self.cached_tokens(prompt)},
+        }
+
+    def cached_tokens(self, prompt: str) -> int:
+        # Like provider prefix caching: the prefix shared with the previous request, in
+        # 128-token blocks, once it reaches 1024 tokens
+        with self._lock:
+            previous, self._previous_prompt = self._previous_prompt, prompt
+        shared = len(os.path.commonprefix([previous, prompt])) // 4
+        return shared // 128 * 128 if shared >= 1024 else 0
+
+    def start(self):
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                text = stub.next_response(body)
+                model = body.get("model", "stub")
+                created = int(time.time())
+
+                if not body.get("stream"):
+                    content = "".join(stub.chunks(text))
+                    payload = json.dumps({
+                        "id": "chatcmpl-stub",
+                        "object": "chat.completion",
+                        "created": created,
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }],
+                        "usage": stub.usage(body, text),
+                    }).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+
+                def send(chunk: dict):
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+
+                base = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model}
+                for piece in stub.chunks(text):
+                    send({**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+                send({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": stub.usage(body, text)})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,71 @@
+class TabManager:
+    """Shares one browser between several task contexts, each working in its own tabs.
+
+    A context is an LLMCommandParser, which already keeps the per-task state
+    (selector_map, element cache, snapshot identity and diff). The manager records
+    which window handles each context owns and switches the driver to a context's
+    tab before its browser calls run (see `activate`). WebDriver is not thread-safe
+    and has one current window, so every call on a shared browser must go through
+    one thread; contexts then interleave between calls, e.g. one snapshots its page
+    while another waits on the LLM.
+
+    Handles nobody owns were opened by a page (target=_blank, window.open). A context
+    reserves one right after its own action, in the same browser call, so no other
+    context can see it first, and adopts it when it settles.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.owners = {}
+        self.active = driver.current_window_handle
+
+    def claim(self, agent, handle: str = None):
+        """Makes `handle` (by default the current tab) the active tab of `agent`."""
+        handle = handle or self.driver.current_window_handle
+        self.owners[handle] = agent
+        agent.tabs = self
+        agent.tab = handle
+        self.active = handle
+
+    def open(self, factory):
+        """Opens a new tab and returns the context `factory(driver)` builds in it."""
+        self.driver.switch_to.new_window("tab")
+        handle = self.driver.current_window_handle
+        self.active = handle
+        agent = factory(self.driver)
+        self.claim(agent, handle)
+        return agent
+
+    def activate(self, agent):
+        if agent.tab != self.active:
+            self.driver.switch_to.window(agent.tab)
+            self.active = agent.tab
+
+    def switch(self, agent, handle: str):
+        self.driver.switch_to.window(handle)
+        self.claim(agent, handle)
+
+    def owned(self, agent, handles: list) -> list:
+        """The tabs `agent` may switch to: its own and those nobody owns, in tab order."""
+        return [handle for handle in handles if self.owners.get(handle, agent) is agent]
+
+    def opened(self, handles: list):
+        # A tab opened by a page that no context has reserved yet
+        return next((handle for handle in handles if handle not in self.owners), None)
+
+    def reserve(self, agent, handle: str):
+        """Gives `agent` a tab its action opened, without switching to it."""
+        self.owners[handle] = agent
+
+    def close(self, agent, handle: str):
+        self.owners.pop(handle, None)
+        self.driver.switch_to.window(handle)
+        self.driver.close()
+        self.active = None
+
+    def release(self, agent):
+        """Closes the tabs of `agent`, keeping the browser's last tab open."""
+        for handle in [handle for handle, owner in self.owners.items() if owner is agent]:
+            if len(self.owners) == 1:
+                break
+            self.close(agent, handle)
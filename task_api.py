@@ -0,0 +1,164 @@
+import http.server
+import json
+import threading
+from queue import Full
+from urllib.parse import unquote, urlsplit
+
+from command_handler import handleCommands
+
+
+def _public(record: dict) -> dict:
+    return {k: v for k, v in record.items() if k != "events"} | {"steps_done": len(record["events"])}
+
+
+class TaskAPI:
+    """Local HTTP/JSON front end of handleCommands, for submitting tasks from other services.
+
+        POST /tasks            {"task", "priority"?, "replay"?, "id"?} -> 202 with the task record,
+                               429 when max_pending tasks are already waiting
+        GET  /tasks/<id>       status, and once finished the result with its command_history;
+                               <id> is percent-encoded, so any string id can be looked up
+        GET  /tasks/<id>/events  step progress as JSON lines, streamed until the task finishes;
+                               the last line is the final result
+        GET  /status           queued/running counts and worker capacity
+        POST /exit             lets the queued tasks finish, then stops the workers
+    """
+
+    def __init__(self, commands: handleCommands, host: str = "127.0.0.1", port: int = 8765, poll_timeout: float = 15):
+        self.commands = commands
+        self.host = host
+        self.port = port
+        # Idle event streams send a blank keep-alive line this often
+        self.poll_timeout = poll_timeout
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self._server.server_port}"
+
+    def start(self):
+        api = self
+        commands = self.commands
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status: int, payload: dict, headers: dict = None):
+                body = json.dumps(payload, ensure_ascii=False, default=str).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def record(self, task_id: str):
+                # Ids from the prompt are ints, ids from clients may be any string
+                with commands.changed:
+                    record = commands.tasks.get(task_id)
+                    if record is None and task_id.isdigit():
+                        record = commands.tasks.get(int(task_id))
+                    return record
+
+            def do_POST(self):
+                if self.path == "/exit":
+                    commands.request_exit()
+                    self.send_json(202, {"status": "exiting"})
+                    return
+                if self.path != "/tasks":
+                    self.send_json(404, {"error": "Not found"})
+                    return
+
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                    task = body["task"]
+                    if not isinstance(task, str) or not task.strip():
+                        raise ValueError("task must be a non-empty string")
+                    priority = int(body.get("priority", 0))
+                    # Ids key the task records, so only plain strings and numbers will do
+                    task_id = body.get("id")
+                    if task_id is not None and (not isinstance(task_id, (str, int)) or isinstance(task_id, bool)):
+                        raise TypeError("id must be a string or an integer")
+                except (ValueError, KeyError, TypeError) as e:
+                    self.send_json(400, {"error": f"Invalid task: {e}"})
+                    return
+                if commands.exit:
+                    self.send_json(503, {"error": "Shutting down"})
+                    return
+
+                try:
+                    record = commands.submit(task.strip(), priority, bool(body.get("replay", False)), task_id)
+                except Full as e:
+                    self.send_json(429, {"error": f"Too many queued tasks: {e}"}, {"Retry-After": "5"})
+                    return
+                except KeyError as e:
+                    self.send_json(409, {"error": str(e.args[0])})
+                    return
+                with commands.changed:
+                    payload = _public(record)
+                self.send_json(202, payload)
+
+            def do_GET(self):
+                if self.path == "/status":
+                    self.send_json(200, commands.stats())
+                    return
+
+                # Split before decoding, so an id can hold an encoded "/"
+                parts = [unquote(part) for part in urlsplit(self.path).path.strip("/").split("/")]
+                if len(parts) < 2 or parts[0] != "tasks" or len(parts) > 3 or (len(parts) == 3 and parts[2] != "events"):
+                    self.send_json(404, {"error": "Not found"})
+                    return
+                record = self.record(parts[1])
+                if record is None:
+                    self.send_json(404, {"error": f"Unknown task {parts[1]}"})
+                    return
+
+                if len(parts) == 2:
+                    with commands.changed:
+                        payload = _public(record)
+                    self.send_json(200, payload)
+                    return
+                self.stream_events(record)
+
+            def stream_events(self, record: dict):
+                # Close-delimited stream, one JSON object per line
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                sent = 0
+                while True:
+                    with commands.changed:
+                        if sent == len(record["events"]) and record["result"] is None:
+                            commands.changed.wait(api.poll_timeout)
+                        events = record["events"][sent:]
+                        result = record["result"]
+                    sent += len(events)
+                    try:
+                        lines = [json.dumps({"event": "step", **event}, default=str) for event in events]
+                        if result is not None:
+                            lines.append(json.dumps({"event": "result", **result}, default=str))
+                        self.wfile.write(("\n".join(lines) + "\n").encode())
+                        self.wfile.flush()
+                    except (BrokenPipeError, ConnectionResetError):
+                        return
+                    if result is not None:
+                        return
+
+        self._server = http.server.ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        commands.serving = True
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+
+# Describes an element by the attributes that survive re-renders, used as its locator
+DESCRIBE_SCRIPT = """
+const el = arguments[0];
+const attrs = {};
+for (const name of ["id", "data-testid", "name", "aria-label", "placeholder", "type", "href", "role"]) {
+    const value = el.getAttribute(name);
+    if (value) attrs[name] = value;
+}
+// A password field's value is never part of its locator
+const secret = el.tagName === "INPUT" && el.type === "password";
+return {
+    tag: el.tagName.toLowerCase(),
+    attrs: attrs,
+    text: secret ? "" : (el.innerText || el.value || "").trim().replace(/\\s+/g, " ").slice(0, 80)
+};
+"""
+
+# Resolves a locator to the first visible matching element; returns null if none matches
+RESOLVE_SCRIPT = """
+const locator = arguments[0];
+const attrs = locator.attrs || {};
+let candidates = [];
+for (const name of ["id", "data-testid", "name", "aria-label", "placeholder"]) {
+    if (attrs[name]) {
+        candidates = Array.from(document.querySelectorAll(
+            locator.tag + "[" + name + "=\\"" + CSS.escape(attrs[name]) + "\\"]"
+        ));
+        if (candidates.length) break;
+    }
+}
+if (!candidates.length && locator.text) {
+    candidates = Array.from(document.getElementsByTagName(locator.tag)).filter(
+        el => (el.innerText || el.value || "").trim().replace(/\\s+/g, " ").slice(0, 80) === locator.text
+    );
+}
+if (!candidates.length && attrs.href) {
+    candidates = Array.from(document.querySelectorAll(locator.tag + "[href=\\"" + CSS.escape(attrs.href) + "\\"]"));
+}
+const visible = candidates.filter(el => el.getClientRects().length > 0);
+return visible[0] || candidates[0] || null;
+"""
+
+ELEMENT_ACTIONS = {"click", "fill", "extract", "press_enter"}
+
+
+def _is_secret(locator: dict) -> bool:
+    """Whether the element is a password field, whose fill text must not be saved."""
+    return (locator.get("attrs") or {}).get("type", "").lower() == "password"
+
+
+def script_path(replay_dir: str, task: str) -> str:
+    normalized = " ".join(task.lower().split())
+    slug = re.sub(r"[^a-z0-9]+", "-", normalized).strip("-")[:50]
+    digest = hashlib.sha256(normalized.encode()).hexdigest()[:10]
+    return os.path.join(replay_dir, f"{slug}-{digest}.json")
+
+
+def compile_script(task: str, start_url: str, command_history: list) -> dict:
+    """Turns a successful command_history into a replay script.
+
+    Element actions keep their recorded locator instead of the element_id, which is
+    only meaningful for the snapshot it came from. Failed and skipped commands are
+    left out, and so is the text filled into password fields: scripts are plain JSON
+    files, and replay hands such a step over to the LLM.
+    """
+    steps = []
+    for entry in command_history:
+        result = str(entry.get("result", "")).lower()
+        if "error occurred" in result or result.startswith("skipped"):
+            continue
+
+        command = {k: v for k, v in entry["command"].items() if k != "element_id"}
+        if entry["command"].get("action") in ELEMENT_ACTIONS:
+            if not entry.get("locator"):
+                continue
+            command["locator"] = entry["locator"]
+            if command["action"] == "fill" and _is_secret(entry["locator"]):
+                command.pop("text", None)
+        steps.append(command)
+
+    return {"task": task, "start_url": start_url, "created": time.time(), "steps": steps}
+
+
+def save_script(replay_dir: str, script: dict) -> str:
+    os.makedirs(replay_dir, exist_ok=True)
+    path = script_path(replay_dir, script["task"])
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(script, f, indent=2)
+    return path
+
+
+def load_script(replay_dir: str, task: str):
+    path = script_path(replay_dir, task)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
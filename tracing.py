@@ -0,0 +1,225 @@
+import contextvars
+import json
+import math
+import os
+import sys
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+
+SERVICE_NAME = "browser-automation-llm"
+
+# The span new spans are parented to; contextvars keep this per thread and per asyncio task
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Span:
+    def __init__(self, tracer, name: str, attrs: dict, activate: bool = True):
+        parent = _current.get()
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.trace_id = parent.trace_id if parent else _new_id(16)
+        self.span_id = _new_id(8)
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self._started = time.perf_counter()
+        # An inactive span is not the parent of spans started while it is open
+        self._token = _current.set(self) if activate else None
+        self.ended = False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self):
+        if self.ended:
+            return
+        self.ended = True
+        duration_ms = (time.perf_counter() - self._started) * 1000
+        if self._token is not None:
+            try:
+                _current.reset(self._token)
+            except ValueError:
+                # Ended from another context than it was started in
+                _current.set(None)
+        self.tracer.export({
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(duration_ms, 3),
+            "attrs": self.attrs,
+            "pid": os.getpid(),
+        })
+
+
+class Tracer:
+    """Times named phases as nested spans and exports them once they end.
+
+    Spans are appended to the JSONL file at `path` and, with `collector`, posted in
+    batches of `batch_size` to an OpenTelemetry collector's OTLP/HTTP endpoint (e.g.
+    http://localhost:4318). With neither set, spans are not recorded at all.
+    """
+
+    def __init__(self, path: str = "", collector: str = "", batch_size: int = 50):
+        self.path = path
+        self.collector = collector.rstrip("/")
+        self.batch_size = batch_size
+        self.pending = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path or self.collector)
+
+    def start_span(self, name: str, activate: bool = True, **attrs):
+        return Span(self, name, attrs, activate) if self.enabled else None
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        span = self.start_span(name, **attrs)
+        try:
+            yield span
+        finally:
+            if span is not None:
+                span.end()
+
+    def export(self, record: dict):
+        with self._lock:
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, default=str) + "\n")
+            if self.collector:
+                self.pending.append(record)
+                if len(self.pending) >= self.batch_size:
+                    self._post()
+
+    def flush(self):
+        with self._lock:
+            if self.collector and self.pending:
+                self._post()
+
+    def _post(self):
+        spans = []
+        for record in self.pending:
+            end = record["start"] + record["duration_ms"] / 1000
+            span = {
+                "traceId": record["trace_id"],
+                "spanId": record["span_id"],
+                "name": record["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(int(record["start"] * 1e9)),
+                "endTimeUnixNano": str(int(end * 1e9)),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in record["attrs"].items()],
+            }
+            if record["parent_id"]:
+                span["parentSpanId"] = record["parent_id"]
+            spans.append(span)
+        self.pending = []
+
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+            }]
+        }
+        request = urllib.request.Request(
+            f"{self.collector}/v1/traces",
+            data=json.dumps(body).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            urllib.request.urlopen(request, timeout=2).close()
+        except Exception as e:
+            # Tracing must never break a task
+            print(f"⚠️ Could not export spans to {self.collector}: {type(e).__name__}", file=sys.stderr)
+
+
+tracer = Tracer()
+
+
+def configure(path: str = "", collector: str = ""):
+    tracer.path = path
+    tracer.collector = collector.rstrip("/")
+
+
+def span(name: str, **attrs):
+    return tracer.span(name, **attrs)
+
+
+def start_span(name: str, activate: bool = True, **attrs):
+    return tracer.start_span(name, activate, **attrs)
+
+
+def percentile(values: list, percent: float) -> float:
+    # Nearest-rank percentile on a sorted list
+    index = max(0, math.ceil(percent / 100 * len(values)) - 1)
+    return values[index]
+
+
+def summarize(path: str) -> dict:
+    """Per span name: count, p50/p95/max in milliseconds and token totals of LLM spans."""
+    durations = {}
+    tokens = {}
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            # Routed LLM calls are reported per model tier, e.g. llm[fast]
+            name = record["name"]
+            if record["attrs"].get("tier"):
+                name = f"{name}[{record['attrs']['tier']}]"
+            durations.setdefault(name, []).append(record["duration_ms"])
+            for key in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                if key in record["attrs"]:
+                    tokens.setdefault(name, {}).setdefault(key, 0)
+                    tokens[name][key] += record["attrs"][key] or 0
+
+    summary = {}
+    for name, values in durations.items():
+        values.sort()
+        summary[name] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50), 1),
+            "p95_ms": round(percentile(values, 95), 1),
+            "max_ms": round(values[-1], 1),
+            **tokens.get(name, {}),
+        }
+    return summary
+
+
+def print_report(path: str):
+    summary = summarize(path)
+    if not summary:
+        print(f"No spans recorded in {path or '(tracing is off, set trace_file)'}")
+        return
+
+    print(f"{'phase':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}  tokens")
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]["p50_ms"] * item[1]["count"]):
+        token_info = ", ".join(f"{k}={stats[k]}" for k in ("prompt_tokens", "completion_tokens", "cached_tokens") if k in stats)
+        print(f"{name:<24}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['max_ms']:>10}  {token_info}")
+
+
+if __name__ == "__main__":
+    print_report(sys.argv[1] if len(sys.argv) > 1 else "traces.jsonl")